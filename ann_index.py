@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 近似最近傍インデックス（IVF / HNSW / SQ8 / PQ）
+学習済みの faiss_index_ip.faiss（IndexFlatIP）から近似インデックスを構築する
+"""
+
+import os
+import sys
+import math
+import argparse
+import logging
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 対応するインデックス種別
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'sq8', 'pq')
+
+# 量子化で圧縮するインデックス種別（検索後にfloatベクトルで再ランキングする）
+COMPRESSED_INDEX_TYPES = ('sq8', 'pq')
+
+
+def ann_index_path(flat_index_path: str, index_type: str) -> str:
+    """
+    フラットインデックスのパスから近似インデックスの保存先を決める
+
+    例: 学習結果/faiss_index_ip.faiss -> 学習結果/faiss_index_ivf.faiss
+    """
+    if index_type == 'flat':
+        return flat_index_path
+    directory = os.path.dirname(flat_index_path)
+    return os.path.join(directory, f"faiss_index_{index_type}.faiss")
+
+
+def default_nlist(ntotal: int) -> int:
+    """
+    IVFのクラスタ数の既定値
+
+    目安の 4*sqrt(N) を、クラスタあたり39点以上の学習データが確保できる数で頭打ちにする
+    """
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+
+def load_flat_vectors(flat_index_path: str) -> np.ndarray:
+    """フラットインデックスから全ベクトルを取り出す"""
+    index = faiss.read_index(flat_index_path)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_ann_index(vectors: np.ndarray, index_type: str,
+                    nlist: Optional[int] = None, hnsw_m: int = 32,
+                    ef_construction: int = 200, pq_m: Optional[int] = None,
+                    pq_nbits: int = 8) -> faiss.Index:
+    """
+    内積（正規化済みベクトルのコサイン類似度）の近似インデックスを構築
+
+    Args:
+        vectors: (件数, 次元) のfloat32行列
+        index_type: 'ivf' / 'hnsw' / 'sq8' / 'pq'
+        nlist: IVFのクラスタ数（Noneの場合は default_nlist）
+        hnsw_m: HNSWの各ノードの接続数
+        ef_construction: HNSW構築時の探索幅
+        pq_m: PQのサブ量子化器の数（次元数を割り切れる値。Noneの場合は8次元ごと）
+        pq_nbits: PQの各サブ量子化器のビット数
+
+    Returns:
+        構築済みのfaissインデックス
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    d = vectors.shape[1]
+
+    if index_type == 'ivf':
+        nlist = nlist or default_nlist(len(vectors))
+        quantizer = faiss.IndexFlatIP(d)
+        index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        logger.info(f"IVFインデックスを構築しました: nlist={nlist}, {index.ntotal}ベクトル")
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.add(vectors)
+        logger.info(f"HNSWインデックスを構築しました: M={hnsw_m}, {index.ntotal}ベクトル")
+    elif index_type == 'sq8':
+        # 各次元をint8に量子化（float32の1/4のサイズ）
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        logger.info(f"SQ8インデックスを構築しました: {index.ntotal}ベクトル")
+    elif index_type == 'pq':
+        pq_m = pq_m or d // 8
+        if d % pq_m != 0:
+            raise ValueError(f"PQのサブ量子化器数は次元数を割り切る必要があります: d={d}, m={pq_m}")
+        index = faiss.IndexPQ(d, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        logger.info(f"PQインデックスを構築しました: m={pq_m}, nbits={pq_nbits}, {index.ntotal}ベクトル")
+    else:
+        raise ValueError(f"未対応のインデックス種別です: {index_type}")
+
+    return index
+
+
+def set_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """
+    検索時パラメータを設定（対応しないインデックスでは無視される）
+
+    Args:
+        nprobe: IVFで探索するクラスタ数
+        ef_search: HNSWの探索幅
+    """
+    if nprobe is not None and hasattr(index, 'nprobe'):
+        index.nprobe = nprobe
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+
+
+def rerank_exact(vectors: np.ndarray, query: np.ndarray, candidates: np.ndarray,
+                 k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    圧縮インデックスの候補をfloatベクトルとの正確な内積で並べ替える
+
+    Args:
+        vectors: (件数, 次元) のfloatベクトル（mmapでも可、候補の行だけ読まれる）
+        query: (次元,) のクエリベクトル
+        candidates: 候補のID（-1は無視）
+        k: 返す件数
+
+    Returns:
+        (distances, indices) の1次元配列
+    """
+    candidates = candidates[candidates >= 0]
+    if len(candidates) == 0:
+        return np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+    # mmapから読む行をディスク上の順序に揃える
+    candidates = np.unique(candidates)
+    scores = np.asarray(vectors[candidates], dtype='float32') @ query
+    order = np.argsort(-scores)[:k]
+    return scores[order], candidates[order].astype('int64')
+
+
+def supports_id_selector(index) -> bool:
+    """
+    検索時のIDセレクタ（SearchParameters の sel）で絞り込めるか
+
+    IndexPQ はセレクタ付きの検索をエラーにするため、多めに取得してから絞り込む必要がある
+    """
+    return not isinstance(index, faiss.IndexPQ)
+
+
+def get_search_params(index) -> dict:
+    """現在の検索時パラメータを取得"""
+    params = {}
+    if hasattr(index, 'nprobe'):
+        params['nprobe'] = int(index.nprobe)
+    if hasattr(index, 'hnsw'):
+        params['efSearch'] = int(index.hnsw.efSearch)
+    return params
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='フラットインデックスから近似インデックスを構築')
+    parser.add_argument('--index', default=os.path.join(base_path, 'faiss_index_ip.faiss'))
+    parser.add_argument('--type', choices=[t for t in INDEX_TYPES if t != 'flat'], required=True)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-construction', type=int, default=200)
+    parser.add_argument('--pq-m', type=int, default=None)
+    parser.add_argument('--pq-nbits', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    vectors = load_flat_vectors(args.index)
+    index = build_ann_index(vectors, args.type, nlist=args.nlist, hnsw_m=args.hnsw_m,
+                            ef_construction=args.ef_construction, pq_m=args.pq_m,
+                            pq_nbits=args.pq_nbits)
+
+    output_path = ann_index_path(args.index, args.type)
+    faiss.write_index(index, output_path)
+    print(f"✓ {args.type}インデックスを保存しました: {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 同時接続ベンチマーク
+同期版（gunicorn sync ワーカー + omae_app_faiss）と asyncio版（uvicorn + omae_app_async）を
+それぞれ1ワーカーで起動し、同時接続数ごとのスループット・レイテンシと、
+負荷中の /api/health の応答時間を比較する
+
+    python benchmark_concurrency.py --concurrency 1 4 16 --requests 64
+    python benchmark_concurrency.py --sync-url http://127.0.0.1:8000 --async-url http://127.0.0.1:8001
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_QUERIES = [
+    '戦略的思考とは何ですか？',
+    'サラリーマンが副業を始める際の注意点は？',
+    '日本企業の課題は何ですか？',
+    '3C分析について教えてください',
+    'What is the key to business success?',
+    'リーダーシップに必要なことは？',
+    '英語を学ぶべき理由は？',
+    '年金に頼らない老後の準備は？'
+]
+
+SERVER_COMMANDS = {
+    'sync': ['gunicorn', '--workers', '1', '--worker-class', 'sync', '--timeout', '300',
+             '--bind', '127.0.0.1:{port}', 'omae_app_faiss:app'],
+    'async': ['uvicorn', 'omae_app_async:app', '--host', '127.0.0.1', '--port', '{port}', '--workers', '1']
+}
+
+
+def _request(url: str, payload: Optional[Dict] = None, timeout: float = 300.0) -> int:
+    """HTTPリクエストを送ってステータスコードを返す（接続できない場合は0）"""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def start_server(kind: str, port: int, log_file) -> subprocess.Popen:
+    """同期版 / asyncio版のサーバーを起動"""
+    command = [part.format(port=port) for part in SERVER_COMMANDS[kind]]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(base_url: str, timeout: float) -> None:
+    """/api/ready が200を返すまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if _request(f"{base_url}/api/ready", timeout=5.0) == 200:
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"{base_url} が {timeout:.0f}秒以内に準備完了になりませんでした")
+
+
+def run_load(base_url: str, concurrency: int, n_requests: int, health_interval: float = 0.1) -> Dict:
+    """
+    同時接続数 concurrency で /api/chat に n_requests 件送り、並行して /api/health を定期的に呼ぶ
+
+    Returns:
+        スループット、チャットとヘルスチェックのレイテンシ（ミリ秒）、失敗件数
+    """
+    chat_latencies: List[float] = []
+    health_latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def send_chat(i: int) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        # クエリ埋め込みキャッシュに当たらないよう、毎回異なる質問にする
+        message = f"{SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]} ({concurrency}-{i})"
+        status = _request(f"{base_url}/api/chat", {'message': message})
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            chat_latencies.append(elapsed)
+            if status != 200:
+                errors += 1
+
+    def probe_health() -> None:
+        while not stop.is_set():
+            start = time.perf_counter()
+            _request(f"{base_url}/api/health", timeout=60.0)
+            health_latencies.append((time.perf_counter() - start) * 1000)
+            stop.wait(health_interval)
+
+    prober = threading.Thread(target=probe_health, daemon=True)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send_chat, range(n_requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+
+    chat = np.array(chat_latencies)
+    health = np.array(health_latencies) if health_latencies else np.zeros(1)
+    return {
+        'concurrency': concurrency,
+        'throughput_rps': n_requests / elapsed,
+        'chat_p50_ms': float(np.percentile(chat, 50)),
+        'chat_p95_ms': float(np.percentile(chat, 95)),
+        'health_p95_ms': float(np.percentile(health, 95)),
+        'health_max_ms': float(health.max()),
+        'errors': errors
+    }
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description='同期版とasyncio版の同時接続時の性能を比較')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=64, help='同時接続数ごとのリクエスト数')
+    parser.add_argument('--sync-url', default=None, help='起動済みの同期版のURL（省略時は起動する）')
+    parser.add_argument('--async-url', default=None, help='起動済みのasyncio版のURL（省略時は起動する）')
+    parser.add_argument('--port', type=int, default=8100, help='起動する場合の最初のポート')
+    parser.add_argument('--ready-timeout', type=float, default=600.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    targets = {'sync': args.sync_url, 'async': args.async_url}
+    processes = []
+    results = {}
+    try:
+        for offset, (kind, url) in enumerate(targets.items()):
+            if url is None:
+                log_path = os.path.join(tempfile.gettempdir(), f"benchmark_concurrency_{kind}.log")
+                log_file = open(log_path, 'w')
+                processes.append((start_server(kind, args.port + offset, log_file), log_file))
+                url = targets[kind] = f"http://127.0.0.1:{args.port + offset}"
+                print(f"{kind}版を起動しました: {url}（ログ: {log_path}）")
+            wait_until_ready(url, args.ready_timeout)
+
+        for kind, url in targets.items():
+            _request(f"{url}/api/chat", {'message': SAMPLE_QUERIES[0]})  # ウォームアップ
+            results[kind] = [run_load(url, concurrency, args.requests) for concurrency in args.concurrency]
+    finally:
+        for process, log_file in processes:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log_file.close()
+
+    print(f"{'server':<8}{'conc':>6}{'req/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}"
+          f"{'health95':>10}{'healthmax':>11}{'errors':>8}")
+    print("-" * 73)
+    for kind, rows in results.items():
+        for row in rows:
+            print(f"{kind:<8}{row['concurrency']:>6}{row['throughput_rps']:>10.1f}{row['chat_p50_ms']:>10.1f}"
+                  f"{row['chat_p95_ms']:>10.1f}{row['health_p95_ms']:>10.1f}{row['health_max_ms']:>11.1f}"
+                  f"{row['errors']:>8}")
+
+    if any(row['errors'] for rows in results.values() for row in rows):
+        print("✗ 失敗したリクエストがありました（asyncio版の503は OMAE_EXECUTOR_QUEUE を超えた分です）")
+        return 1
+    print("✓ ベンチマーク完了")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
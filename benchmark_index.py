@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット インデックスベンチマーク
+IndexFlatIP（全探索）を正解として、近似・圧縮インデックスと次元削減インデックスの
+recall@k、検索レイテンシ、メモリ使用量を測定する
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import logging
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from ann_index import build_ann_index, load_flat_vectors, rerank_exact, set_search_params
+from dim_reduction import REDUCTION_TYPES, build_reduced_index, make_projection
+
+logger = logging.getLogger(__name__)
+
+
+def load_queries(vectors: np.ndarray, queries_path: str = None, n_queries: int = 200,
+                 noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """
+    ベンチマーク用のクエリベクトルを用意
+
+    queries_path が指定され sentence_transformers が使える場合は実際の質問文を埋め込む。
+    それ以外はコーパスのベクトルにノイズを加えた合成クエリを使う。
+    """
+    if queries_path:
+        from sentence_transformers import SentenceTransformer
+        with open(queries_path, 'r', encoding='utf-8') as f:
+            queries = [f"query: {line.strip()}" for line in f if line.strip()]
+        model = SentenceTransformer('intfloat/multilingual-e5-base')
+        return np.ascontiguousarray(model.encode(queries, normalize_embeddings=True), dtype='float32')
+
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + rng.normal(scale=noise, size=(len(picks), vectors.shape[1]))
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(ground_truth: np.ndarray, predicted: np.ndarray, k: int) -> float:
+    """正解の上位k件のうち、予測の上位k件に含まれる割合の平均"""
+    hits = 0
+    for truth, pred in zip(ground_truth[:, :k], predicted[:, :k]):
+        hits += len(set(truth.tolist()) & set(pred.tolist()))
+    return hits / (len(ground_truth) * k)
+
+
+def measure(search, queries: np.ndarray, k: int) -> Dict:
+    """
+    1クエリずつ検索してレイテンシを測定（本番の /api/chat と同じ呼び出し方）
+
+    Args:
+        search: (queries, k) -> (distances, indices) を返す関数
+
+    Returns:
+        indices と p50/p95/平均レイテンシ（ミリ秒）
+    """
+    latencies = []
+    all_indices = []
+    for query in queries:
+        start = time.perf_counter()
+        _, indices = search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        all_indices.append(indices[0])
+    latencies = np.array(latencies)
+    return {
+        'indices': np.array(all_indices),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'mean_ms': float(latencies.mean())
+    }
+
+
+def index_memory_mb(index) -> float:
+    """インデックスのメモリ使用量（シリアライズ後のサイズで近似）"""
+    return faiss.serialize_index(index).nbytes / (1024 * 1024)
+
+
+def reranked_search(index, vectors: np.ndarray, rerank_factor: int):
+    """
+    圧縮インデックスで k * rerank_factor 件を取得し、floatベクトルで再ランキングする検索関数
+    （FAISSVectorStore._search_index と同じ処理）
+    """
+    def search(query: np.ndarray, k: int):
+        _, candidates = index.search(query, k * rerank_factor)
+        distances, indices = rerank_exact(vectors, query[0], candidates[0], k)
+        return distances.reshape(1, -1), indices.reshape(1, -1)
+    return search
+
+
+def run_benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 5,
+                  nprobes: List[int] = None, ef_searches: List[int] = None,
+                  rerank_factors: List[int] = None) -> List[Dict]:
+    """
+    フラット・IVF・HNSW・SQ8・PQの recall@k / レイテンシ / メモリを測定
+
+    Returns:
+        設定ごとの測定結果のリスト
+    """
+    nprobes = nprobes or [1, 2, 4, 8, 16, 32, 64]
+    ef_searches = ef_searches or [16, 32, 64, 128, 256]
+    rerank_factors = rerank_factors or [1, 2, 4, 8]
+
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    baseline = measure(flat.search, queries, k)
+    ground_truth = baseline['indices']
+
+    rows = [{'index': 'flat', 'param': '-', 'recall': 1.0, 'memory_mb': index_memory_mb(flat),
+             **_latency(baseline)}]
+
+    ivf = build_ann_index(vectors, 'ivf')
+    for nprobe in nprobes:
+        if nprobe > ivf.nlist:
+            break
+        set_search_params(ivf, nprobe=nprobe)
+        result = measure(ivf.search, queries, k)
+        rows.append({'index': 'ivf', 'param': f"nprobe={nprobe}", 'memory_mb': index_memory_mb(ivf),
+                     'recall': recall_at_k(ground_truth, result['indices'], k), **_latency(result)})
+
+    hnsw = build_ann_index(vectors, 'hnsw')
+    for ef_search in ef_searches:
+        set_search_params(hnsw, ef_search=ef_search)
+        result = measure(hnsw.search, queries, k)
+        rows.append({'index': 'hnsw', 'param': f"efSearch={ef_search}", 'memory_mb': index_memory_mb(hnsw),
+                     'recall': recall_at_k(ground_truth, result['indices'], k), **_latency(result)})
+
+    # 圧縮インデックス: rerank=1 は圧縮後のスコアのみ、それ以上は候補を多めに取って再ランキング
+    # floatベクトルはmmapで参照するため、常駐メモリは圧縮インデックスの分のみ
+    for index_type in ('sq8', 'pq'):
+        compressed = build_ann_index(vectors, index_type)
+        memory_mb = index_memory_mb(compressed)
+        for rerank_factor in rerank_factors:
+            if rerank_factor == 1:
+                search = compressed.search
+            else:
+                search = reranked_search(compressed, vectors, rerank_factor)
+            result = measure(search, queries, k)
+            rows.append({'index': index_type, 'param': f"rerank={rerank_factor}", 'memory_mb': memory_mb,
+                         'recall': recall_at_k(ground_truth, result['indices'], k), **_latency(result)})
+
+    return rows
+
+
+def projected_search(index, projection):
+    """
+    クエリを射影してから次元削減インデックスを検索する関数
+    （FAISSVectorStore._search_index と同じく、射影の時間もレイテンシに含める）
+    """
+    def search(query: np.ndarray, k: int):
+        return index.search(projection.apply(query), k)
+    return search
+
+
+def run_dimension_benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 5,
+                            dims: List[int] = None) -> List[Dict]:
+    """
+    元の次元のフラットインデックスを正解として、PCA / 切り詰めで次元削減した
+    フラットインデックスの recall@k / レイテンシ / メモリを測定
+
+    Returns:
+        設定ごとの測定結果のリスト
+    """
+    dims = dims or [256, 128]
+
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    baseline = measure(flat.search, queries, k)
+    ground_truth = baseline['indices']
+
+    rows = [{'index': 'flat', 'param': f"d={vectors.shape[1]}", 'recall': 1.0,
+             'memory_mb': index_memory_mb(flat), **_latency(baseline)}]
+    for kind in REDUCTION_TYPES:
+        for dim in dims:
+            projection = make_projection(vectors, kind, dim)
+            index = build_reduced_index(vectors, projection)
+            result = measure(projected_search(index, projection), queries, k)
+            # 射影行列も常駐するためメモリに含める
+            memory_mb = index_memory_mb(index) + (projection.matrix.nbytes + projection.mean.nbytes) / (1024 * 1024)
+            rows.append({'index': kind, 'param': f"d={dim}", 'memory_mb': memory_mb,
+                         'recall': recall_at_k(ground_truth, result['indices'], k), **_latency(result)})
+    return rows
+
+
+def _latency(result: Dict) -> Dict:
+    """測定結果からレイテンシ項目だけを取り出す"""
+    return {key: result[key] for key in ('p50_ms', 'p95_ms', 'mean_ms')}
+
+
+def print_table(rows: List[Dict], k: int) -> None:
+    """測定結果を表形式で表示"""
+    print(f"{'index':<10}{'param':<16}{f'recall@{k}':>10}{'p50(ms)':>10}{'p95(ms)':>10}"
+          f"{'mean(ms)':>10}{'mem(MB)':>10}")
+    print("-" * 76)
+    for row in rows:
+        print(f"{row['index']:<10}{row['param']:<16}{row['recall']:>10.3f}"
+              f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['mean_ms']:>10.3f}{row['memory_mb']:>10.2f}")
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='近似・圧縮インデックスの recall@k とレイテンシを測定')
+    parser.add_argument('--index', default=os.path.join(base_path, 'faiss_index_ip.faiss'))
+    parser.add_argument('--queries', default=None, help='質問文を1行ずつ書いたファイル（省略時は合成クエリ）')
+    parser.add_argument('--n-queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    parser.add_argument('--reduced', action='store_true',
+                        help='近似インデックスの代わりに次元削減（PCA / 切り詰め）を比較')
+    parser.add_argument('--dims', type=int, nargs='+', default=[256, 128], help='--reduced で比較する次元')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    vectors = load_flat_vectors(args.index)
+    queries = load_queries(vectors, args.queries, args.n_queries)
+
+    print(f"ベクトル数: {len(vectors)}, 次元: {vectors.shape[1]}, クエリ数: {len(queries)}")
+    if args.reduced:
+        rows = run_dimension_benchmark(vectors, queries, k=args.k, dims=args.dims)
+    else:
+        rows = run_benchmark(vectors, queries, k=args.k)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print_table(rows, args.k)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
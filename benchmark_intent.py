@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 意図判定ベンチマーク
+従来のキーワードの if/elif（キーワードごとに message.lower() を走査）と、
+Aho-Corasick による1回の走査（intent_matcher.py）の結果の一致と1メッセージあたりの時間を比較する
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+from typing import Dict, List
+
+from intent_matcher import FOLLOWUP_PATTERNS, REACTION_PATTERNS, TOPIC_RULES, IntentMatcher
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_analyze_question_intent(message: str) -> Dict[str, str]:
+    """置き換え前の ChatBot.analyze_question_intent（比較用にそのまま残す）"""
+    intent = {
+        'topic': 'general',
+        'emotion': 'neutral',
+        'specificity': 'general'
+    }
+
+    if any(word in message.lower() for word in ['怖い', '恐い', '恐怖', 'fear', 'scared', 'afraid']):
+        intent['topic'] = 'fear_overcoming'
+        intent['emotion'] = 'concern'
+    elif any(word in message.lower() for word in ['失敗', '挫折', '困難', 'failure', 'difficulty', 'challenge']):
+        intent['topic'] = 'failure_overcoming'
+        intent['emotion'] = 'struggle'
+    elif any(word in message.lower() for word in ['成功', '達成', '勝利', 'success', 'achievement', 'victory']):
+        intent['topic'] = 'success'
+        intent['emotion'] = 'positive'
+    elif any(word in message.lower() for word in ['経営', '戦略', 'ビジネス', 'business', 'strategy', 'management']):
+        intent['topic'] = 'business_strategy'
+    elif any(word in message.lower() for word in ['リーダー', '指導', 'leadership', 'leader']):
+        intent['topic'] = 'leadership'
+    elif any(word in message.lower() for word in ['グローバル', '国際', 'global', 'international']):
+        intent['topic'] = 'global_strategy'
+    elif any(word in message.lower() for word in ['デジタル', '技術', 'digital', 'technology']):
+        intent['topic'] = 'digital_transformation'
+    elif any(word in message.lower() for word in ['50', 'fifty', 'age', 'older', 'survive', 'future', '2030', '2030s']):
+        intent['topic'] = 'future_survival'
+    elif any(word in message.lower() for word in ['yamaha', 'ヤマハ', 'motorcycle', '楽器']):
+        intent['topic'] = 'yamaha_experience'
+    elif any(word in message.lower() for word in ['hitachi', '日立', 'nuclear', '原発', '原子力']):
+        intent['topic'] = 'hitachi_experience'
+    elif any(word in message.lower() for word in ['panasonic', 'パナソニック', '松下']):
+        intent['topic'] = 'panasonic_experience'
+    elif any(word in message.lower() for word in ['それ', 'これ', 'that', 'this']) and any(word in message.lower() for word in ['日本語', 'japanese']):
+        intent['topic'] = 'repeat_in_japanese'
+
+    return intent
+
+
+def legacy_context_intent(message: str) -> str:
+    """置き換え前の ChatBot._analyze_context_intent のパターン照合部分"""
+    for pattern in FOLLOWUP_PATTERNS:
+        if pattern in message.lower():
+            return 'followup_question'
+    for pattern in REACTION_PATTERNS:
+        if pattern in message.lower():
+            return 'reaction'
+    return 'new_topic'
+
+
+def make_messages(n_messages: int, texts_path: str = None, seed: int = 0) -> List[str]:
+    """
+    キーワードの組み合わせと、学習結果のチャンクの断片からメッセージを作成
+
+    キーワード同士の優先順位（複数のトピックに一致するメッセージ）も確認できるよう、
+    0〜3個のキーワードを文中に混ぜる
+    """
+    rng = random.Random(seed)
+    keywords = [keyword for _, _, groups in TOPIC_RULES for keywords in groups for keyword in keywords]
+    keywords += list(FOLLOWUP_PATTERNS) + list(REACTION_PATTERNS)
+    fillers = ['について教えてください', 'はどう考えますか？', 'What do you think about ', ' in Japan', '。',
+               'Please tell me', 'サラリーマンが', 'AIと', ' and ']
+
+    snippets = []
+    if texts_path and os.path.exists(texts_path):
+        with open(texts_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    text = json.loads(line).get('text', '')
+                    start = rng.randrange(max(1, len(text) - 60))
+                    snippets.append(text[start:start + rng.randint(10, 60)])
+                if len(snippets) >= n_messages:
+                    break
+
+    messages = []
+    for i in range(n_messages):
+        parts = [rng.choice(fillers)]
+        for _ in range(rng.randint(0, 3)):
+            keyword = rng.choice(keywords)
+            parts.append(keyword.upper() if rng.random() < 0.2 else keyword)
+            parts.append(rng.choice(fillers))
+        if snippets and rng.random() < 0.5:
+            parts.append(snippets[i % len(snippets)])
+        messages.append(''.join(parts))
+    return messages
+
+
+def time_per_message(func, messages: List[str], repeat: int) -> float:
+    """1メッセージあたりの平均時間（マイクロ秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            func(message)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='意図判定のキーワード照合の速度と結果の一致を確認')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--texts', default=os.path.join(base_path, 'faiss_texts.jsonl'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    messages = make_messages(args.messages, args.texts)
+
+    build_start = time.perf_counter()
+    matcher = IntentMatcher()
+    build_ms = (time.perf_counter() - build_start) * 1000
+
+    def new_context_intent(message: str) -> str:
+        return matcher.context_from_hits(matcher.match(message)) or 'new_topic'
+
+    def legacy_both(message: str):
+        return legacy_analyze_question_intent(message), legacy_context_intent(message)
+
+    def new_both(message: str):
+        # トピック・フォローアップ・反応を1回の走査で求める
+        hits = matcher.match(message)
+        topic, emotion = matcher.topic_from_hits(hits)
+        return topic, emotion, matcher.context_from_hits(hits)
+
+    mismatches = [message for message in messages
+                  if legacy_analyze_question_intent(message) != matcher.analyze(message)
+                  or legacy_context_intent(message) != new_context_intent(message)]
+
+    print(f"{'method':<24}{'intent(us)':>12}{'intent+context(us)':>20}")
+    print("-" * 56)
+    print(f"{'if/elif (legacy)':<24}{time_per_message(legacy_analyze_question_intent, messages, args.repeat):>12.2f}"
+          f"{time_per_message(legacy_both, messages, args.repeat):>20.2f}")
+    print(f"{'aho-corasick':<24}{time_per_message(matcher.analyze, messages, args.repeat):>12.2f}"
+          f"{time_per_message(new_both, messages, args.repeat):>20.2f}")
+    print(f"オートマトンの構築: {build_ms:.2f}ms / 状態数 {matcher.automaton.state_count}")
+
+    if mismatches:
+        print(f"✗ {len(mismatches)}件のメッセージで判定結果が異なります（例: {mismatches[0]!r}）")
+        return 1
+    print(f"✓ {len(messages)}件のメッセージで判定結果が一致しました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
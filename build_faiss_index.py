@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット FAISSインデックスビルダー
+学習結果/ocr_results_all.json から faiss_index_ip.faiss / faiss_meta.json / faiss_texts.jsonl を生成する
+
+チャンク分割と埋め込みはColabでの学習時と同じ設定:
+    チャンクサイズ 800文字、オーバーラップ 120文字、"passage: " プレフィックス、正規化あり
+埋め込みはチャンク内容のハッシュでキャッシュし、再構築時は変更されたチャンクだけを計算する
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+from typing import Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from chunk_quality import prune_chunks, save_id_map
+from corpus_store import write_corpus
+from dedup import DUPLICATE_THRESHOLD, compose_id_maps, dedup_chunks
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'intfloat/multilingual-e5-base'
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 120
+
+_SPACE_PATTERN = re.compile(r'[ \t　]+')
+
+# フラットインデックスから作る派生インデックス（ann_index.py / dim_reduction.py）のファイル名
+_DERIVED_INDEX_PATTERN = re.compile(r'^faiss_index_(?:(ivf|hnsw|sq8|pq)|(pca|truncate)(\d+))\.faiss$')
+
+
+def normalize_page_text(text: str) -> str:
+    """OCRテキストの連続する空白（全角スペース含む）を1つにまとめる"""
+    return _SPACE_PATTERN.sub(' ', text).strip()
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    テキストを固定長のオーバーラップ付きチャンクに分割
+
+    Args:
+        text: 分割するテキスト
+        chunk_size: チャンクの文字数
+        overlap: 隣接チャンクの重なり文字数
+
+    Returns:
+        空白のみのチャンクを除いたチャンクのリスト
+    """
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError(f"オーバーラップはチャンクサイズより小さくする必要があります: {overlap} >= {chunk_size}")
+    chunks = []
+    for start in range(0, len(text), step):
+        chunk = text[start:start + chunk_size]
+        if chunk.strip():
+            chunks.append(chunk)
+    return chunks
+
+
+def build_chunks(ocr_results: List[Dict], chunk_size: int = CHUNK_SIZE,
+                 overlap: int = CHUNK_OVERLAP) -> Tuple[List[str], List[Dict]]:
+    """
+    OCR結果（1ページ1件）をチャンクとメタデータに変換
+
+    Returns:
+        (テキストのリスト, source / page / len を持つメタデータのリスト)
+    """
+    texts = []
+    metadata = []
+    for page in ocr_results:
+        for chunk in chunk_text(normalize_page_text(page.get('text', '')), chunk_size, overlap):
+            texts.append(chunk)
+            metadata.append({
+                'source': page.get('source', ''),
+                'page': page.get('page', 0),
+                'len': len(chunk)
+            })
+    return texts, metadata
+
+
+def content_hash(text: str, model_name: str = MODEL_NAME) -> str:
+    """埋め込みキャッシュのキー（モデル名と入力文字列のハッシュ）"""
+    return hashlib.sha1(f"{model_name}\n{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """チャンク内容のハッシュをキーにした埋め込みキャッシュ（npzファイル）"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: キャッシュファイルのパス（存在しなければ空のキャッシュ）
+        """
+        self.path = path
+        self.vectors: Dict[str, np.ndarray] = {}
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                for key, vector in zip(data['keys'], data['vectors']):
+                    self.vectors[str(key)] = vector
+            logger.info(f"埋め込みキャッシュを読み込みました: {path} ({len(self.vectors)}件)")
+
+    def get(self, key: str):
+        return self.vectors.get(key)
+
+    def update(self, keys: List[str], vectors: np.ndarray) -> None:
+        for key, vector in zip(keys, vectors):
+            self.vectors[key] = vector
+
+    def save(self, keep_keys: List[str] = None) -> None:
+        """
+        キャッシュを保存
+
+        Args:
+            keep_keys: 指定した場合はこのキーだけを残す（使われなくなったチャンクを削除）
+        """
+        if not self.path:
+            return
+        keys = list(dict.fromkeys(keep_keys)) if keep_keys is not None else list(self.vectors)
+        keys = [key for key in keys if key in self.vectors]
+        vectors = np.stack([self.vectors[key] for key in keys]) if keys else np.zeros((0, 0), dtype='float32')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, keys=np.array(keys), vectors=vectors)
+        os.replace(tmp_path, self.path)
+        logger.info(f"埋め込みキャッシュを保存しました: {self.path} ({len(keys)}件)")
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+
+def embed_passages(texts: List[str], cache: EmbeddingCache, model_name: str = MODEL_NAME,
+                   processes: int = 1, batch_size: int = 32) -> Tuple[np.ndarray, List[str], int]:
+    """
+    チャンクを "passage: " プレフィックス付きで埋め込む（キャッシュにないものだけ計算）
+
+    Args:
+        texts: チャンクのテキスト
+        cache: 埋め込みキャッシュ
+        model_name: SentenceTransformerのモデル名
+        processes: 埋め込みに使うプロセス数（2以上でマルチプロセス）
+        batch_size: バッチサイズ
+
+    Returns:
+        (正規化済み埋め込み行列, キャッシュキーのリスト, 新たに計算した件数)
+    """
+    passages = [f"passage: {text}" for text in texts]
+    keys = [content_hash(passage, model_name) for passage in passages]
+
+    missing_keys = [key for key in dict.fromkeys(keys) if cache.get(key) is None]
+    if missing_keys:
+        from sentence_transformers import SentenceTransformer
+
+        passage_by_key = dict(zip(keys, passages))
+        missing_passages = [passage_by_key[key] for key in missing_keys]
+        logger.info(f"埋め込みを計算中: {len(missing_passages)}件（キャッシュ済み {len(keys) - len(missing_keys)}件）")
+
+        model = SentenceTransformer(model_name)
+        if processes > 1:
+            pool = model.start_multi_process_pool(target_devices=['cpu'] * processes)
+            try:
+                embeddings = model.encode_multi_process(missing_passages, pool, batch_size=batch_size)
+            finally:
+                model.stop_multi_process_pool(pool)
+        else:
+            embeddings = model.encode(missing_passages, batch_size=batch_size, show_progress_bar=True)
+
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        faiss.normalize_L2(embeddings)
+        cache.update(missing_keys, embeddings)
+
+    vectors = np.ascontiguousarray(np.stack([cache.get(key) for key in keys]), dtype='float32')
+    return vectors, keys, len(missing_keys)
+
+
+def write_artifacts(vectors: np.ndarray, texts: List[str], metadata: List[Dict], output_dir: str) -> None:
+    """
+    faiss_index_ip.faiss / faiss_meta.json / faiss_texts.jsonl を書き出す
+
+    途中で失敗しても既存の成果物を壊さないよう、一時ファイルに書いてから置き換える
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, 'faiss_index_ip.faiss')
+    meta_path = os.path.join(output_dir, 'faiss_meta.json')
+    texts_path = os.path.join(output_dir, 'faiss_texts.jsonl')
+
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    faiss.write_index(index, index_path + '.tmp')
+
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    with open(texts_path + '.tmp', 'w', encoding='utf-8') as f:
+        for text in texts:
+            f.write(json.dumps({'text': text}, ensure_ascii=False) + '\n')
+
+    for path in (index_path, meta_path, texts_path):
+        os.replace(path + '.tmp', path)
+    logger.info(f"成果物を書き出しました: {output_dir} ({index.ntotal}ベクトル)")
+
+
+def rebuild_derived_artifacts(vectors: np.ndarray, output_dir: str) -> Dict[str, List[str]]:
+    """
+    出力先にある派生インデックス（近似・次元削減インデックスと射影）を新しいベクトルで作り直す
+
+    チャンク数が変わると古い派生インデックスのIDが別のチャンクを指すため、
+    フラットインデックスを書き出すたびに呼ぶ。パラメータは各スクリプトの既定値を使い、
+    作り直せなかったもの（学習データ不足など）と対になるインデックスのない射影は削除する
+
+    Returns:
+        {'rebuilt': [...], 'removed': [...]} のファイル名のリスト
+    """
+    from ann_index import build_ann_index
+    from dim_reduction import build_reduced_index, make_projection, projection_path
+
+    result = {'rebuilt': [], 'removed': []}
+    for name in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, name)
+        match = _DERIVED_INDEX_PATTERN.match(name)
+        if match is None:
+            if name.endswith('.proj.npz') and not os.path.exists(path[:-len('.proj.npz')] + '.faiss'):
+                os.remove(path)
+                result['removed'].append(name)
+            continue
+
+        index_type, kind, dim = match.groups()
+        try:
+            if index_type:
+                index = build_ann_index(vectors, index_type)
+            else:
+                projection = make_projection(vectors, kind, int(dim))
+                index = build_reduced_index(vectors, projection)
+                projection.save(projection_path(path))
+            faiss.write_index(index, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            result['rebuilt'].append(name)
+        except Exception as e:
+            logger.error(f"派生インデックスを作り直せないため削除します: {name}: {str(e)}")
+            for stale in (path, path + '.tmp', projection_path(path)):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            result['removed'].append(name)
+    return result
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='OCR結果からFAISSインデックスを構築')
+    parser.add_argument('--ocr', default=os.path.join(base_path, 'ocr_results_all.json'))
+    parser.add_argument('--output-dir', default=base_path)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--overlap', type=int, default=CHUNK_OVERLAP)
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--cache', default=os.path.join(base_path, 'embedding_cache.npz'),
+                        help='埋め込みキャッシュのパス（空文字で無効）')
+    parser.add_argument('--corpus', action='store_true',
+                        help='コンパクトコーパス（corpus/）も書き出す（既にある場合は指定しなくても書き直す）')
+    parser.add_argument('--min-quality', type=float, default=None,
+                        help='品質スコアがこの値未満のチャンクを除外（chunk_quality.py、省略時は除外しない）')
+    parser.add_argument('--dedup', action='store_true', help='ほぼ同一のチャンクを1つにまとめる（dedup.py）')
+    parser.add_argument('--dedup-threshold', type=float, default=DUPLICATE_THRESHOLD,
+                        help='重複とみなすJaccard類似度（MinHashによる推定値）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.time()
+
+    with open(args.ocr, 'r', encoding='utf-8') as f:
+        ocr_results = json.load(f)
+    texts, metadata = build_chunks(ocr_results, args.chunk_size, args.overlap)
+    print(f"✓ チャンク分割: {len(ocr_results)}ページ -> {len(texts)}チャンク")
+
+    id_map = None
+    if args.min_quality is not None:
+        texts, metadata, id_map, report = prune_chunks(texts, metadata, args.min_quality)
+        print(f"✓ 品質フィルタ: {report['before']} -> {report['after']}チャンク "
+              f"(削除 {report['dropped']}件 / 統合 {report['merged']}件)")
+
+    if args.dedup:
+        texts, metadata, dedup_map, report = dedup_chunks(texts, metadata, args.dedup_threshold)
+        id_map = dedup_map if id_map is None else compose_id_maps(id_map, dedup_map)
+        print(f"✓ 重複の統合: {report['before']} -> {report['after']}チャンク "
+              f"(削除 {report['removed']}件 / {report['removed_ratio']:.1%}, {report['groups']}グループ)")
+
+    cache = EmbeddingCache(args.cache)
+    vectors, keys, computed = embed_passages(texts, cache, args.model, args.processes, args.batch_size)
+    cache.save(keep_keys=keys)
+    print(f"✓ 埋め込み: {len(texts)}件（新規計算 {computed}件 / キャッシュ {len(texts) - computed}件）")
+
+    write_artifacts(vectors, texts, metadata, args.output_dir)
+    # 前回の構築の成果物が今回のチャンクと食い違ったまま残らないようにする
+    remap_path = os.path.join(args.output_dir, 'faiss_id_remap.npy')
+    if id_map is not None:
+        save_id_map(id_map, args.output_dir)
+    elif os.path.exists(remap_path):
+        os.remove(remap_path)
+    corpus_dir = os.path.join(args.output_dir, 'corpus')
+    if args.corpus or os.path.isdir(corpus_dir):
+        write_corpus(texts, metadata, corpus_dir)
+    derived = rebuild_derived_artifacts(vectors, args.output_dir)
+    if derived['rebuilt'] or derived['removed']:
+        print(f"✓ 派生インデックス: 作り直し {derived['rebuilt']} / 削除 {derived['removed']}")
+
+    print(f"✓ 構築完了: {args.output_dir} ({time.time() - start:.1f}秒)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,110 +6,127 @@
 
 import json
 import logging
-import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
+
+from intent_matcher import default_matcher
+from message_analysis import MessageAnalysis
+from session_state import EMPTY_STATE, ConversationState
 
 logger = logging.getLogger(__name__)
 
 class ChatBot:
+    # 固定の文章で回答し、検索結果（similar_docs）を使わない意図
+    TEMPLATE_TOPICS = ('fear_overcoming', 'failure_overcoming', 'success',
+                       'future_survival', 'yamaha_experience', 'hitachi_experience')
+    # 検索が不要な意図（repeat_in_japanese は前の回答を使うため固定の文章ではない）
+    RETRIEVAL_FREE_TOPICS = TEMPLATE_TOPICS + ('repeat_in_japanese',)
+    LANGUAGES = ('ja', 'en')
+    # 意図判定のキーワード照合（全インスタンスで共有）
+    intent_matcher = default_matcher
+    
     def __init__(self, api_key=None):
         """
         チャットボットの初期化
+        
+        会話履歴と前の回答はインスタンスに持たず、セッションごとの ConversationState として
+        generate_response に渡す。そのため1つのインスタンスを複数のスレッドから同時に使ってよい
+        
         Args:
             api_key: APIキー（Ollama使用時はNone）
         """
         self.api_key = api_key
-        self.last_response = None  # 前の回答を記憶
-        self.conversation_history = []  # 会話履歴を保持
         self.max_history_length = 10  # 履歴の最大長
+        # 固定の回答は (topic, lang) ごとに一度だけ作成しておく
+        self.template_responses = self._build_template_responses()
         logger.info("ChatBotが初期化されました")
     
-    def detect_language(self, text: str) -> str:
+    def _build_template_responses(self) -> Dict[tuple, str]:
+        """固定の回答を (topic, lang) ごとに作成"""
+        generators = {
+            'fear_overcoming': self._generate_fear_overcoming_response,
+            'failure_overcoming': self._generate_failure_overcoming_response,
+            'success': self._generate_success_response,
+            'future_survival': self._generate_future_survival_response,
+            'yamaha_experience': self._generate_yamaha_experience_response,
+            'hitachi_experience': self._generate_hitachi_experience_response
+        }
+        return {(topic, lang): generators[topic]('', lang)
+                for topic in self.TEMPLATE_TOPICS for lang in self.LANGUAGES}
+    
+    def needs_retrieval(self, intent: Dict[str, Any]) -> bool:
+        """
+        応答の生成に検索結果が必要な意図か
+        
+        固定の回答を返す意図では埋め込みとFAISS検索を省略できる
+        """
+        return intent['topic'] not in self.RETRIEVAL_FREE_TOPICS
+    
+    def get_template_response(self, topic: str, lang: str):
+        """固定の回答（該当しない場合はNone）"""
+        return self.template_responses.get((topic, lang))
+    
+    def analyze(self, message: Union[str, MessageAnalysis]) -> MessageAnalysis:
+        """メッセージの解析（言語・意図などは参照時に1回だけ計算される）"""
+        if isinstance(message, MessageAnalysis):
+            return message
+        return MessageAnalysis(message, self.intent_matcher)
+    
+    def detect_language(self, text: Union[str, MessageAnalysis]) -> str:
         """
         テキストの言語を検出
         Args:
-            text: 検出対象のテキスト
+            text: 検出対象のテキスト（または解析済みのメッセージ）
         Returns:
             検出された言語（'ja' または 'en'）
         """
         # 日本語文字が含まれているかチェック
-        japanese_pattern = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]')
-        if japanese_pattern.search(text):
-            return 'ja'
-        else:
-            return 'en'
+        return self.analyze(text).language
     
-    def analyze_question_intent(self, message: str) -> Dict[str, Any]:
+    def analyze_question_intent(self, message: Union[str, MessageAnalysis]) -> Dict[str, Any]:
         """
         質問の意図を分析
-        """
-        intent = {
-            'topic': 'general',
-            'emotion': 'neutral',
-            'specificity': 'general'
-        }
-        
-        # トピック分析
-        if any(word in message.lower() for word in ['怖い', '恐い', '恐怖', 'fear', 'scared', 'afraid']):
-            intent['topic'] = 'fear_overcoming'
-            intent['emotion'] = 'concern'
-        elif any(word in message.lower() for word in ['失敗', '挫折', '困難', 'failure', 'difficulty', 'challenge']):
-            intent['topic'] = 'failure_overcoming'
-            intent['emotion'] = 'struggle'
-        elif any(word in message.lower() for word in ['成功', '達成', '勝利', 'success', 'achievement', 'victory']):
-            intent['topic'] = 'success'
-            intent['emotion'] = 'positive'
-        elif any(word in message.lower() for word in ['経営', '戦略', 'ビジネス', 'business', 'strategy', 'management']):
-            intent['topic'] = 'business_strategy'
-        elif any(word in message.lower() for word in ['リーダー', '指導', 'leadership', 'leader']):
-            intent['topic'] = 'leadership'
-        elif any(word in message.lower() for word in ['グローバル', '国際', 'global', 'international']):
-            intent['topic'] = 'global_strategy'
-        elif any(word in message.lower() for word in ['デジタル', '技術', 'digital', 'technology']):
-            intent['topic'] = 'digital_transformation'
-        elif any(word in message.lower() for word in ['50', 'fifty', 'age', 'older', 'survive', 'future', '2030', '2030s']):
-            intent['topic'] = 'future_survival'
-        elif any(word in message.lower() for word in ['yamaha', 'ヤマハ', 'motorcycle', '楽器']):
-            intent['topic'] = 'yamaha_experience'
-        elif any(word in message.lower() for word in ['hitachi', '日立', 'nuclear', '原発', '原子力']):
-            intent['topic'] = 'hitachi_experience'
-        elif any(word in message.lower() for word in ['panasonic', 'パナソニック', '松下']):
-            intent['topic'] = 'panasonic_experience'
-        elif any(word in message.lower() for word in ['それ', 'これ', 'that', 'this']) and any(word in message.lower() for word in ['日本語', 'japanese']):
-            intent['topic'] = 'repeat_in_japanese'
         
-        return intent
+        トピックのキーワードは intent_matcher.TOPIC_RULES の順に優先し、
+        全キーワードを1回の走査で照合する
+        """
+        return self.analyze(message).intent
     
-    def generate_response(self, message: str, similar_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def generate_response(self, message: Union[str, MessageAnalysis],
+                          similar_docs: List[Dict[str, Any]],
+                          state: ConversationState = EMPTY_STATE) -> Dict[str, Any]:
         """
         メッセージに対する応答を生成（改善版・コンテキスト対応）
+        
+        state は読むだけで変更しない。応答後の状態は update_state で作る
+        
         Args:
-            message: ユーザーのメッセージ
+            message: ユーザーのメッセージ（検索の前に analyze で解析したものを渡すと、
+                     言語・意図の判定を繰り返さない）
             similar_docs: 類似ドキュメントのリスト
+            state: このセッションの会話の状態（省略時は履歴なし）
         Returns:
             応答データの辞書
         """
         try:
-            detected_lang = self.detect_language(message)
-            intent = self.analyze_question_intent(message)
+            analysis = self.analyze(message)
+            message = analysis.text
+            detected_lang = analysis.language
+            intent = analysis.intent
             
             # コンテキストを考慮したメッセージ解析
-            context_enhanced_message = self._enhance_message_with_context(message)
+            context_enhanced_message = self._enhance_message_with_context(message, state)
             
             # 意図に基づいた応答生成
-            response = self._generate_intent_based_response(context_enhanced_message, intent, similar_docs, detected_lang)
-            
-            # 会話履歴を更新
-            self._update_conversation_history(message, response)
-            
-            # 前の回答を記憶（repeat機能用）
-            if intent['topic'] != 'repeat_in_japanese':
-                self.last_response = response
+            response = self._generate_intent_based_response(context_enhanced_message, intent, similar_docs, detected_lang,
+                                                            analysis, state)
             
             return {
                 'response': response,
                 'sources': [doc.get('source', '') for doc in similar_docs],
-                'confidence': 0.9 if intent['topic'] != 'general' else 0.7
+                'confidence': 0.9 if intent['topic'] != 'general' else 0.7,
+                # 固定の回答の場合、Webアプリは /api/template/<topic>?lang= のURLも返す
+                'topic': intent['topic'],
+                'lang': detected_lang
             }
             
         except Exception as e:
@@ -120,19 +137,36 @@ class ChatBot:
                 'confidence': 0.0
             }
     
-    def _generate_intent_based_response(self, message: str, intent: Dict[str, Any], similar_docs: List[Dict[str, Any]], lang: str) -> str:
+    def update_state(self, state: ConversationState, message: Union[str, MessageAnalysis],
+                     response: Dict[str, Any], keywords: List[str] = ()) -> ConversationState:
+        """
+        generate_response の応答を加えた新しい会話の状態
+        
+        セッションバックエンドの update に渡し、同じセッションの最新の状態に対して呼ぶ
+        
+        Args:
+            keywords: 次の質問の検索クエリに加えるキーワード
+        """
+        analysis = self.analyze(message)
+        # 「それを日本語で」への応答は前の回答として記憶しない（repeat機能用）
+        return state.add_turn(analysis.text, response['response'],
+                              remember_response=analysis.intent['topic'] != 'repeat_in_japanese',
+                              max_history=self.max_history_length, keywords=keywords)
+    
+    def _generate_intent_based_response(self, message: str, intent: Dict[str, Any], similar_docs: List[Dict[str, Any]], lang: str,
+                                        analysis: MessageAnalysis = None,
+                                        state: ConversationState = EMPTY_STATE) -> str:
         """
         意図に基づいた応答を生成
         """
         topic = intent['topic']
         
-        if topic == 'fear_overcoming':
-            return self._generate_fear_overcoming_response(message, lang)
-        elif topic == 'failure_overcoming':
-            return self._generate_failure_overcoming_response(message, lang)
-        elif topic == 'success':
-            return self._generate_success_response(message, lang)
-        elif topic == 'business_strategy':
+        # 固定の回答（恐怖・失敗・成功・2030年代・ヤマハ・日立）は作成済みのものを返す
+        template = self.get_template_response(topic, lang)
+        if template is not None:
+            return template
+        
+        if topic == 'business_strategy':
             return self._generate_business_strategy_response(message, similar_docs, lang)
         elif topic == 'leadership':
             return self._generate_leadership_response(message, similar_docs, lang)
@@ -140,16 +174,10 @@ class ChatBot:
             return self._generate_global_strategy_response(message, similar_docs, lang)
         elif topic == 'digital_transformation':
             return self._generate_digital_response(message, similar_docs, lang)
-        elif topic == 'future_survival':
-            return self._generate_future_survival_response(message, lang)
-        elif topic == 'yamaha_experience':
-            return self._generate_yamaha_experience_response(message, lang)
-        elif topic == 'hitachi_experience':
-            return self._generate_hitachi_experience_response(message, lang)
         elif topic == 'repeat_in_japanese':
-            return self._generate_repeat_in_japanese_response(message, lang)
+            return self._generate_repeat_in_japanese_response(message, lang, state.last_response)
         else:
-            return self._generate_general_response(message, similar_docs, lang)
+            return self._generate_general_response(message, similar_docs, lang, analysis, state)
     
     def _generate_fear_overcoming_response(self, message: str, lang: str) -> str:
         """恐怖や困難を乗り越えることについての応答"""
@@ -449,13 +477,13 @@ Ohmae evaluates Hitachi as "a symbol of Japan's technological prowess."
 
 ※OCR quality improvement is needed to verify actual PDF content."""
     
-    def _generate_repeat_in_japanese_response(self, message: str, lang: str) -> str:
+    def _generate_repeat_in_japanese_response(self, message: str, lang: str, last_response: str = None) -> str:
         """前の回答を日本語で繰り返す応答"""
-        if self.last_response:
+        if last_response:
             # 前の回答が英語の場合は日本語に翻訳
-            if any(char.isascii() and char.isalpha() for char in self.last_response):
+            if any(char.isascii() and char.isalpha() for char in last_response):
                 # 英語の回答を日本語に翻訳（簡易版）
-                if "YAMAHA" in self.last_response:
+                if "YAMAHA" in last_response:
                     return """【注意：PDF学習に問題があるため、これは仮のベンチマーク回答です】
 
 大前研一は、マッキンゼー時代にヤマハの経営戦略に関与しました。
@@ -465,7 +493,7 @@ Ohmae evaluates Hitachi as "a symbol of Japan's technological prowess."
 大前研一はヤマハを日本の製造業の成功モデルとして評価しています。
 
 ※実際のPDF内容を確認するには、OCR品質の改善が必要です。"""
-                elif "Hitachi" in self.last_response:
+                elif "Hitachi" in last_response:
                     return """【注意：PDF学習に問題があるため、これは仮のベンチマーク回答です】
 
 大前研一は、日立の経営戦略や技術開発に関してコンサルティングを行いました。
@@ -479,14 +507,16 @@ Ohmae evaluates Hitachi as "a symbol of Japan's technological prowess."
                     return "前の回答を日本語で翻訳できませんでした。"
             else:
                 # 既に日本語の場合はそのまま返す
-                return self.last_response
+                return last_response
         else:
             return "前の回答が見つかりません。"
     
-    def _generate_general_response(self, message: str, similar_docs: List[Dict[str, Any]], lang: str) -> str:
+    def _generate_general_response(self, message: str, similar_docs: List[Dict[str, Any]], lang: str,
+                                   analysis: MessageAnalysis = None,
+                                   state: ConversationState = EMPTY_STATE) -> str:
         """一般的な応答（コンテキスト対応版）"""
         context = self._extract_context(similar_docs)
-        context_intent = self._analyze_context_intent(message)
+        context_intent = self._analyze_context_intent(analysis or message, state)
         
         # フォローアップ質問の場合
         if context_intent == 'followup_question':
@@ -568,16 +598,16 @@ Ohmae evaluates Hitachi as "a symbol of Japan's technological prowess."
                 context_parts.append(doc['content'][:500])  # 最初の500文字
         return '\n\n'.join(context_parts)
     
-    def _enhance_message_with_context(self, message: str) -> str:
+    def _enhance_message_with_context(self, message: str, state: ConversationState = EMPTY_STATE) -> str:
         """
         コンテキストを考慮してメッセージを強化
         """
-        if not self.conversation_history:
+        if not state.history:
             return message
         
         # 前の会話履歴から関連情報を抽出
         context_info = []
-        for entry in self.conversation_history[-3:]:  # 最新3件を参照
+        for entry in state.history[-3:]:  # 最新3件を参照
             if entry.get('intent') and entry.get('intent') != 'general':
                 context_info.append(f"前の質問: {entry['message']}")
                 context_info.append(f"前の回答: {entry['response'][:200]}...")
@@ -588,56 +618,17 @@ Ohmae evaluates Hitachi as "a symbol of Japan's technological prowess."
         
         return message
     
-    def _update_conversation_history(self, message: str, response: str):
-        """
-        会話履歴を更新
-        """
-        # 履歴に追加
-        self.conversation_history.append({
-            'message': message,
-            'response': response,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # 履歴が長すぎる場合は古いものを削除
-        if len(self.conversation_history) > self.max_history_length:
-            self.conversation_history = self.conversation_history[-self.max_history_length:]
-    
-    def _analyze_context_intent(self, message: str) -> str:
+    def _analyze_context_intent(self, message: Union[str, MessageAnalysis],
+                                state: ConversationState = EMPTY_STATE) -> str:
         """
         コンテキストを考慮した意図分析
+        
+        フォローアップ質問のパターンを反応のパターンより優先する
+        （パターンは intent_matcher.FOLLOWUP_PATTERNS / REACTION_PATTERNS）。
+        照合結果はトピックの判定と同じ1回の走査のものを使う
         """
         # 前の会話履歴をチェック
-        if not self.conversation_history:
+        if not state.history:
             return 'new_topic'
         
-        last_entry = self.conversation_history[-1]
-        last_message = last_entry.get('message', '').lower()
-        last_response = last_entry.get('response', '').lower()
-        
-        # フォローアップ質問のパターンを検出
-        followup_patterns = [
-            'それって', 'それは', 'その', 'これって', 'これは', 'この',
-            'that', 'this', 'it', 'what about', 'how about',
-            '詳しく', '具体的に', '例を', 'for example', 'specifically',
-            'なぜ', 'どうして', 'why', 'how come',
-            '他には', '他に', 'other', 'else', 'more'
-        ]
-        
-        for pattern in followup_patterns:
-            if pattern in message.lower():
-                return 'followup_question'
-        
-        # 前の回答に対する反応をチェック
-        reaction_patterns = [
-            'なるほど', 'そうですね', '確かに', '理解しました',
-            'i see', 'i understand', 'that makes sense', 'okay',
-            'ありがとう', 'thank you', 'thanks',
-            'もっと', 'さらに', 'more', 'further'
-        ]
-        
-        for pattern in reaction_patterns:
-            if pattern in message.lower():
-                return 'reaction'
-        
-        return 'new_topic'
+        return self.analyze(message).context_intent
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット チャンク品質スコアリング
+OCRノイズだけのチャンク（"』 暴"、"豊 筆 昌 川 1 { !" など）を検出し、
+インデックス構築・圧縮時に削除または前のチャンクへ統合する
+
+スコアは次の特徴量から計算する（0〜1、高いほど本文らしい）:
+    文字種の割合      かな・漢字・英数字が占める割合、ひらがなの割合
+    記号密度          | { @ # 』 などOCRノイズに多い記号の割合
+    断片率            空白で区切られた1文字だけのトークンの割合
+    辞書ヒット率      頻出語（助詞・助動詞の連なり、ビジネス用語など）で覆われる文字の割合
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import unicodedata
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 既定のしきい値
+MIN_QUALITY = 0.4
+MERGE_MAX_LENGTH = 40
+MIN_LETTERS = 4
+
+# 日本語の文章でよく使われる語（2文字以上）。OCRノイズでは偶然一致しにくい
+_JA_WORDS = frozenset("""
+    です ます でした ました ません である であり だった ない なく なら なる なっ なり ある あっ あり いる いう いっ
+    する した して され させ できる でき という といった として とは では には からの までの ための ように
+    こと もの ところ とき ため よう ほど など これ それ あれ どの その この ここ そこ どう なぜ しかし だが
+    つまり また さらに まず 一方 日本 日本人 世界 経営 企業 会社 社会 経済 市場 戦略 問題 時代 政治 政府
+    国家 人生 仕事 時間 自分 我々 私は 私が 大前 研一 ビジネス マーケット グローバル アメリカ 中国
+    社員 顧客 競争 成長 成功 失敗 将来 必要 重要 可能 考え 考える 発想 教育 学校 大学 産業 技術 情報
+    会議 組織 人材 能力 世代 国民 地域 地方 都市 事業 投資 資本 価格 商品 製品 サービス 消費
+    """.split())
+
+_EN_WORDS = frozenset("""
+    the of and to in is that for it as with was on be by are this from at or an not have
+    which but has its they their we you can will business market strategy company japan world
+""".split())
+
+# 文章中に普通に現れる記号（記号密度に含めない）
+_ALLOWED_SYMBOLS = frozenset('、。，．・ー「」（）()〈〉《》【】〔〕…―-:：;；!?！？"\'%％/')
+
+# OCRノイズとして頻出する記号（句読点として使われても記号密度に含める）
+_NOISE_SYMBOLS = frozenset('|{}[]@#~^*=<>\\`_『』')
+
+_MAX_WORD_LENGTH = max(len(word) for word in _JA_WORDS)
+
+
+def _char_class(char: str) -> str:
+    """文字種を判定（hiragana / katakana / kanji / latin / digit / space / symbol）"""
+    if char.isspace():
+        return 'space'
+    if 'ぁ' <= char <= 'ゟ':
+        return 'hiragana'
+    if '゠' <= char <= 'ヿ' or 'ｦ' <= char <= 'ﾟ':
+        return 'katakana'
+    if '一' <= char <= '鿿' or '㐀' <= char <= '䶿' or char in '々〆':
+        return 'kanji'
+    if char.isdigit():
+        return 'digit'
+    if char.isalpha():
+        return 'latin'
+    return 'symbol'
+
+
+def script_ratios(text: str) -> Dict[str, float]:
+    """空白以外の文字に占める各文字種の割合"""
+    counts = {'hiragana': 0, 'katakana': 0, 'kanji': 0, 'latin': 0, 'digit': 0, 'symbol': 0}
+    for char in unicodedata.normalize('NFKC', text):
+        kind = _char_class(char)
+        if kind != 'space':
+            counts[kind] += 1
+    total = sum(counts.values())
+    return {kind: (count / total if total else 0.0) for kind, count in counts.items()}
+
+
+def symbol_density(text: str) -> float:
+    """空白以外の文字に占めるノイズ記号の割合"""
+    chars = [char for char in text if not char.isspace()]
+    if not chars:
+        return 0.0
+    noisy = sum(1 for char in chars
+                if char in _NOISE_SYMBOLS or (_char_class(char) == 'symbol' and char not in _ALLOWED_SYMBOLS))
+    return noisy / len(chars)
+
+
+def fragment_ratio(text: str) -> float:
+    """空白で区切られたトークンのうち1文字だけのトークンの割合"""
+    tokens = text.split()
+    if not tokens:
+        return 1.0
+    return sum(1 for token in tokens if len(token) == 1) / len(tokens)
+
+
+def dictionary_hit_rate(text: str) -> float:
+    """
+    頻出語で覆われる文字の割合（日本語は最長一致、英語は単語単位）
+
+    1文字の助詞はノイズにも多く含まれるため、2文字以上の語だけを数える
+    """
+    text = unicodedata.normalize('NFKC', text)
+    covered = 0
+    total = 0
+    for token in text.split():
+        if token.isascii():
+            word = token.strip('.,:;!?()"\'').lower()
+            if word.isalpha():
+                total += len(word)
+                if word in _EN_WORDS:
+                    covered += len(word)
+            continue
+        total += len(token)
+        i = 0
+        while i < len(token):
+            for length in range(min(_MAX_WORD_LENGTH, len(token) - i), 1, -1):
+                if token[i:i + length] in _JA_WORDS:
+                    covered += length
+                    i += length
+                    break
+            else:
+                i += 1
+    return covered / total if total else 0.0
+
+
+def score_chunk(text: str) -> Dict[str, float]:
+    """
+    チャンクの品質スコアを計算
+
+    Returns:
+        score（0〜1）と各特徴量の辞書
+    """
+    ratios = script_ratios(text)
+    symbols = symbol_density(text)
+    fragments = fragment_ratio(text)
+    dictionary = dictionary_hit_rate(text)
+    letters = ratios['hiragana'] + ratios['katakana'] + ratios['kanji'] + ratios['latin']
+
+    # 本文らしさ: 断片化しておらず、記号が少なく、頻出語やひらがなを含む
+    score = (
+        0.35 * (1.0 - fragments)
+        + 0.25 * max(0.0, 1.0 - 3.0 * symbols)
+        + 0.2 * min(1.0, 4.0 * dictionary)
+        + 0.1 * min(1.0, 3.0 * ratios['hiragana'])
+        + 0.1 * letters
+    )
+    # ページ番号だけ（"254"）や1〜2文字だけのチャンクは内容がないものとして扱う
+    letter_count = sum(1 for char in text if _char_class(char) in ('hiragana', 'katakana', 'kanji', 'latin'))
+    if letter_count < MIN_LETTERS:
+        score *= letter_count / MIN_LETTERS
+    return {
+        'score': round(score, 4),
+        'symbol_density': round(symbols, 4),
+        'fragment_ratio': round(fragments, 4),
+        'dictionary_hit_rate': round(dictionary, 4),
+        **{f"{kind}_ratio": round(value, 4) for kind, value in ratios.items()}
+    }
+
+
+def prune_chunks(texts: List[str], metadata: List[Dict], min_quality: float = MIN_QUALITY,
+                 merge_max_length: int = MERGE_MAX_LENGTH) -> Tuple[List[str], List[Dict], np.ndarray, Dict]:
+    """
+    低品質なチャンクを削除し、短い断片を同じページの直前のチャンクへ統合
+
+    - スコアが min_quality 未満のチャンクは削除
+    - スコアは十分でも merge_max_length 文字以下の短いチャンクは、同じソース・ページの
+      直前に残したチャンクの末尾に連結（直前がなければそのまま残す）
+
+    Returns:
+        (残ったテキスト, メタデータ, 旧ID→新IDの対応（削除は-1）, 集計)
+    """
+    kept_texts: List[str] = []
+    kept_metadata: List[Dict] = []
+    id_map = np.full(len(texts), -1, dtype='int64')
+    dropped = merged = 0
+
+    for old_id, (text, meta) in enumerate(zip(texts, metadata)):
+        if score_chunk(text)['score'] < min_quality:
+            dropped += 1
+            continue
+
+        previous = kept_metadata[-1] if kept_metadata else None
+        if (len(text.strip()) <= merge_max_length and previous is not None
+                and previous.get('source') == meta.get('source') and previous.get('page') == meta.get('page')):
+            kept_texts[-1] = f"{kept_texts[-1]}\n{text.strip()}"
+            previous['len'] = len(kept_texts[-1])
+            id_map[old_id] = len(kept_texts) - 1
+            merged += 1
+            continue
+
+        id_map[old_id] = len(kept_texts)
+        kept_texts.append(text)
+        kept_metadata.append(dict(meta))
+
+    report = {
+        'before': len(texts),
+        'after': len(kept_texts),
+        'dropped': dropped,
+        'merged': merged
+    }
+    logger.info(f"チャンクの品質フィルタ: {report['before']}件 -> {report['after']}件 "
+                f"(削除 {dropped}件 / 統合 {merged}件)")
+    return kept_texts, kept_metadata, id_map, report
+
+
+def save_id_map(id_map: np.ndarray, output_dir: str) -> str:
+    """旧ID→新IDの対応を faiss_id_remap.npy として保存"""
+    path = os.path.join(output_dir, 'faiss_id_remap.npy')
+    np.save(path, id_map)
+    return path
+
+
+def measure_search_ms(vectors: np.ndarray, queries: np.ndarray, k: int = 5) -> float:
+    """フラットインデックスの1クエリあたりの平均検索時間（ミリ秒）"""
+    import faiss
+
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query.reshape(1, -1), k)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def compact_artifacts(index_path: str, meta_path: str, texts_path: str, output_dir: str,
+                      min_quality: float = MIN_QUALITY, merge_max_length: int = MERGE_MAX_LENGTH,
+                      write_corpus_dir: bool = False) -> Dict:
+    """
+    既存の成果物から低品質なチャンクを取り除いて書き直す（埋め込みの再計算なし）
+
+    統合したチャンクのベクトルは統合先のものをそのまま使う
+
+    Returns:
+        ベクトル数と検索時間の変化を含む集計
+    """
+    from ann_index import load_flat_vectors
+    from build_faiss_index import rebuild_derived_artifacts, write_artifacts
+    from corpus_store import write_corpus
+
+    vectors = load_flat_vectors(index_path)
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    with open(texts_path, 'r', encoding='utf-8') as f:
+        texts = [json.loads(line).get('text', '') for line in f if line.strip()]
+
+    kept_texts, kept_metadata, id_map, report = prune_chunks(texts, metadata, min_quality, merge_max_length)
+    # 統合先は常に新IDの最初の出現なので、各新IDについて最初の旧IDのベクトルを使う
+    new_ids, first_old = np.unique(id_map, return_index=True)
+    kept_vectors = np.ascontiguousarray(vectors[first_old[new_ids >= 0]])
+
+    write_artifacts(kept_vectors, kept_texts, kept_metadata, output_dir)
+    save_id_map(id_map, output_dir)
+    # 出力先の corpus/ と派生インデックスが古いチャンクのIDのまま残らないようにする
+    corpus_dir = os.path.join(output_dir, 'corpus')
+    if write_corpus_dir or os.path.isdir(corpus_dir):
+        write_corpus(kept_texts, kept_metadata, corpus_dir)
+    report['derived'] = rebuild_derived_artifacts(kept_vectors, output_dir)
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=min(200, len(vectors)), replace=False)]
+    report['search_ms_before'] = measure_search_ms(vectors, queries)
+    report['search_ms_after'] = measure_search_ms(kept_vectors, queries)
+    return report
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='低品質なチャンクを取り除いてインデックスを圧縮')
+    parser.add_argument('--index', default=os.path.join(base_path, 'faiss_index_ip.faiss'))
+    parser.add_argument('--meta', default=os.path.join(base_path, 'faiss_meta.json'))
+    parser.add_argument('--texts', default=os.path.join(base_path, 'faiss_texts.jsonl'))
+    parser.add_argument('--output-dir', default=base_path)
+    parser.add_argument('--min-quality', type=float, default=MIN_QUALITY)
+    parser.add_argument('--merge-max-length', type=int, default=MERGE_MAX_LENGTH)
+    parser.add_argument('--corpus', action='store_true',
+                        help='コンパクトコーパス（corpus/）も書き出す（既にある場合は指定しなくても書き直す）')
+    parser.add_argument('--show', type=int, default=0, help='スコアの低いチャンクを指定件数表示して終了')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.show:
+        with open(args.texts, 'r', encoding='utf-8') as f:
+            texts = [json.loads(line).get('text', '') for line in f if line.strip()]
+        scored = sorted((score_chunk(text)['score'], i, text) for i, text in enumerate(texts))
+        for score, i, text in scored[:args.show]:
+            print(f"{score:.3f} #{i}: {text[:60]!r}")
+        return 0
+
+    report = compact_artifacts(args.index, args.meta, args.texts, args.output_dir,
+                               args.min_quality, args.merge_max_length, args.corpus)
+    print(f"✓ ベクトル数: {report['before']} -> {report['after']} "
+          f"(削除 {report['dropped']}件 / 統合 {report['merged']}件)")
+    print(f"✓ 検索時間: {report['search_ms_before']:.3f}ms -> {report['search_ms_after']:.3f}ms / クエリ")
+    derived = report['derived']
+    if derived['rebuilt'] or derived['removed']:
+        print(f"✓ 派生インデックス: 作り直し {derived['rebuilt']} / 削除 {derived['removed']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
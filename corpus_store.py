@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット コンパクトコーパスストア
+faiss_texts.jsonl / faiss_meta.json をバイナリ形式に変換し、mmapで遅延読み込みする
+
+ディレクトリ構成:
+    texts.bin       全チャンクのUTF-8テキストを連結したもの
+    offsets.npy     各チャンクの開始バイト位置（uint64, 件数+1）
+    source_ids.npy  ソースID（uint16）
+    pages.npy       ページ番号（int32）
+    lens.npy        テキスト長（int32）
+    sources.json    ソースIDとファイル名の対応
+    citations.json  重複統合したチャンクの出典（dedup.py、該当チャンクがある場合のみ）
+"""
+
+import os
+import sys
+import json
+import argparse
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusStore:
+    """mmapベースの読み取り専用コーパスストア"""
+
+    def __init__(self, corpus_dir: str):
+        """
+        Args:
+            corpus_dir: convert_jsonl_corpusで作成したディレクトリ
+        """
+        self.corpus_dir = corpus_dir
+        self.offsets = np.load(os.path.join(corpus_dir, 'offsets.npy'), mmap_mode='r')
+        self.source_ids = np.load(os.path.join(corpus_dir, 'source_ids.npy'), mmap_mode='r')
+        self.pages = np.load(os.path.join(corpus_dir, 'pages.npy'), mmap_mode='r')
+        self.lens = np.load(os.path.join(corpus_dir, 'lens.npy'), mmap_mode='r')
+        with open(os.path.join(corpus_dir, 'sources.json'), 'r', encoding='utf-8') as f:
+            self.sources = json.load(f)
+        # 重複統合したチャンクだけが持つので、IDをキーにした疎な辞書で保持する
+        self.citations: Dict[int, List[Dict]] = {}
+        citations_path = os.path.join(corpus_dir, 'citations.json')
+        if os.path.exists(citations_path):
+            with open(citations_path, 'r', encoding='utf-8') as f:
+                self.citations = {int(key): value for key, value in json.load(f).items()}
+
+        texts_path = os.path.join(corpus_dir, 'texts.bin')
+        if os.path.getsize(texts_path) > 0:
+            self.blob = np.memmap(texts_path, dtype='uint8', mode='r')
+        else:
+            # 空ファイルはmmapできないため空配列で代用
+            self.blob = np.zeros(0, dtype='uint8')
+
+        logger.info(f"コーパスを読み込みました: {corpus_dir} ({len(self)}件)")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def text(self, index: int) -> str:
+        """チャンクのテキストをデコードして返す"""
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def meta(self, index: int) -> Dict:
+        """faiss_meta.json と同じ形式のメタデータを返す"""
+        meta = {
+            'source': self.sources[int(self.source_ids[index])],
+            'page': int(self.pages[index]),
+            'len': int(self.lens[index])
+        }
+        if index in self.citations:
+            meta['citations'] = self.citations[index]
+        return meta
+
+    @property
+    def nbytes(self) -> int:
+        """ディスク上のコーパスサイズ（バイト）"""
+        return int(self.blob.nbytes + self.offsets.nbytes + self.source_ids.nbytes
+                   + self.pages.nbytes + self.lens.nbytes)
+
+
+def write_corpus(texts: List[str], metadata: List[Dict], output_dir: str) -> None:
+    """
+    テキストとメタデータのリストをコーパス形式で書き出す
+
+    Args:
+        texts: チャンクのテキスト
+        metadata: source / page / len を持つメタデータ
+        output_dir: 出力ディレクトリ
+    """
+    if len(texts) != len(metadata):
+        raise ValueError(f"テキスト数とメタデータ数が一致しません: {len(texts)} != {len(metadata)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    sources: List[str] = []
+    source_index: Dict[str, int] = {}
+    offsets = np.zeros(len(texts) + 1, dtype='uint64')
+    source_ids = np.zeros(len(texts), dtype='uint16')
+    pages = np.zeros(len(texts), dtype='int32')
+    lens = np.zeros(len(texts), dtype='int32')
+    citations: Dict[str, List[Dict]] = {}
+
+    with open(os.path.join(output_dir, 'texts.bin'), 'wb') as f:
+        position = 0
+        for i, (text, meta) in enumerate(zip(texts, metadata)):
+            encoded = text.encode('utf-8')
+            f.write(encoded)
+            position += len(encoded)
+            offsets[i + 1] = position
+
+            source = meta.get('source', '')
+            if source not in source_index:
+                source_index[source] = len(sources)
+                sources.append(source)
+            source_ids[i] = source_index[source]
+            pages[i] = int(meta.get('page', 0) or 0)
+            lens[i] = int(meta.get('len', len(text)))
+            if meta.get('citations'):
+                citations[str(i)] = meta['citations']
+
+    np.save(os.path.join(output_dir, 'offsets.npy'), offsets)
+    np.save(os.path.join(output_dir, 'source_ids.npy'), source_ids)
+    np.save(os.path.join(output_dir, 'pages.npy'), pages)
+    np.save(os.path.join(output_dir, 'lens.npy'), lens)
+    with open(os.path.join(output_dir, 'sources.json'), 'w', encoding='utf-8') as f:
+        json.dump(sources, f, ensure_ascii=False, indent=2)
+    citations_path = os.path.join(output_dir, 'citations.json')
+    if citations:
+        with open(citations_path, 'w', encoding='utf-8') as f:
+            json.dump(citations, f, ensure_ascii=False)
+    elif os.path.exists(citations_path):
+        os.remove(citations_path)
+
+
+def convert_jsonl_corpus(texts_path: str, meta_path: str, output_dir: str) -> int:
+    """
+    学習結果の faiss_texts.jsonl / faiss_meta.json をコーパス形式に変換
+
+    Returns:
+        変換したチャンク数
+    """
+    texts = []
+    with open(texts_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                texts.append(json.loads(line).get('text', ''))
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    write_corpus(texts, metadata, output_dir)
+    logger.info(f"コーパスを変換しました: {output_dir} ({len(texts)}件)")
+    return len(texts)
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='学習結果をコンパクトなコーパス形式に変換')
+    parser.add_argument('--texts', default=os.path.join(base_path, 'faiss_texts.jsonl'))
+    parser.add_argument('--meta', default=os.path.join(base_path, 'faiss_meta.json'))
+    parser.add_argument('--output', default=os.path.join(base_path, 'corpus'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = convert_jsonl_corpus(args.texts, args.meta, args.output)
+
+    store = CorpusStore(args.output)
+    print(f"✓ 変換完了: {count}件 -> {args.output} ({store.nbytes / (1024 * 1024):.1f}MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 重複チャンクの検出（MinHash-LSH）
+繰り返し現れる章見出しや同じページの再OCRなど、ほぼ同一のチャンクを1つにまとめる
+
+まとめたチャンクは代表の1ベクトルだけを残し、他のチャンクの出典（source / page）は
+代表のメタデータの citations に記録する
+"""
+
+import os
+import sys
+import json
+import zlib
+import argparse
+import unicodedata
+import logging
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 既定のパラメータ（16バンド × 4行で、Jaccard類似度 0.5 付近から候補になる）
+SHINGLE_SIZE = 5
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+DUPLICATE_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    空白を除いた正規化テキストの文字n-gramをハッシュ値の集合にする
+
+    Python の hash() はプロセスごとに値が変わるため crc32 を使う
+    """
+    text = ''.join(unicodedata.normalize('NFKC', text).lower().split())
+    if len(text) <= size:
+        grams = {text} if text else set()
+    else:
+        grams = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.array(sorted(zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype='uint64')
+
+
+class MinHasher:
+    """ランダムな一次関数 (a*x + b) mod p によるMinHashシグネチャ"""
+
+    def __init__(self, num_perm: int = NUM_BANDS * ROWS_PER_BAND, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype='uint64')
+        self.b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype='uint64')
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        シングルのハッシュ値からシグネチャを計算
+
+        Returns:
+            (num_perm,) のuint64配列（シングルが空の場合は全て最大値）
+        """
+        if len(hashes) == 0:
+            return np.full(self.num_perm, np.iinfo('uint64').max, dtype='uint64')
+        x = (hashes % _MERSENNE_PRIME)[:, None]
+        return ((self.a * x + self.b) % _MERSENNE_PRIME).min(axis=0)
+
+
+def estimated_jaccard(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """シグネチャの一致率（Jaccard類似度の推定値）"""
+    return float(np.mean(signature_a == signature_b))
+
+
+def find_duplicate_groups(texts: List[str], threshold: float = DUPLICATE_THRESHOLD,
+                          num_bands: int = NUM_BANDS, rows_per_band: int = ROWS_PER_BAND,
+                          shingle_size: int = SHINGLE_SIZE) -> List[List[int]]:
+    """
+    ほぼ同一のチャンクのグループを求める
+
+    LSHで同じバケットに入ったペアだけシグネチャを比較し、threshold 以上のペアを
+    Union-Findでまとめる
+
+    Returns:
+        2件以上からなるグループ（チャンクIDの昇順リスト）のリスト
+    """
+    hasher = MinHasher(num_bands * rows_per_band)
+    signatures = np.stack([hasher.signature(shingles(text, shingle_size)) for text in texts]) \
+        if texts else np.zeros((0, num_bands * rows_per_band), dtype='uint64')
+    empty = np.array([not text.strip() for text in texts], dtype=bool)
+
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(num_bands):
+        buckets: Dict[bytes, List[int]] = defaultdict(list)
+        rows = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        for i, row in enumerate(rows):
+            if not empty[i]:
+                buckets[row.tobytes()].append(i)
+        for members in buckets.values():
+            for j in members[1:]:
+                i = members[0]
+                pair = (i, j)
+                if pair in checked or find(i) == find(j):
+                    continue
+                checked.add(pair)
+                if estimated_jaccard(signatures[i], signatures[j]) >= threshold:
+                    parent[find(j)] = find(i)
+
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(texts)):
+        groups[find(i)].append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def dedup_chunks(texts: List[str], metadata: List[Dict], threshold: float = DUPLICATE_THRESHOLD
+                 ) -> Tuple[List[str], List[Dict], np.ndarray, Dict]:
+    """
+    ほぼ同一のチャンクを1つにまとめる
+
+    各グループの最も長いチャンクを代表として残し、他のチャンクの出典を
+    代表のメタデータの citations（{'source', 'page'} のリスト）に追加する
+
+    Returns:
+        (残ったテキスト, メタデータ, 旧ID→新IDの対応, 集計)
+    """
+    representative = np.arange(len(texts))
+    groups = find_duplicate_groups(texts, threshold)
+    for members in groups:
+        keep = max(members, key=lambda i: (len(texts[i]), -i))
+        representative[members] = keep
+
+    kept_ids = [i for i in range(len(texts)) if representative[i] == i]
+    new_id = {old: new for new, old in enumerate(kept_ids)}
+    id_map = np.array([new_id[int(representative[i])] for i in range(len(texts))], dtype='int64')
+
+    kept_texts = [texts[i] for i in kept_ids]
+    kept_metadata = [dict(metadata[i]) for i in kept_ids]
+    for i in range(len(texts)):
+        if representative[i] != i:
+            citations = kept_metadata[id_map[i]].setdefault('citations', [])
+            citation = {'source': metadata[i].get('source', ''), 'page': metadata[i].get('page', 0)}
+            if citation not in citations:
+                citations.append(citation)
+
+    removed = len(texts) - len(kept_texts)
+    report = {
+        'before': len(texts),
+        'after': len(kept_texts),
+        'removed': removed,
+        'groups': len(groups),
+        'largest_group': max((len(members) for members in groups), default=0),
+        'removed_ratio': removed / len(texts) if texts else 0.0
+    }
+    logger.info(f"重複チャンクの統合: {report['before']}件 -> {report['after']}件 "
+                f"({report['groups']}グループ, 削除 {removed}件)")
+    return kept_texts, kept_metadata, id_map, report
+
+
+def compose_id_maps(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """2段階の旧ID→新IDの対応を合成（どちらかで削除されたIDは-1）"""
+    return np.where(first >= 0, second[np.maximum(first, 0)], -1)
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='ほぼ同一のチャンクを検出して件数を報告')
+    parser.add_argument('--meta', default=os.path.join(base_path, 'faiss_meta.json'))
+    parser.add_argument('--texts', default=os.path.join(base_path, 'faiss_texts.jsonl'))
+    parser.add_argument('--threshold', type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument('--show', type=int, default=5, help='表示する重複グループの数')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with open(args.meta, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    with open(args.texts, 'r', encoding='utf-8') as f:
+        texts = [json.loads(line).get('text', '') for line in f if line.strip()]
+
+    groups = find_duplicate_groups(texts, args.threshold)
+    _, _, _, report = dedup_chunks(texts, metadata, args.threshold)
+    print(f"✓ チャンク数: {report['before']} -> {report['after']} "
+          f"(削除 {report['removed']}件 / {report['removed_ratio']:.1%}, {report['groups']}グループ)")
+
+    for members in sorted(groups, key=len, reverse=True)[:args.show]:
+        print(f"- {len(members)}件: " + ', '.join(
+            f"{metadata[i].get('source', '')} p.{metadata[i].get('page', '')}" for i in members[:5]))
+        print(f"    {texts[members[0]][:60]!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
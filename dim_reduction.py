@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 埋め込みの次元削減（PCA / 先頭次元の切り詰め）
+768次元のe5ベクトルを256 / 128次元に射影したフラットインデックスを構築する
+
+射影は faiss_index_{pca|truncate}{次元}.faiss と同じ名前の .proj.npz に保存し、
+検索時は同じ射影をクエリにも適用する
+"""
+
+import os
+import sys
+import argparse
+import logging
+from typing import Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 対応する次元削減の種類
+REDUCTION_TYPES = ('pca', 'truncate')
+
+
+class Projection:
+    """(x - mean) @ matrix.T を計算して正規化する線形射影"""
+
+    def __init__(self, kind: str, mean: np.ndarray, matrix: np.ndarray):
+        """
+        Args:
+            kind: 'pca' / 'truncate'
+            mean: (入力次元,) の中心化ベクトル
+            matrix: (出力次元, 入力次元) の射影行列
+        """
+        self.kind = kind
+        self.mean = np.ascontiguousarray(mean, dtype='float32')
+        self.matrix = np.ascontiguousarray(matrix, dtype='float32')
+
+    @property
+    def input_dim(self) -> int:
+        return int(self.matrix.shape[1])
+
+    @property
+    def output_dim(self) -> int:
+        return int(self.matrix.shape[0])
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        ベクトルを射影し、内積がコサイン類似度になるよう再正規化
+
+        Args:
+            vectors: (件数, 入力次元) の行列
+        """
+        projected = np.ascontiguousarray((np.asarray(vectors, dtype='float32') - self.mean) @ self.matrix.T)
+        faiss.normalize_L2(projected)
+        return projected
+
+    def save(self, path: str) -> None:
+        """npzファイルに保存（途中で失敗しても既存のファイルを壊さない）"""
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, kind=np.array(self.kind), mean=self.mean, matrix=self.matrix)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Projection':
+        """save で保存した射影を読み込む"""
+        with np.load(path) as data:
+            return cls(str(data['kind']), data['mean'], data['matrix'])
+
+
+def fit_pca(vectors: np.ndarray, dim: int) -> Projection:
+    """
+    共分散行列の固有ベクトルから上位dim次元の主成分への射影を学習
+
+    Args:
+        vectors: (件数, 入力次元) の学習ベクトル
+        dim: 出力次元
+    """
+    vectors = np.asarray(vectors, dtype='float64')
+    if dim > vectors.shape[1]:
+        raise ValueError(f"出力次元が入力次元を超えています: {dim} > {vectors.shape[1]}")
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    covariance = centered.T @ centered / max(1, len(vectors) - 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:dim]
+    explained = float(eigenvalues[order].sum() / eigenvalues.sum()) if eigenvalues.sum() > 0 else 0.0
+    logger.info(f"PCAを学習しました: {vectors.shape[1]} -> {dim}次元（寄与率 {explained:.1%}）")
+    return Projection('pca', mean, eigenvectors[:, order].T)
+
+
+def truncation(input_dim: int, dim: int) -> Projection:
+    """先頭dim次元だけを残す射影（Matryoshka学習されたモデル向け）"""
+    if dim > input_dim:
+        raise ValueError(f"出力次元が入力次元を超えています: {dim} > {input_dim}")
+    return Projection('truncate', np.zeros(input_dim, dtype='float32'), np.eye(input_dim, dtype='float32')[:dim])
+
+
+def make_projection(vectors: np.ndarray, kind: str, dim: int) -> Projection:
+    """種類に応じて射影を作成"""
+    if kind == 'pca':
+        return fit_pca(vectors, dim)
+    if kind == 'truncate':
+        return truncation(vectors.shape[1], dim)
+    raise ValueError(f"未対応の次元削減です: {kind}")
+
+
+def reduced_index_path(flat_index_path: str, kind: str, dim: int) -> str:
+    """
+    次元削減したインデックスの保存先
+
+    例: 学習結果/faiss_index_ip.faiss -> 学習結果/faiss_index_pca256.faiss
+    """
+    return os.path.join(os.path.dirname(flat_index_path), f"faiss_index_{kind}{dim}.faiss")
+
+
+def projection_path(index_path: str) -> str:
+    """インデックスと対になる射影ファイルのパス"""
+    return os.path.splitext(index_path)[0] + '.proj.npz'
+
+
+def build_reduced_index(vectors: np.ndarray, projection: Projection) -> faiss.Index:
+    """射影したベクトルのフラットインデックスを構築"""
+    index = faiss.IndexFlatIP(projection.output_dim)
+    index.add(projection.apply(vectors))
+    return index
+
+
+def load_projection(index_path: str) -> Optional[Projection]:
+    """インデックスに対応する射影があれば読み込む"""
+    path = projection_path(index_path)
+    return Projection.load(path) if os.path.exists(path) else None
+
+
+def main():
+    """メイン関数"""
+    from ann_index import load_flat_vectors
+
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='フラットインデックスから次元削減したインデックスを構築')
+    parser.add_argument('--index', default=os.path.join(base_path, 'faiss_index_ip.faiss'))
+    parser.add_argument('--kind', choices=REDUCTION_TYPES, default='pca')
+    parser.add_argument('--dim', type=int, default=256)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    vectors = load_flat_vectors(args.index)
+    projection = make_projection(vectors, args.kind, args.dim)
+    index = build_reduced_index(vectors, projection)
+
+    output_path = reduced_index_path(args.index, args.kind, args.dim)
+    faiss.write_index(index, output_path + '.tmp')
+    projection.save(projection_path(output_path))
+    os.replace(output_path + '.tmp', output_path)
+    print(f"✓ {args.kind}{args.dim}インデックスを保存しました: {output_path}")
+    print(f"✓ 射影を保存しました: {projection_path(output_path)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,23 +5,195 @@ Colabで学習済みのFAISSインデックスを使用したRAG機能を提供
 
 import os
 import json
+import math
+import struct
+import time
+import threading
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 import logging
 
+from ann_index import (COMPRESSED_INDEX_TYPES, ann_index_path, get_search_params,
+                       rerank_exact, set_search_params, supports_id_selector)
+from corpus_store import CorpusStore
+from dim_reduction import REDUCTION_TYPES, Projection, projection_path, reduced_index_path
+from lexical_index import CharNgramBM25, reciprocal_rank_fusion
+from message_analysis import MessageAnalysis, analyze_message
+from query_cache import QueryEmbeddingCache
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class MmapFlatIndex:
+    """
+    IndexFlatIPファイルをmmapで読み込む読み取り専用インデックス
+
+    ベクトル本体はページキャッシュ上に置かれるため、
+    gunicornの複数ワーカー間で同じ物理ページが共有される
+    """
+
+    # faiss.write_index が書き出すフラットインデックスのヘッダ識別子
+    FLAT_FOURCCS = (b'IxFI', b'IxF2', b'IxFl')
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: write_indexで保存されたフラットインデックスのパス
+        """
+        with open(path, 'rb') as f:
+            header = f.read(4 + 4 + 8 + 8 + 8 + 1 + 4)
+        fourcc = header[:4]
+        if fourcc not in self.FLAT_FOURCCS:
+            raise ValueError(f"mmap読み込みはフラットインデックスのみ対応しています: {fourcc!r}")
+
+        d, ntotal = struct.unpack_from('<iq', header, 4)
+        metric_type = struct.unpack_from('<i', header, 4 + 4 + 8 + 8 + 8 + 1)[0]
+
+        # ベクトル本体はファイル末尾に ntotal * d 個のfloat32として格納されている
+        data_bytes = ntotal * d * 4
+        offset = os.path.getsize(path) - data_bytes
+        if offset <= 0:
+            raise ValueError(f"インデックスファイルのサイズが不正です: {path}")
+
+        self.path = path
+        self.d = d
+        self.ntotal = ntotal
+        self.metric_type = metric_type
+        self.xb = np.memmap(path, dtype='float32', mode='r', offset=offset, shape=(ntotal, d))
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        faiss.Index.search と同じ形式で (distances, indices) を返す
+
+        k がベクトル数より大きい場合も faiss と同じく (クエリ数, k) の形で、不足分は -inf と -1
+        """
+        x = np.ascontiguousarray(x, dtype='float32')
+        distances, indices = faiss.knn(x, self.xb, min(k, self.ntotal), metric=self.metric_type)
+        if distances.shape[1] < k:
+            return _merge_topk([(distances, indices)], k, len(x))
+        return distances, indices
+
+    def search_ranges(self, x: np.ndarray, k: int,
+                      id_ranges: List[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        指定したIDの範囲だけを検索（範囲外のページはディスクから読まれない）
+        
+        Args:
+            id_ranges: (開始ID, 終了ID) の半開区間のリスト
+        """
+        x = np.ascontiguousarray(x, dtype='float32')
+        parts = []
+        for start, end in id_ranges:
+            distances, indices = faiss.knn(x, self.xb[start:end], min(k, end - start), metric=self.metric_type)
+            parts.append((distances, np.where(indices >= 0, indices + start, -1)))
+        return _merge_topk(parts, k, len(x))
+    
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        """指定範囲のベクトルを取得"""
+        return np.array(self.xb[i0:i0 + n])
+
+
+def _merge_topk(parts: List[Tuple[np.ndarray, np.ndarray]], k: int,
+                n_queries: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    複数の検索結果を内積の大きい順に統合して上位k件にする
+    
+    Returns:
+        (クエリ数, k) の distances と indices（不足分は -inf と -1）
+    """
+    parts = [(d, i) for d, i in parts if i.shape[1] > 0]
+    if not parts:
+        return (np.full((n_queries, k), -np.inf, dtype='float32'),
+                np.full((n_queries, k), -1, dtype='int64'))
+    distances = np.concatenate([d for d, _ in parts], axis=1)
+    indices = np.concatenate([i for _, i in parts], axis=1)
+    distances = np.where(indices >= 0, distances, -np.inf)
+    if distances.shape[1] < k:
+        pad = k - distances.shape[1]
+        distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=-np.inf)
+        indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+    order = np.argsort(-distances, axis=1, kind='stable')[:, :k]
+    return (np.take_along_axis(distances, order, axis=1).astype('float32'),
+            np.take_along_axis(indices, order, axis=1))
+
+
+def _ids_in_ranges(indices: np.ndarray, id_ranges: List[Tuple[int, int]]) -> np.ndarray:
+    """IDの配列のうち、いずれかの半開区間に含まれる要素をTrueにした真偽値配列"""
+    allowed = np.zeros(indices.shape, dtype=bool)
+    for start, end in id_ranges:
+        allowed |= (indices >= start) & (indices < end)
+    return allowed
+
+
+def _mask_to_ranges(mask: np.ndarray, offset: int = 0) -> List[Tuple[int, int]]:
+    """真偽値配列の連続するTrueの区間を (開始, 終了) の半開区間のリストにする"""
+    padded = np.concatenate([[False], mask, [False]]).astype('int8')
+    edges = np.flatnonzero(np.diff(padded))
+    return [(int(start) + offset, int(end) + offset) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def _read_proc_memory(path: Optional[str] = None) -> Dict:
+    """
+    /proc/self から常駐メモリと共有メモリのバイト数を取得
+
+    Args:
+        path: 指定した場合はそのファイルのマッピングのみを集計
+
+    Returns:
+        rss_bytes / shared_bytes / private_bytes の辞書（Linux以外では空）
+    """
+    fields = {'Rss': 0, 'Shared_Clean': 0, 'Shared_Dirty': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    smaps = '/proc/self/smaps' if path else '/proc/self/smaps_rollup'
+    if not os.path.exists(smaps):
+        return {}
+
+    target = os.path.realpath(path) if path else None
+    in_target = target is None
+    with open(smaps, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if not parts[0].endswith(':'):
+                # マッピングのヘッダ行: "addr perms offset dev inode pathname"
+                in_target = target is None or (len(parts) >= 6 and ' '.join(parts[5:]) == target)
+                continue
+            key = parts[0][:-1]
+            if in_target and key in fields:
+                fields[key] += int(parts[1]) * 1024
+
+    return {
+        'rss_bytes': fields['Rss'],
+        'shared_bytes': fields['Shared_Clean'] + fields['Shared_Dirty'],
+        'private_bytes': fields['Private_Clean'] + fields['Private_Dirty']
+    }
+
+
 class FAISSVectorStore:
     """FAISSベクトルストア管理クラス"""
     
     def __init__(self, 
                  index_path: str = "./学習結果/faiss_index_ip.faiss",
                  meta_path: str = "./学習結果/faiss_meta.json",
-                 texts_path: str = "./学習結果/faiss_texts.jsonl"):
+                 texts_path: str = "./学習結果/faiss_texts.jsonl",
+                 use_mmap: bool = False,
+                 corpus_dir: Optional[str] = None,
+                 query_cache_size: int = 1024,
+                 query_cache_ttl: Optional[float] = 3600,
+                 index_type: str = 'flat',
+                 nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None,
+                 rerank_factor: int = 4,
+                 append_log_path: Optional[str] = None,
+                 hybrid: bool = False,
+                 rrf_k: int = 60,
+                 encoder_backend: str = 'torch',
+                 onnx_model_dir: Optional[str] = None,
+                 reduction: Optional[str] = None,
+                 reduced_dim: int = 256):
         """
         FAISSVectorStoreの初期化
         
@@ -29,34 +201,164 @@ class FAISSVectorStore:
             index_path: FAISSインデックスファイルのパス
             meta_path: メタデータJSONファイルのパス
             texts_path: テキストJSONLファイルのパス
+            use_mmap: Trueの場合インデックスをmmapで読み込み、ワーカー間で共有する
+            corpus_dir: コンパクトコーパスのディレクトリ（存在すればJSONLの代わりに使用）
+            query_cache_size: クエリ埋め込みキャッシュの最大件数（0で無効）
+            query_cache_ttl: クエリ埋め込みキャッシュの有効期間（秒）
+            index_type: 'flat'（全探索）/ 'ivf' / 'hnsw' / 'sq8' / 'pq'（ann_index.pyで構築）
+            nprobe: IVFで探索するクラスタ数
+            ef_search: HNSWの探索幅
+            rerank_factor: 圧縮インデックス（sq8 / pq）で取得する候補数の倍率。
+                候補はfloatベクトルとの正確な内積で再ランキングされる
+            append_log_path: add_documentsで追加したチャンクの追記ログ
+                （Noneの場合はインデックスと同じディレクトリの faiss_append_log.jsonl）
+            hybrid: Trueの場合、文字n-gram BM25とベクトル検索の結果をRRFで統合する
+            rrf_k: Reciprocal Rank Fusionの定数
+            encoder_backend: 'torch'（SentenceTransformer）/ 'onnx'（ONNX Runtime + int8量子化）/
+                'onnx-fp32'（ONNX Runtime、量子化なし）
+            onnx_model_dir: onnx_encoder.py で書き出したディレクトリ
+                （Noneの場合はインデックスと同じディレクトリの onnx_e5）
+            reduction: 'pca' / 'truncate' の場合、dim_reduction.py で構築した次元削減インデックスを使い、
+                クエリにも同じ射影を適用する（flatのみ対応）
+            reduced_dim: 次元削減後の次元数
         """
         self.index_path = index_path
+        # 次元削減版に切り替える前の、全次元のフラットインデックス（件数の照合に使う）
+        self.flat_index_path = index_path
         self.meta_path = meta_path
         self.texts_path = texts_path
+        self.use_mmap = use_mmap
+        self.corpus_dir = corpus_dir
+        self.index_type = index_type
+        self.rerank_factor = rerank_factor
+        self.append_log_path = append_log_path or os.path.join(
+            os.path.dirname(index_path), "faiss_append_log.jsonl")
+        self.append_vectors_path = os.path.splitext(self.append_log_path)[0] + ".f32"
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.encoder_backend = encoder_backend
+        self.onnx_model_dir = onnx_model_dir or os.path.join(os.path.dirname(index_path), "onnx_e5")
+        self.reduction = reduction
+        self.reduced_dim = reduced_dim
+        self.projection: Optional[Projection] = None
         
         self.index = None
+        self.float_vectors = None
         self.metadata = None
         self.texts = None
+        self.corpus = None
         self.embedding_model = None
+        self.lexical_index = None
+        self.source_ranges: Dict[str, Tuple[int, int]] = {}
+        self._source_ids = None
+        self._pages = None
+        self.query_cache = QueryEmbeddingCache(max_size=query_cache_size, ttl_seconds=query_cache_ttl)
         
-        self.load_faiss_index()
-        self.load_metadata()
-        self.load_texts()
-        self.init_embedding_model()
+        # 追加ドキュメント: (追加分のみのIndexFlatIP, ドキュメントのリスト)
+        # 検索中に差し替えても安全なよう、追加のたびに新しいタプルを作って丸ごと置き換える
+        self._appended: Tuple[Optional[faiss.Index], List[Dict]] = (None, [])
+        self._append_lock = threading.Lock()
+        # 追記ログのうち、読み込み・追加に成功した部分のバイト数
+        self._append_log_size = 0
+        
+        # 読み込みの各段階にかかった時間（秒）。/api/health で起動状況として返す
+        self.load_timings: Dict[str, float] = {}
+        
+        if reduction:
+            self._timed('projection', self.load_projection)
+        self._timed('index', self.load_faiss_index)
+        self.set_search_params(nprobe=nprobe, ef_search=ef_search)
+        if corpus_dir and os.path.isdir(corpus_dir):
+            self._timed('corpus', self.load_corpus)
+        else:
+            self._timed('metadata', self.load_metadata)
+            self._timed('texts', self.load_texts)
+        self.check_consistency()
+        self._timed('source_ranges', self.build_source_ranges)
+        self._timed('append_log', self.load_append_log)
+        if hybrid:
+            self._timed('lexical_index', self.build_lexical_index)
+        self._timed('embedding_model', self.init_embedding_model)
+    
+    def _timed(self, phase: str, func):
+        """初期化の1段階を実行し、かかった時間を load_timings に記録"""
+        start = time.perf_counter()
+        func()
+        self.load_timings[phase] = round(time.perf_counter() - start, 3)
     
     def load_faiss_index(self):
         """FAISSインデックスの読み込み"""
         try:
-            if os.path.exists(self.index_path):
-                self.index = faiss.read_index(self.index_path)
-                logger.info(f"FAISSインデックスを読み込みました: {self.index_path}")
+            path = ann_index_path(self.index_path, self.index_type)
+            if os.path.exists(path):
+                if self.index_type == 'flat' and self.use_mmap:
+                    self.index = MmapFlatIndex(path)
+                elif self.use_mmap and self.index_type == 'ivf':
+                    # IVFの転置リストはmmapで読み込める（HNSWのグラフは非対応）
+                    self.index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+                else:
+                    self.index = faiss.read_index(path)
+                mode = 'mmap' if self._index_mmapped() else 'memory'
+                logger.info(f"FAISSインデックスを読み込みました: {path} ({self.index_type}, {mode})")
                 logger.info(f"インデックスサイズ: {self.index.ntotal} ベクトル")
+                
+                if self.index_type in COMPRESSED_INDEX_TYPES:
+                    self.load_float_vectors()
             else:
-                raise FileNotFoundError(f"FAISSインデックスファイルが見つかりません: {self.index_path}")
+                raise FileNotFoundError(f"FAISSインデックスファイルが見つかりません: {path}")
         except Exception as e:
             logger.error(f"FAISSインデックス読み込みエラー: {str(e)}")
             raise
     
+    def load_projection(self):
+        """次元削減の射影を読み込み、検索に使うインデックスを次元削減版に切り替える"""
+        try:
+            if self.reduction not in REDUCTION_TYPES:
+                raise ValueError(f"未対応の次元削減です: {self.reduction}")
+            if self.index_type != 'flat':
+                raise ValueError(f"次元削減はflatインデックスのみ対応しています: {self.index_type}")
+            self.index_path = reduced_index_path(self.index_path, self.reduction, self.reduced_dim)
+            path = projection_path(self.index_path)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"射影ファイルが見つかりません: {path}（python dim_reduction.py で作成）")
+            self.projection = Projection.load(path)
+            logger.info(f"射影を読み込みました: {path} ({self.projection.input_dim} -> {self.projection.output_dim}次元)")
+        except Exception as e:
+            logger.error(f"射影読み込みエラー: {str(e)}")
+            raise
+    
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        """埋め込みモデルの出力をインデックスの次元に射影（次元削減なしの場合はそのまま）"""
+        if self.projection is None:
+            return vectors
+        return self.projection.apply(vectors)
+    
+    def load_float_vectors(self):
+        """
+        再ランキング用のfloatベクトルをフラットインデックスからmmapで読み込む
+        
+        ヒープには載せず、検索時に候補の行だけがページキャッシュから読まれる
+        """
+        if os.path.exists(self.index_path):
+            self.float_vectors = MmapFlatIndex(self.index_path).xb
+            logger.info(f"再ランキング用ベクトルをmmapで読み込みました: {self.index_path}")
+        else:
+            logger.warning(f"フラットインデックスがないため再ランキングを行いません: {self.index_path}")
+    
+    def _index_mmapped(self) -> bool:
+        """インデックスがmmapで読み込まれているか"""
+        return self.use_mmap and self.index_type in ('flat', 'ivf')
+    
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        近似インデックスの検索時パラメータを実行中に変更
+        
+        Args:
+            nprobe: IVFで探索するクラスタ数（大きいほど高精度・低速）
+            ef_search: HNSWの探索幅（大きいほど高精度・低速）
+        """
+        set_search_params(self.index, nprobe=nprobe, ef_search=ef_search)
+    
     def load_metadata(self):
         """メタデータの読み込み"""
         try:
@@ -88,52 +390,376 @@ class FAISSVectorStore:
             logger.error(f"テキストデータ読み込みエラー: {str(e)}")
             raise
     
-    def init_embedding_model(self):
-        """埋め込みモデルの初期化"""
+    def load_corpus(self):
+        """コンパクトコーパスの読み込み（テキストは検索時に遅延デコード）"""
         try:
-            # Colabで使用したのと同じモデル
-            self.embedding_model = SentenceTransformer('intfloat/multilingual-e5-base')
-            logger.info("埋め込みモデルを初期化しました: intfloat/multilingual-e5-base")
+            self.corpus = CorpusStore(self.corpus_dir)
         except Exception as e:
-            logger.error(f"埋め込みモデル初期化エラー: {str(e)}")
+            logger.error(f"コーパス読み込みエラー: {str(e)}")
+            raise
+    
+    def check_consistency(self):
+        """
+        インデックスのベクトル数とコーパス（またはメタデータ・テキスト）の件数、
+        近似・次元削減インデックスとフラットインデックスのベクトル数が一致するか確認
+
+        チャンク数を変えて再構築した後に古い派生インデックスが残っていると、
+        IDが別のチャンクを指すため、読み込み時に ValueError で止める
+        """
+        ntotal = self.index.ntotal
+        counts = {'corpus': len(self.corpus)} if self.corpus is not None else {
+            'metadata': len(self.metadata), 'texts': len(self.texts)}
+        if self.float_vectors is not None:
+            counts['flat_index'] = len(self.float_vectors)
+        elif self.flat_index_path != ann_index_path(self.index_path, self.index_type) \
+                and os.path.exists(self.flat_index_path):
+            counts['flat_index'] = MmapFlatIndex(self.flat_index_path).ntotal
+
+        mismatched = {name: count for name, count in counts.items() if count != ntotal}
+        if mismatched:
+            detail = ', '.join(f"{name}={count}" for name, count in mismatched.items())
+            message = (f"インデックス（{self.index_type}, {ntotal}ベクトル）と件数が一致しません: {detail}"
+                       f"（build_faiss_index.py / ann_index.py / dim_reduction.py で作り直してください）")
+            logger.error(message)
+            raise ValueError(message)
+    
+    def _base_count(self) -> int:
+        """学習済みの（追加分を除く）ドキュメント数"""
+        if self.corpus is not None:
+            return len(self.corpus)
+        return len(self.texts) if self.texts else 0
+    
+    def _document_count(self) -> int:
+        """ドキュメント数（add_documentsで追加した分を含む）"""
+        return self._base_count() + len(self._appended[1])
+    
+    def _get_text(self, index: int) -> str:
+        """ドキュメントのテキストを取得"""
+        base_count = self._base_count()
+        if index >= base_count:
+            return self._appended[1][index - base_count]['text']
+        if self.corpus is not None:
+            return self.corpus.text(index)
+        return self.texts[index].get('text', '')
+    
+    def _get_meta(self, index: int) -> Dict:
+        """ドキュメントのメタデータを取得"""
+        base_count = self._base_count()
+        if index >= base_count:
+            return self._appended[1][index - base_count]
+        if self.corpus is not None:
+            return self.corpus.meta(index)
+        return self.metadata[index] if index < len(self.metadata) else {}
+    
+    def build_source_ranges(self):
+        """
+        メタデータからソース（書籍）ごとのID範囲とページ番号の列を作成
+        
+        学習結果のチャンクは書籍ごとに連続して並んでいるため、
+        書籍での絞り込みはID範囲だけで表現できる
+        """
+        if self.corpus is not None:
+            self._source_ids = np.asarray(self.corpus.source_ids)
+            self._pages = np.asarray(self.corpus.pages)
+            names = self.corpus.sources
+        else:
+            names = []
+            name_ids: Dict[str, int] = {}
+            source_ids = []
+            for meta in self.metadata[:self._base_count()]:
+                source = meta.get('source', '')
+                if source not in name_ids:
+                    name_ids[source] = len(names)
+                    names.append(source)
+                source_ids.append(name_ids[source])
+            self._source_ids = np.array(source_ids, dtype='int32')
+            self._pages = np.array([int(meta.get('page', 0) or 0) for meta in self.metadata[:self._base_count()]],
+                                   dtype='int32')
+        
+        self.source_ranges = {}
+        for source_id, name in enumerate(names):
+            ranges = _mask_to_ranges(self._source_ids == source_id)
+            if len(ranges) == 1:
+                self.source_ranges[name] = ranges[0]
+            elif ranges:
+                # 書籍のチャンクが連続していない場合は全体を範囲とし、ページと同様にマスクで絞り込む
+                self.source_ranges[name] = (ranges[0][0], ranges[-1][1])
+    
+    def get_sources(self) -> List[str]:
+        """検索対象の書籍（ソースファイル名）の一覧"""
+        sources = list(self.source_ranges)
+        for doc in self._appended[1]:
+            if doc.get('source') and doc['source'] not in sources:
+                sources.append(doc['source'])
+        return sources
+    
+    def _filter_ranges(self, source: Optional[str] = None,
+                       page_range: Optional[Tuple[int, int]] = None) -> Optional[List[Tuple[int, int]]]:
+        """
+        書籍・ページ範囲の条件に合うドキュメントIDの区間を求める
+        
+        Args:
+            source: ソースファイル名（例: omae_kenichi_01.pdf）
+            page_range: (開始ページ, 終了ページ)（両端を含む）
+            
+        Returns:
+            (開始ID, 終了ID) の半開区間のリスト。条件がない場合はNone
+        """
+        if source is None and page_range is None:
+            return None
+        
+        if source is not None:
+            if source not in self.source_ranges:
+                base_ranges = []
+            else:
+                start, end = self.source_ranges[source]
+                mask = np.ones(end - start, dtype=bool)
+                if page_range is not None:
+                    pages = self._pages[start:end]
+                    mask &= (pages >= page_range[0]) & (pages <= page_range[1])
+                # 書籍のチャンクが連続していない場合に備えてソースIDでも絞り込む
+                source_id = self._source_ids[start]
+                mask &= self._source_ids[start:end] == source_id
+                base_ranges = _mask_to_ranges(mask, offset=start)
+        else:
+            base_ranges = _mask_to_ranges((self._pages >= page_range[0]) & (self._pages <= page_range[1]))
+        
+        # add_documentsで追加したドキュメントはメタデータを直接判定する
+        base_count = self._base_count()
+        appended_mask = np.array([
+            (source is None or doc.get('source') == source) and
+            (page_range is None or page_range[0] <= int(doc.get('page', 0) or 0) <= page_range[1])
+            for doc in self._appended[1]
+        ], dtype=bool)
+        return base_ranges + _mask_to_ranges(appended_mask, offset=base_count)
+    
+    def build_lexical_index(self):
+        """全ドキュメント（追加分を含む）から文字n-gram BM25インデックスを構築"""
+        try:
+            count = self._document_count()
+            self.lexical_index = CharNgramBM25(self._get_text(i) for i in range(count))
+        except Exception as e:
+            logger.error(f"n-gramインデックス構築エラー: {str(e)}")
+            raise
+    
+    def _append_dim(self) -> int:
+        """追記ログに保存するベクトルの次元（射影前の埋め込みモデルの出力）"""
+        return self.projection.input_dim if self.projection is not None else self.index.d
+    
+    def _read_append_log(self) -> Tuple[List[Dict], List[int]]:
+        """
+        追記ログの行を読み込む
+        
+        書き込みの途中で失敗した行（改行のない最後の行・JSONとして読めない行）があれば、
+        それ以降は位置の対応が取れないため読み込まない
+        
+        Returns:
+            (ドキュメントのリスト, 各行の末尾のバイト位置)
+        """
+        docs, ends, position = [], [], 0
+        with open(self.append_log_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    logger.warning(f"追記ログの最後の行が途中で切れています: {self.append_log_path}")
+                    break
+                position += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    docs.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"追記ログに読み込めない行があります: {self.append_log_path} ({len(docs) + 1}行目以降を無視)")
+                    break
+                ends.append(position)
+        return docs, ends
+    
+    def _truncate_append_files(self, count: int, log_size: int):
+        """
+        追記ログとベクトルを有効な件数に切り詰める
+        
+        追加の途中で失敗した分（ログ行のないベクトル・途中で切れたログ行）が残っていると、
+        以降の追加分のログ行とベクトルの位置がずれるため、読み込み時と追加の前に取り除く
+        """
+        for path, size in ((self.append_log_path, log_size),
+                           (self.append_vectors_path, count * self._append_dim() * 4)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                logger.warning(f"追記ログの書き込みに失敗した分を取り除きます: {path}")
+                os.truncate(path, size)
+    
+    def load_append_log(self):
+        """
+        追記ログから追加済みドキュメントを復元（埋め込みの再計算は不要）
+        
+        ベクトルを先に書き、ログ行を後に書くため、ログ行のあるものだけを有効とする
+        """
+        if not os.path.exists(self.append_log_path) and not os.path.exists(self.append_vectors_path):
+            return
+        try:
+            docs, ends = self._read_append_log() if os.path.exists(self.append_log_path) else ([], [])
+            
+            # 追記ログには埋め込みモデルの出力をそのまま保存し、読み込み時に射影する
+            d = self._append_dim()
+            vectors = np.fromfile(self.append_vectors_path, dtype='float32') \
+                if os.path.exists(self.append_vectors_path) else np.zeros(0, dtype='float32')
+            count = min(len(docs), len(vectors) // d)
+            if count < len(docs):
+                logger.warning(f"追記ログのベクトルが不足しています: {len(docs)}件中{count}件を復元")
+            
+            self._append_log_size = ends[count - 1] if count else 0
+            self._truncate_append_files(count, self._append_log_size)
+            
+            delta_index = faiss.IndexFlatIP(self.index.d)
+            delta_index.add(self._project(np.ascontiguousarray(vectors[:count * d].reshape(count, d))))
+            self._appended = (delta_index, docs[:count])
+            logger.info(f"追記ログを読み込みました: {self.append_log_path} ({count}件)")
+        except Exception as e:
+            logger.error(f"追記ログ読み込みエラー: {str(e)}")
+            raise
+    
+    def add_documents(self, chunks: List[Dict], batch_size: int = 32) -> int:
+        """
+        インデックスを再構築せずにチャンクを追加
+        
+        埋め込みはロックの外で計算するため、その間も検索は通常どおり動作する。
+        追加分は追記ログに記録され、再起動後は埋め込みを再計算せずに復元される。
+        
+        Args:
+            chunks: text / source / page を持つチャンクのリスト
+            batch_size: 埋め込みモデルのバッチサイズ
+            
+        Returns:
+            追加したチャンク数
+        """
+        chunks = [chunk for chunk in chunks if chunk.get('text', '').strip()]
+        if not chunks:
+            return 0
+        
+        try:
+            passages = [f"passage: {chunk['text']}" for chunk in chunks]
+            vectors = self.embedding_model.encode(passages, batch_size=batch_size, normalize_embeddings=True)
+            vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(len(chunks), -1)
+            
+            docs = [{
+                'text': chunk['text'],
+                'source': chunk.get('source', ''),
+                'page': chunk.get('page', 0),
+                'len': len(chunk['text'])
+            } for chunk in chunks]
+            
+            lines = ''.join(json.dumps(doc, ensure_ascii=False) + '\n' for doc in docs).encode('utf-8')
+            
+            with self._append_lock:
+                # 前回の追加で失敗した分を取り除いてから、ベクトル -> ログ行の順に書く
+                # （ログ行まで書けた追加分だけが再起動後に復元される）
+                self._truncate_append_files(len(self._appended[1]), self._append_log_size)
+                with open(self.append_vectors_path, 'ab') as f:
+                    f.write(vectors.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.append_log_path, 'ab') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._append_log_size += len(lines)
+                
+                # 新しい追加分インデックスを作ってから丸ごと差し替える（検索側はロック不要）
+                old_index, old_docs = self._appended
+                delta_index = faiss.IndexFlatIP(self.index.d)
+                if old_index is not None and old_index.ntotal:
+                    delta_index.add(old_index.reconstruct_n(0, old_index.ntotal))
+                delta_index.add(self._project(vectors))
+                self._appended = (delta_index, old_docs + docs)
+                
+                if self.lexical_index is not None:
+                    # 追加分のn-gramだけを抽出して既存のポスティングに加えたインデックスに差し替える
+                    self.lexical_index = self.lexical_index.extended(doc['text'] for doc in docs)
+            
+            logger.info(f"ドキュメントを追加しました: {len(docs)}件（追加分合計 {len(self._appended[1])}件）")
+            return len(docs)
+            
+        except Exception as e:
+            logger.error(f"ドキュメント追加エラー: {str(e)}")
             raise
     
-    def search_similar(self, query: str, n_results: int = 5) -> List[Dict]:
+    def init_embedding_model(self, backend: Optional[str] = None):
+        """
+        埋め込みモデルの初期化
+        
+        Args:
+            backend: 'torch' / 'onnx' / 'onnx-fp32'（Noneの場合はコンストラクタの encoder_backend）
+        """
+        backend = backend or self.encoder_backend
+        try:
+            if backend in ('onnx', 'onnx-fp32'):
+                # onnxruntimeは任意の依存関係のため、選択した場合のみ読み込む
+                from onnx_encoder import OnnxEncoder
+                self.embedding_model = OnnxEncoder(self.onnx_model_dir, quantized=(backend == 'onnx'))
+            elif backend == 'torch':
+                # torchの読み込みに時間がかかるため、モジュールの読み込み時ではなくここでimportする
+                from sentence_transformers import SentenceTransformer
+                
+                # Colabで使用したのと同じモデル
+                self.embedding_model = SentenceTransformer('intfloat/multilingual-e5-base')
+            else:
+                raise ValueError(f"未対応のエンコーダーです: {backend}")
+            self.encoder_backend = backend
+            # バックエンドが変わると埋め込みも僅かに変わるため、キャッシュ済みのクエリは使わない
+            self.query_cache.clear()
+            logger.info(f"埋め込みモデルを初期化しました: intfloat/multilingual-e5-base ({backend})")
+        except Exception as e:
+            logger.error(f"埋め込みモデル初期化エラー: {str(e)}")
+            raise
+
+    def share_memory(self) -> bool:
+        """
+        fork前に、埋め込みモデルの重みテンソルを共有メモリ（/dev/shm）へ移す
+
+        gunicornのマスターで読み込んだ場合、通常のページはコピーオンライトのため
+        ワーカーが書き込むと複製されるが、共有メモリ上のテンソルは常に全ワーカーで1つになる
+
+        Returns:
+            移動した場合はTrue（ONNX Runtimeなど torch.nn.Module でない場合はFalse）
+        """
+        share = getattr(self.embedding_model, 'share_memory', None)
+        if not callable(share):
+            return False
+        try:
+            share()
+            logger.info("埋め込みモデルの重みを共有メモリに移動しました")
+            return True
+        except Exception as e:
+            logger.error(f"共有メモリへの移動エラー: {str(e)}")
+            raise
+
+    def search_similar(self, query: Union[str, MessageAnalysis], n_results: int = 5, source: Optional[str] = None,
+                       page_range: Optional[Tuple[int, int]] = None) -> List[Dict]:
         """
         類似ドキュメントの検索
         
         Args:
-            query: 検索クエリ
+            query: 検索クエリ（解析済みのメッセージの場合は正規化済みのテキストを使う）
             n_results: 取得する結果数
+            source: 指定した書籍（ソースファイル名）のみを検索
+            page_range: (開始ページ, 終了ページ) の範囲のみを検索（両端を含む）
             
         Returns:
             類似ドキュメントのリスト
         """
         try:
-            # クエリにプレフィックスを追加（Colab学習時と同じ）
-            query_with_prefix = f"query: {query}"
+            id_ranges = self._filter_ranges(source, page_range)
+            if id_ranges is not None and not id_ranges:
+                logger.info("検索完了: 絞り込み条件に合うドキュメントがありません")
+                return []
             
             # クエリの埋め込みベクトルを生成
-            query_embedding = self.embedding_model.encode([query_with_prefix], normalize_embeddings=True)[0]
-            query_embedding = query_embedding.reshape(1, -1).astype('float32')
+            query_embedding = self._encode_queries([query])
             
-            # FAISSで類似度検索を実行
-            distances, indices = self.index.search(query_embedding, n_results)
+            # FAISSで類似度検索を実行（ハイブリッド時はRRF用に候補を多めに取る）
+            distances, indices = self._search_index(query_embedding, self._candidate_count(n_results), id_ranges)
             
             # 結果を整形
-            similar_docs = []
-            for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-                if idx < len(self.texts):
-                    doc = self.texts[idx]
-                    meta = self.metadata[idx] if idx < len(self.metadata) else {}
-                    
-                    similar_docs.append({
-                        'content': doc.get('text', ''),
-                        'source': meta.get('source', ''),
-                        'page': meta.get('page', ''),
-                        'distance': float(distance),
-                        'index': int(idx)
-                    })
+            similar_docs = self._fuse_results(analyze_message(query).text, distances[0], indices[0], n_results,
+                                              id_ranges)
             
             logger.info(f"検索完了: {len(similar_docs)}件の結果を取得")
             return similar_docs
@@ -142,6 +768,260 @@ class FAISSVectorStore:
             logger.error(f"検索エラー: {str(e)}")
             return []
     
+    def search_similar_batch(self, queries: List[Union[str, MessageAnalysis]], n_results: int = 5,
+                             batch_size: int = 32, source: Optional[str] = None,
+                             page_range: Optional[Tuple[int, int]] = None) -> List[List[Dict]]:
+        """
+        複数クエリの一括検索
+        
+        全クエリを1回のencode呼び出しで埋め込み、まとめて1回のindex.searchを実行する。
+        オフライン評価やFAQの事前計算など大量のクエリを処理する用途向け。
+        
+        Args:
+            queries: 検索クエリのリスト
+            n_results: クエリごとに取得する結果数
+            batch_size: 埋め込みモデルのバッチサイズ
+            source: 指定した書籍（ソースファイル名）のみを検索
+            page_range: (開始ページ, 終了ページ) の範囲のみを検索（両端を含む）
+            
+        Returns:
+            クエリと同じ順序の類似ドキュメントリストのリスト
+        """
+        if not queries:
+            return []
+        
+        try:
+            id_ranges = self._filter_ranges(source, page_range)
+            if id_ranges is not None and not id_ranges:
+                return [[] for _ in queries]
+            
+            query_embeddings = self._encode_queries(queries, batch_size=batch_size)
+            distances, indices = self._search_index(query_embeddings, self._candidate_count(n_results), id_ranges)
+            
+            results = [self._fuse_results(analyze_message(query).text, distances[i], indices[i], n_results, id_ranges)
+                       for i, query in enumerate(queries)]
+            
+            logger.info(f"一括検索完了: {len(queries)}クエリ")
+            return results
+            
+        except Exception as e:
+            logger.error(f"一括検索エラー: {str(e)}")
+            return [[] for _ in queries]
+    
+    def _search_index(self, query_embeddings: np.ndarray, k: int,
+                      id_ranges: Optional[List[Tuple[int, int]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        インデックスを検索（圧縮インデックスの場合は多めに取得して再ランキング）
+        
+        add_documentsで追加したドキュメントがあれば、その結果もまとめて上位k件を返す
+        
+        Args:
+            id_ranges: 検索対象のIDの半開区間（Noneの場合は全件）
+        
+        Returns:
+            (クエリ数, k) の distances と indices（不足分は -1）
+        """
+        # クエリはキャッシュも含めて元の次元で扱い、検索の直前に射影する
+        query_embeddings = self._project(query_embeddings)
+        
+        # 検索中に追加が行われても一貫した状態を使うよう、最初に参照を取得しておく
+        delta_index, delta_docs = self._appended
+        base_count = self._base_count()
+        
+        base_ranges = None
+        if id_ranges is not None:
+            base_ranges = [(start, min(end, base_count)) for start, end in id_ranges if start < base_count]
+        
+        if base_ranges is not None and not base_ranges:
+            parts = []
+        else:
+            parts = [self._search_base_index(query_embeddings, k, base_ranges)]
+        
+        if delta_index is not None and delta_index.ntotal:
+            # 追加分は件数が少ないため全件を検索してから絞り込む
+            delta_distances, delta_indices = delta_index.search(query_embeddings, delta_index.ntotal)
+            delta_indices = np.where(delta_indices >= 0, delta_indices + base_count, -1)
+            if id_ranges is not None:
+                delta_indices = np.where(_ids_in_ranges(delta_indices, id_ranges), delta_indices, -1)
+            parts.append((delta_distances, delta_indices))
+        
+        if len(parts) == 1 and parts[0][1].shape[1] == k:
+            return parts[0]
+        return _merge_topk(parts, k, len(query_embeddings))
+    
+    def _search_base_index(self, query_embeddings: np.ndarray, k: int,
+                           id_ranges: Optional[List[Tuple[int, int]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        学習済みインデックスの検索（圧縮インデックスの場合は再ランキング）
+        
+        絞り込み条件はFAISSのIDセレクタとして渡し、対象外のベクトルは距離計算しない（PQは取得後に絞り込む）
+        """
+        if id_ranges is not None and isinstance(self.index, MmapFlatIndex):
+            # mmapの場合は対象範囲の行だけを直接検索する
+            return self.index.search_ranges(query_embeddings, k, id_ranges)
+        
+        if self.index_type not in COMPRESSED_INDEX_TYPES or self.float_vectors is None:
+            return self._faiss_search(query_embeddings, k, id_ranges)
+        
+        _, candidates = self._faiss_search(query_embeddings, k * self.rerank_factor, id_ranges)
+        distances = np.full((len(query_embeddings), k), -np.inf, dtype='float32')
+        indices = np.full((len(query_embeddings), k), -1, dtype='int64')
+        for row, query in enumerate(query_embeddings):
+            row_distances, row_indices = rerank_exact(self.float_vectors, query, candidates[row], k)
+            distances[row, :len(row_indices)] = row_distances
+            indices[row, :len(row_indices)] = row_indices
+        return distances, indices
+    
+    def _faiss_search(self, query_embeddings: np.ndarray, k: int,
+                      id_ranges: Optional[List[Tuple[int, int]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        IDセレクタ付きでfaissインデックスを検索
+
+        近似インデックスは対象外のIDを探索後に除くため、絞り込むと上位k件がそろわないことがある。
+        対象のIDの割合に応じてIVFの nprobe・HNSWの efSearch を広げて検索し、
+        それでも（対象の件数が足りているのに）k件に満たないクエリがあれば、
+        全クラスタ（IVF）・全件の探索幅（HNSW）で検索し直す
+        """
+        if id_ranges is None:
+            return self.index.search(query_embeddings, k)
+        if not supports_id_selector(self.index):
+            return self._search_without_selector(query_embeddings, k, id_ranges)
+        
+        if len(id_ranges) == 1:
+            selector = faiss.IDSelectorRange(*id_ranges[0])
+        else:
+            ids = np.concatenate([np.arange(start, end, dtype='int64') for start, end in id_ranges])
+            selector = faiss.IDSelectorBatch(ids)
+        
+        ntotal = self.index.ntotal
+        allowed = sum(end - start for start, end in id_ranges)
+        scale = ntotal / max(allowed, 1)
+        if hasattr(self.index, 'nprobe'):
+            nlist = self.index.nlist
+            widths = dict.fromkeys((min(nlist, math.ceil(self.index.nprobe * scale)), nlist))
+            attempts = [faiss.SearchParametersIVF(sel=selector, nprobe=nprobe) for nprobe in widths]
+        elif hasattr(self.index, 'hnsw'):
+            ef_search = self.index.hnsw.efSearch
+            widths = dict.fromkeys((max(k, min(ntotal, math.ceil(ef_search * scale))), max(k, ntotal)))
+            attempts = [faiss.SearchParametersHNSW(sel=selector, efSearch=ef) for ef in widths]
+        else:
+            attempts = [faiss.SearchParameters(sel=selector)]
+        
+        needed = min(k, allowed)
+        for params in attempts:
+            distances, indices = self.index.search(query_embeddings, k, params=params)
+            if np.all((indices >= 0).sum(axis=1) >= needed):
+                break
+        # selectorはparamsから参照されるだけなので、検索が終わるまでPython側で保持しておく
+        del selector
+        return distances, indices
+    
+    def _search_without_selector(self, query_embeddings: np.ndarray, k: int,
+                                 id_ranges: List[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        IDセレクタに対応しないインデックス（PQ）の絞り込み検索
+
+        対象のIDの割合に応じて多めに取得してから範囲外のIDを除く。
+        対象の件数（最大k件）がそろわないクエリがあれば、取得数を倍にして検索し直す
+        """
+        ntotal = self.index.ntotal
+        allowed = sum(end - start for start, end in id_ranges)
+        needed = min(k, allowed)
+        fetch = min(ntotal, math.ceil(k * ntotal / max(allowed, 1)))
+        while True:
+            distances, indices = self.index.search(query_embeddings, fetch)
+            indices = np.where(_ids_in_ranges(indices, id_ranges), indices, -1)
+            if fetch >= ntotal or np.all((indices >= 0).sum(axis=1) >= needed):
+                return _merge_topk([(distances, indices)], k, len(query_embeddings))
+            fetch = min(ntotal, fetch * 2)
+    
+    def _encode_queries(self, queries: List[Union[str, MessageAnalysis]], batch_size: int = 32) -> np.ndarray:
+        """
+        クエリを埋め込みベクトルに変換
+        
+        Returns:
+            (クエリ数, 次元) のfloat32行列
+        """
+        # クエリにプレフィックスを追加（Colab学習時と同じ）
+        # 表記揺れで同じ質問がキャッシュを外さないよう正規化後の文字列をキーにする
+        keys = [f"query: {analyze_message(query).normalized}" for query in queries]
+        
+        embeddings: List[Optional[np.ndarray]] = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            # キャッシュにないクエリだけを1回のencodeでまとめて計算
+            # 同じバッチ内の重複クエリは1度だけ計算する
+            unique_keys = list(dict.fromkeys(keys[i] for i in missing))
+            encoded = self.embedding_model.encode(unique_keys, batch_size=batch_size,
+                                                  normalize_embeddings=True)
+            encoded = np.asarray(encoded, dtype='float32').reshape(len(unique_keys), -1)
+            by_key = {key: row.copy() for key, row in zip(unique_keys, encoded)}
+            for key, embedding in by_key.items():
+                self.query_cache.put(key, embedding)
+            for i in missing:
+                embeddings[i] = by_key[keys[i]]
+        
+        return np.ascontiguousarray(np.stack(embeddings), dtype='float32')
+    
+    def _candidate_count(self, n_results: int) -> int:
+        """ベクトル検索で取得する候補数"""
+        if self.lexical_index is None:
+            return n_results
+        return max(n_results * 4, 20)
+    
+    def _fuse_results(self, query: str, distances: np.ndarray, indices: np.ndarray,
+                      n_results: int, id_ranges: Optional[List[Tuple[int, int]]] = None) -> List[Dict]:
+        """
+        ベクトル検索の結果とn-gram BM25の結果をReciprocal Rank Fusionで統合
+        
+        ハイブリッド検索が無効の場合はベクトル検索の結果をそのまま整形する
+        """
+        if self.lexical_index is None:
+            return self._format_results(distances[:n_results], indices[:n_results])
+        
+        dense_ids = [int(idx) for idx in indices if idx >= 0]
+        dense_scores = {int(idx): float(distance) for distance, idx in zip(distances, indices) if idx >= 0}
+        lexical_scores, lexical_ids = self.lexical_index.search(query, len(indices), id_ranges)
+        lexical_by_id = dict(zip(lexical_ids.tolist(), lexical_scores.tolist()))
+        
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids.tolist()], k=self.rrf_k)[:n_results]
+        
+        similar_docs = []
+        for idx, rrf_score in fused:
+            if not 0 <= idx < self._document_count():
+                continue
+            meta = self._get_meta(idx)
+            similar_docs.append({
+                'content': self._get_text(idx),
+                'source': meta.get('source', ''),
+                'page': meta.get('page', ''),
+                'citations': meta.get('citations', []),
+                # n-gramのみでヒットしたドキュメントはベクトル類似度を持たない（None）
+                'distance': dense_scores.get(idx),
+                'lexical_score': lexical_by_id.get(idx, 0.0),
+                'rrf_score': rrf_score,
+                'index': idx
+            })
+        return similar_docs
+    
+    def _format_results(self, distances: np.ndarray, indices: np.ndarray) -> List[Dict]:
+        """検索結果の1行分をドキュメント辞書のリストに整形"""
+        similar_docs = []
+        for distance, idx in zip(distances, indices):
+            if 0 <= idx < self._document_count():
+                meta = self._get_meta(idx)
+                
+                similar_docs.append({
+                    'content': self._get_text(idx),
+                    'source': meta.get('source', ''),
+                    'page': meta.get('page', ''),
+                    'citations': meta.get('citations', []),
+                    'distance': float(distance),
+                    'index': int(idx)
+                })
+        return similar_docs
+    
     def get_document_by_index(self, index: int) -> Optional[Dict]:
         """
         インデックスでドキュメントを取得
@@ -153,14 +1033,14 @@ class FAISSVectorStore:
             ドキュメント情報
         """
         try:
-            if 0 <= index < len(self.texts):
-                doc = self.texts[index]
-                meta = self.metadata[index] if index < len(self.metadata) else {}
+            if 0 <= index < self._document_count():
+                meta = self._get_meta(index)
                 
                 return {
-                    'content': doc.get('text', ''),
+                    'content': self._get_text(index),
                     'source': meta.get('source', ''),
                     'page': meta.get('page', ''),
+                    'citations': meta.get('citations', []),
                     'index': index
                 }
             return None
@@ -172,13 +1052,113 @@ class FAISSVectorStore:
         """ベクトルストアの統計情報を取得"""
         try:
             return {
-                'total_vectors': self.index.ntotal if self.index else 0,
+                'total_vectors': (self.index.ntotal + len(self._appended[1])) if self.index else 0,
                 'vector_dimension': self.index.d if self.index else 0,
-                'metadata_count': len(self.metadata) if self.metadata else 0,
-                'texts_count': len(self.texts) if self.texts else 0,
-                'index_type': 'IndexFlatIP' if self.index else 'None'
+                'metadata_count': (self._base_count() if self.corpus is not None else len(self.metadata or []))
+                                  + len(self._appended[1]),
+                'texts_count': self._document_count(),
+                'appended_count': len(self._appended[1]),
+                'source_count': len(self.get_sources()),
+                'hybrid': self.lexical_index is not None,
+                'lexical_index': {
+                    'vocabulary': len(self.lexical_index.vocabulary),
+                    'postings_bytes': self.lexical_index.nbytes
+                } if self.lexical_index is not None else None,
+                'encoder_backend': self.encoder_backend,
+                'load_timings': self.load_timings,
+                'reduction': ({'type': self.projection.kind, 'input_dim': self.projection.input_dim,
+                               'output_dim': self.projection.output_dim} if self.projection is not None else None),
+                'corpus_format': 'binary' if self.corpus is not None else 'jsonl',
+                'index_type': self._index_type_name(),
+                'search_params': get_search_params(self.index) if self.index else {},
+                'rerank_factor': self.rerank_factor if self.float_vectors is not None else None,
+                'load_mode': 'mmap' if self._index_mmapped() else 'memory',
+                'memory': self.get_memory_usage(),
+                'query_cache': self.query_cache.stats()
             }
         except Exception as e:
             logger.error(f"統計情報取得エラー: {str(e)}")
             return {}
+    
+    def _index_type_name(self) -> str:
+        """統計情報用のインデックス種別名"""
+        if self.index is None:
+            return 'None'
+        if isinstance(self.index, MmapFlatIndex):
+            return 'IndexFlatIP'
+        return type(self.index).__name__
+    
+    def get_memory_usage(self) -> Dict:
+        """
+        インデックスとプロセス全体のメモリ使用量を取得
+        
+        mmapモードではインデックスのページは共有メモリとして計上され、
+        ワーカー数が増えても物理メモリは1コピー分しか消費しない
+        """
+        process = _read_proc_memory()
+        if self.index is None:
+            return {'process': process}
+        
+        if self._index_mmapped():
+            index_memory = _read_proc_memory(ann_index_path(self.index_path, self.index_type))
+        else:
+            # ヒープに読み込んだ場合はすべてプロセス固有のメモリになる
+            # （シリアライズ形式とメモリ上の表現はほぼ同じサイズ）
+            index_bytes = os.path.getsize(ann_index_path(self.index_path, self.index_type))
+            index_memory = {
+                'rss_bytes': index_bytes,
+                'shared_bytes': 0,
+                'private_bytes': index_bytes
+            }
+        memory = {'index': index_memory, 'process': process}
+        if self.float_vectors is not None:
+            # 再ランキング用のfloatベクトル（mmap、参照された候補のページのみ常駐）
+            memory['float_vectors'] = _read_proc_memory(self.index_path)
+        return memory
 
+
+def _env_int(name: str) -> Optional[int]:
+    """整数の環境変数を取得（未設定の場合はNone）"""
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def create_vector_store_from_env(base_path: str):
+    """
+    環境変数（OMAE_*）の設定で学習結果ディレクトリのベクトルストアを作成
+    
+    Webアプリと検索デーモン（retrieval_server.py）で同じ設定を使うための共通処理
+    
+    Args:
+        base_path: 学習結果ディレクトリ
+    
+    Returns:
+        FAISSVectorStore（OMAE_BATCH_WINDOW_MS > 0 の場合は QueryBatcher で包んだもの）
+    """
+    store = FAISSVectorStore(
+        index_path=os.path.join(base_path, "faiss_index_ip.faiss"),
+        meta_path=os.path.join(base_path, "faiss_meta.json"),
+        texts_path=os.path.join(base_path, "faiss_texts.jsonl"),
+        # mmapで読み込むとgunicornの各ワーカーがインデックスのページを共有できる
+        use_mmap=os.environ.get('OMAE_FAISS_MMAP', '1') == '1',
+        # corpus_store.py で変換済みのコーパスがあればそちらを優先
+        corpus_dir=os.path.join(base_path, "corpus"),
+        query_cache_size=int(os.environ.get('OMAE_QUERY_CACHE_SIZE', 1024)),
+        query_cache_ttl=float(os.environ.get('OMAE_QUERY_CACHE_TTL', 3600)),
+        index_type=os.environ.get('OMAE_INDEX_TYPE', 'flat'),
+        nprobe=_env_int('OMAE_IVF_NPROBE'),
+        ef_search=_env_int('OMAE_HNSW_EF_SEARCH'),
+        rerank_factor=int(os.environ.get('OMAE_RERANK_FACTOR', 4)),
+        hybrid=os.environ.get('OMAE_HYBRID_SEARCH', '1') == '1',
+        encoder_backend=os.environ.get('OMAE_ENCODER_BACKEND', 'torch'),
+        reduction=os.environ.get('OMAE_REDUCTION') or None,
+        reduced_dim=int(os.environ.get('OMAE_REDUCED_DIM', 256))
+    )
+    
+    # 同時に届いたクエリを1回のencode / index.searchにまとめる（スレッドやasyncioで並行処理する場合）
+    window_ms = float(os.environ.get('OMAE_BATCH_WINDOW_MS', 0))
+    if window_ms > 0:
+        from query_batcher import QueryBatcher
+        return QueryBatcher(store, window_ms=window_ms,
+                            max_batch_size=int(os.environ.get('OMAE_BATCH_MAX_SIZE', 16)))
+    return store
@@ -1,9 +1,16 @@
 # Gunicorn設定ファイル
+import os
 import multiprocessing
 
 # ワーカー数
 workers = multiprocessing.cpu_count() * 2 + 1
 
+# 会話の状態はワーカー間で共有する必要があるため、複数ワーカーではSQLiteのセッションバックエンドを既定にする
+# （memory ではリクエストごとに別のワーカーが応答し、前の会話を参照できない）。
+# 設定ファイルはアプリ（preload_app）より先に読み込まれるため、ここで設定すればアプリの読み込み時に反映される
+if workers > 1:
+    os.environ.setdefault('OMAE_SESSION_BACKEND', 'sqlite')
+
 # ワーカークラス
 worker_class = 'sync'
 
@@ -37,3 +44,24 @@ max_requests_jitter = 50
 preload_app = True
 
 
+
+
+def when_ready(server):
+    """
+    ワーカーをforkする前（マスター）にベクトルストアと埋め込みモデルを読み込む
+
+    preload_app だけではモジュールの読み込みまでしか共有されないため、ここで読み込んで
+    gc.freeze() まで済ませておく。OMAE_PRELOAD_STORE=0 で無効（各ワーカーが個別に読み込む）
+    """
+    import os
+    import sys
+
+    if os.environ.get('OMAE_PRELOAD_STORE', '1') == '0':
+        return
+    # omae_app_simple など、FAISS版以外のアプリを起動している場合は何もしない
+    app_module = sys.modules.get('omae_app_faiss')
+    if app_module is None:
+        return
+    server.log.info("fork前にベクトルストアを読み込みます")
+    if not app_module.preload_components():
+        server.log.warning("fork前の読み込みに失敗しました。各ワーカーで初期化します")
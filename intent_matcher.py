@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 意図判定のキーワード照合
+ChatBot の意図判定ルール（トピック・フォローアップ・反応）を表で定義し、
+全キーワードを1つの Aho-Corasick オートマトンにまとめて、メッセージを1回走査するだけで判定する
+
+照合は小文字化したメッセージに対する部分文字列の一致で、従来の
+any(word in message.lower() for word in [...]) の if/elif と同じ結果・同じ優先順位になる
+"""
+
+import logging
+from collections import deque
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# トピックのルール（上から順に優先）: (トピック, 感情, キーワードのグループ)
+# グループが複数あるルールは、すべてのグループのいずれかのキーワードを含む場合に一致する
+TOPIC_RULES: List[Tuple[str, Optional[str], Tuple[Tuple[str, ...], ...]]] = [
+    ('fear_overcoming', 'concern', (('怖い', '恐い', '恐怖', 'fear', 'scared', 'afraid'),)),
+    ('failure_overcoming', 'struggle', (('失敗', '挫折', '困難', 'failure', 'difficulty', 'challenge'),)),
+    ('success', 'positive', (('成功', '達成', '勝利', 'success', 'achievement', 'victory'),)),
+    ('business_strategy', None, (('経営', '戦略', 'ビジネス', 'business', 'strategy', 'management'),)),
+    ('leadership', None, (('リーダー', '指導', 'leadership', 'leader'),)),
+    ('global_strategy', None, (('グローバル', '国際', 'global', 'international'),)),
+    ('digital_transformation', None, (('デジタル', '技術', 'digital', 'technology'),)),
+    ('future_survival', None, (('50', 'fifty', 'age', 'older', 'survive', 'future', '2030', '2030s'),)),
+    ('yamaha_experience', None, (('yamaha', 'ヤマハ', 'motorcycle', '楽器'),)),
+    ('hitachi_experience', None, (('hitachi', '日立', 'nuclear', '原発', '原子力'),)),
+    ('panasonic_experience', None, (('panasonic', 'パナソニック', '松下'),)),
+    ('repeat_in_japanese', None, (('それ', 'これ', 'that', 'this'), ('日本語', 'japanese'))),
+]
+
+# 前の会話へのフォローアップ質問
+FOLLOWUP_PATTERNS = (
+    'それって', 'それは', 'その', 'これって', 'これは', 'この',
+    'that', 'this', 'it', 'what about', 'how about',
+    '詳しく', '具体的に', '例を', 'for example', 'specifically',
+    'なぜ', 'どうして', 'why', 'how come',
+    '他には', '他に', 'other', 'else', 'more'
+)
+
+# 前の回答への反応
+REACTION_PATTERNS = (
+    'なるほど', 'そうですね', '確かに', '理解しました',
+    'i see', 'i understand', 'that makes sense', 'okay',
+    'ありがとう', 'thank you', 'thanks',
+    'もっと', 'さらに', 'more', 'further'
+)
+
+FOLLOWUP = 'followup'
+REACTION = 'reaction'
+
+
+class AhoCorasick:
+    """
+    複数パターンの部分文字列照合オートマトン
+
+    パターンごとにラベルを付けて構築し、テキストを1回走査して一致したラベルを返す
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Hashable]]):
+        """
+        Args:
+            patterns: (パターン, ラベル) の組（同じパターンに複数のラベルを付けてもよい）
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+
+        outputs: List[set] = [set()]
+        for pattern, label in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                state = next_state
+            outputs[state].add(label)
+
+        # 幅優先で失敗遷移を求め、接尾辞になっているパターンの出力を引き継ぐ。
+        # 同時に失敗遷移をたどった先の遷移も各状態に展開し、走査時は1文字につき1回の辞書参照で済むようにする
+        self._delta: List[Dict[str, int]] = [dict(self._goto[0])] + [None] * (len(self._goto) - 1)
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._delta[state] = {**self._delta[0], **self._goto[state]}
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                outputs[next_state] |= outputs[self._fail[next_state]]
+                self._delta[next_state] = {**self._delta[self._fail[next_state]], **self._goto[next_state]}
+        self._output = [frozenset(labels) for labels in outputs]
+
+    @property
+    def state_count(self) -> int:
+        return len(self._goto)
+
+    def find_labels(self, text: str) -> FrozenSet[Hashable]:
+        """テキストに含まれるパターンのラベルの集合"""
+        delta, output = self._delta, self._output
+        found = set()
+        state = 0
+        for char in text:
+            state = delta[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return frozenset(found)
+
+
+class IntentMatcher:
+    """意図判定ルールをまとめたオートマトン（構築は1回だけ）"""
+
+    def __init__(self, topic_rules=TOPIC_RULES, followup_patterns=FOLLOWUP_PATTERNS,
+                 reaction_patterns=REACTION_PATTERNS):
+        self.topic_rules = list(topic_rules)
+        patterns: List[Tuple[str, Hashable]] = []
+        for rule_index, (_, _, groups) in enumerate(self.topic_rules):
+            for group_index, keywords in enumerate(groups):
+                patterns.extend((keyword.lower(), (rule_index, group_index)) for keyword in keywords)
+        patterns.extend((pattern.lower(), FOLLOWUP) for pattern in followup_patterns)
+        patterns.extend((pattern.lower(), REACTION) for pattern in reaction_patterns)
+        self.automaton = AhoCorasick(patterns)
+
+    def match(self, message: str) -> FrozenSet[Hashable]:
+        """メッセージ（小文字化して照合）で一致したルールのラベル"""
+        return self.automaton.find_labels(message.lower())
+
+    def topic_from_hits(self, hits: FrozenSet[Hashable]) -> Tuple[str, Optional[str]]:
+        """一致したラベルから、優先順位の最も高いトピックと感情を求める"""
+        for rule_index, (topic, emotion, groups) in enumerate(self.topic_rules):
+            if all((rule_index, group_index) in hits for group_index in range(len(groups))):
+                return topic, emotion
+        return 'general', None
+
+    @staticmethod
+    def context_from_hits(hits: FrozenSet[Hashable]) -> Optional[str]:
+        """フォローアップ質問（優先）/ 反応 のどちらに一致したか（どちらでもない場合はNone）"""
+        if FOLLOWUP in hits:
+            return 'followup_question'
+        if REACTION in hits:
+            return 'reaction'
+        return None
+
+    def analyze(self, message: str) -> Dict[str, str]:
+        """ChatBot.analyze_question_intent と同じ形式の意図"""
+        topic, emotion = self.topic_from_hits(self.match(message))
+        return {
+            'topic': topic,
+            'emotion': emotion or 'neutral',
+            'specificity': 'general'
+        }
+
+
+# 起動時に1回だけ構築して共有する（構築後は読み取りのみのためスレッドセーフ）
+default_matcher = IntentMatcher()
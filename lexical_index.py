@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 文字n-gram BM25転置インデックス
+OCRノイズの多いテキストでも固有名詞（ヤマハ、日立、3Cなど）を取りこぼさないよう、
+形態素解析を使わず文字2-gram / 3-gramで語彙を作る
+"""
+
+import re
+import unicodedata
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_for_ngrams(text: str) -> str:
+    """n-gram抽出用の正規化（NFKC + 小文字化）"""
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def char_ngrams(text: str, sizes: Tuple[int, ...] = (2, 3)) -> List[str]:
+    """
+    空白で区切られた各トークン内の文字n-gramを抽出
+
+    OCRノイズに多い1文字だけのトークン（"|" や "川" など）からはn-gramを作らない
+    """
+    ngrams = []
+    for token in _WHITESPACE_PATTERN.split(normalize_for_ngrams(text)):
+        for size in sizes:
+            if len(token) < size:
+                continue
+            ngrams.extend(token[i:i + size] for i in range(len(token) - size + 1))
+    return ngrams
+
+
+class CharNgramBM25:
+    """
+    CSR形式の転置インデックスによるBM25検索
+
+    各ポスティングにはBM25の語重み（idf × tf飽和 × 文書長正規化）を事前計算して持つため、
+    検索はクエリn-gramのポスティングを連結して np.bincount で合計するだけになる
+    """
+
+    def __init__(self, texts: Iterable[str], k1: float = 1.2, b: float = 0.75,
+                 sizes: Tuple[int, ...] = (2, 3)):
+        """
+        Args:
+            texts: ドキュメントのテキスト（並び順がドキュメントIDになる）
+            k1: BM25のtf飽和パラメータ
+            b: BM25の文書長正規化パラメータ
+            sizes: 使う文字n-gramのサイズ
+        """
+        self.k1 = k1
+        self.b = b
+        self.sizes = sizes
+        self.vocabulary: Dict[str, int] = {}
+
+        term_docs: List[List[int]] = []
+        term_tfs: List[List[int]] = []
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(char_ngrams(text, sizes))
+            doc_lengths.append(sum(counts.values()))
+            for ngram, tf in counts.items():
+                term_id = self.vocabulary.get(ngram)
+                if term_id is None:
+                    term_id = len(self.vocabulary)
+                    self.vocabulary[ngram] = term_id
+                    term_docs.append([])
+                    term_tfs.append([])
+                term_docs[term_id].append(doc_id)
+                term_tfs[term_id].append(tf)
+
+        self.doc_lengths = np.array(doc_lengths, dtype='float32')
+
+        # CSR: term_offsets[t]:term_offsets[t+1] が語tのポスティング範囲
+        lengths = np.array([len(docs) for docs in term_docs], dtype='int64')
+        self.term_offsets = np.zeros(len(term_docs) + 1, dtype='int64')
+        np.cumsum(lengths, out=self.term_offsets[1:])
+        self.posting_docs = np.fromiter((doc for docs in term_docs for doc in docs),
+                                        dtype='int32', count=int(lengths.sum()))
+        self.posting_tfs = np.fromiter((tf for tfs in term_tfs for tf in tfs),
+                                       dtype='float32', count=int(lengths.sum()))
+        self._compute_weights()
+
+        logger.info(f"n-gram転置インデックスを構築しました: {self.doc_count}件, 語彙 {len(self.vocabulary)}")
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_lengths)
+
+    def _compute_weights(self):
+        """ポスティングごとのBM25の語重みを計算（idfと平均文書長は全ドキュメントから求める）"""
+        avg_length = float(self.doc_lengths.mean()) if self.doc_count and self.doc_lengths.sum() else 1.0
+        lengths = np.diff(self.term_offsets)
+        df = lengths.astype('float32')
+        idf = np.log(1.0 + (self.doc_count - df + 0.5) / (df + 0.5))
+        tfs = self.posting_tfs
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[self.posting_docs] / avg_length)
+        self.posting_weights = (np.repeat(idf, lengths) * tfs * (self.k1 + 1.0) / (tfs + norm)).astype('float32')
+
+    def extended(self, texts: Iterable[str]) -> 'CharNgramBM25':
+        """
+        ドキュメントを末尾に加えた新しいインデックス（自身は変更しないため、検索中に差し替えてよい）
+
+        n-gramの抽出は追加分のテキストだけで行い、既存のポスティングには各語の末尾に
+        追加分のポスティングを挿入する。idfと平均文書長が変わるため語重みは全体を計算し直すが、
+        numpyの配列演算だけで済む
+
+        Args:
+            texts: 追加するドキュメントのテキスト（既存のドキュメントの後に続くIDになる）
+        """
+        index = object.__new__(CharNgramBM25)
+        index.k1, index.b, index.sizes = self.k1, self.b, self.sizes
+        index.vocabulary = dict(self.vocabulary)
+
+        new_terms, new_docs, new_tfs, doc_lengths = [], [], [], []
+        for doc_id, text in enumerate(texts, start=self.doc_count):
+            counts = Counter(char_ngrams(text, self.sizes))
+            doc_lengths.append(sum(counts.values()))
+            for ngram, tf in counts.items():
+                term_id = index.vocabulary.setdefault(ngram, len(index.vocabulary))
+                new_terms.append(term_id)
+                new_docs.append(doc_id)
+                new_tfs.append(tf)
+        index.doc_lengths = np.concatenate([self.doc_lengths, np.array(doc_lengths, dtype='float32')])
+
+        # 語ID順（同じ語の中ではドキュメントID順）に並べ、各語のポスティング範囲の末尾に挿入する
+        new_terms = np.array(new_terms, dtype='int64')
+        order = np.argsort(new_terms, kind='stable')
+        new_terms = new_terms[order]
+        term_count = len(self.term_offsets) - 1
+        positions = self.term_offsets[np.minimum(new_terms + 1, term_count)]
+        index.posting_docs = np.insert(self.posting_docs, positions, np.array(new_docs, dtype='int32')[order])
+        index.posting_tfs = np.insert(self.posting_tfs, positions, np.array(new_tfs, dtype='float32')[order])
+
+        lengths = np.diff(self.term_offsets)
+        lengths = np.concatenate([lengths, np.zeros(len(index.vocabulary) - term_count, dtype='int64')])
+        lengths += np.bincount(new_terms, minlength=len(index.vocabulary))
+        index.term_offsets = np.zeros(len(lengths) + 1, dtype='int64')
+        np.cumsum(lengths, out=index.term_offsets[1:])
+        index._compute_weights()
+        return index
+
+    def search(self, query: str, k: int = 10,
+               id_ranges: Optional[List[Tuple[int, int]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25スコアの上位k件を取得
+
+        Args:
+            query: 検索クエリ
+            k: 取得する件数
+            id_ranges: 検索対象のドキュメントIDの半開区間（Noneの場合は全件）
+
+        Returns:
+            (scores, doc_ids) のスコア降順の1次元配列（スコア0のドキュメントは含まない）
+        """
+        term_ids = {self.vocabulary[ngram] for ngram in char_ngrams(query, self.sizes) if ngram in self.vocabulary}
+        if not term_ids or self.doc_count == 0:
+            return np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+
+        slices = [slice(self.term_offsets[t], self.term_offsets[t + 1]) for t in term_ids]
+        docs = np.concatenate([self.posting_docs[s] for s in slices])
+        weights = np.concatenate([self.posting_weights[s] for s in slices])
+        scores = np.bincount(docs, weights=weights, minlength=self.doc_count)
+        if id_ranges is not None:
+            allowed = np.zeros(self.doc_count, dtype=bool)
+            for start, end in id_ranges:
+                allowed[start:end] = True
+            scores[~allowed] = 0.0
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return scores[top].astype('float32'), top.astype('int64')
+
+    @property
+    def nbytes(self) -> int:
+        """ポスティング配列のサイズ（バイト）"""
+        return int(self.term_offsets.nbytes + self.posting_docs.nbytes + self.posting_tfs.nbytes
+                   + self.posting_weights.nbytes)
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    複数の検索結果の順位を Reciprocal Rank Fusion で統合
+
+    Args:
+        rankings: ドキュメントIDの順位リストのリスト
+        k: RRFの定数（大きいほど下位の結果の影響が相対的に大きくなる）
+
+    Returns:
+        (ドキュメントID, RRFスコア) のスコア降順リスト
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット ワーカーごとのメモリレポート
+fork前の読み込み（gunicorn_config.py の when_ready → preload_components）の有無で、
+ワーカーごとの USS（そのプロセスだけが持つメモリ = Private_Clean + Private_Dirty）を比較する
+
+    python memory_report.py                      # 両方の方式でワーカーをforkして比較
+    python memory_report.py --master <PID>       # 起動中のgunicornのワーカーを集計
+
+USS は fork後にコピーオンライトで複製されたページを含むため、共有できていない分の目安になる
+（Linuxの /proc/<pid>/smaps_rollup を使う）
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_QUERIES = [
+    '戦略的思考とは何ですか？',
+    'サラリーマンが副業を始める際の注意点は？',
+    '日本企業の課題は何ですか？',
+    '3C分析について教えてください',
+    'What is the key to business success?',
+    'リーダーシップに必要なことは？',
+    '英語を学ぶべき理由は？',
+    '年金に頼らない老後の準備は？'
+]
+
+MODES = ('preload', 'lazy')
+
+
+def read_process_memory(pid: int) -> Dict[str, int]:
+    """
+    プロセスのメモリ使用量（バイト）を取得
+
+    Returns:
+        rss / pss / uss / shared の辞書
+    """
+    fields = {'Rss': 0, 'Pss': 0, 'Shared_Clean': 0, 'Shared_Dirty': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    with open(f'/proc/{pid}/smaps_rollup', 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[0][:-1] in fields:
+                fields[parts[0][:-1]] = int(parts[1]) * 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+        'shared': fields['Shared_Clean'] + fields['Shared_Dirty']
+    }
+
+
+def worker_pids(master_pid: int) -> List[int]:
+    """gunicornマスターの子プロセス（ワーカー）のPID"""
+    with open(f'/proc/{master_pid}/task/{master_pid}/children', 'r') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def _exercise(app, n_requests: int) -> None:
+    """ワーカーとしてチャットAPIを呼び、最後にGCの全世代を回す"""
+    import gc
+
+    client = app.test_client()
+    for i in range(n_requests):
+        client.post('/api/chat', json={'message': SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]})
+    gc.collect()
+
+
+def simulate(mode: str, n_workers: int, n_requests: int) -> Dict:
+    """
+    gunicornと同じようにアプリを読み込んだプロセスからワーカーをforkし、メモリを測定
+
+    Args:
+        mode: 'preload'（fork前に読み込み + gc.freeze）/ 'lazy'（各ワーカーが読み込み）
+        n_workers: forkするワーカー数
+        n_requests: 各ワーカーが処理するリクエスト数
+
+    Returns:
+        マスターとワーカーごとのメモリ使用量
+    """
+    import omae_app_faiss as app_module
+
+    if mode == 'preload' and not app_module.preload_components():
+        raise RuntimeError("fork前の読み込みに失敗しました")
+
+    done_read, done_write = os.pipe()
+    release_read, release_write = os.pipe()
+    pids = []
+    for _ in range(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(done_read)
+            os.close(release_write)
+            status = 0
+            try:
+                if mode == 'lazy' and not app_module.initialize_components():
+                    status = 1
+                else:
+                    _exercise(app_module.app, n_requests)
+            except Exception as e:
+                logger.error(f"ワーカーの実行エラー: {str(e)}")
+                status = 1
+            # 測定が終わるまで終了せずに待つ
+            os.write(done_write, b'\x01' if status == 0 else b'\x00')
+            os.read(release_read, 1)
+            os._exit(status)
+        pids.append(pid)
+
+    os.close(done_write)
+    os.close(release_read)
+    statuses = b''
+    while len(statuses) < n_workers:
+        chunk = os.read(done_read, n_workers - len(statuses))
+        if not chunk:
+            break
+        statuses += chunk
+
+    report = {
+        'mode': mode,
+        'master': read_process_memory(os.getpid()),
+        'workers': [read_process_memory(pid) for pid in pids],
+        'failed_workers': statuses.count(b'\x00') + (n_workers - len(statuses))
+    }
+
+    os.close(release_write)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return report
+
+
+def _format_mb(value: int) -> str:
+    return f"{value / 1024 / 1024:>10.1f}"
+
+
+def print_report(report: Dict) -> None:
+    """ワーカーごとの RSS / PSS / USS と合計を表示"""
+    print(f"[{report['mode']}]")
+    print(f"{'process':<12}{'RSS(MB)':>10}{'PSS(MB)':>10}{'USS(MB)':>10}")
+    print("-" * 42)
+    master = report['master']
+    print(f"{'master':<12}{_format_mb(master['rss'])}{_format_mb(master['pss'])}{_format_mb(master['uss'])}")
+    for i, worker in enumerate(report['workers']):
+        print(f"{f'worker{i}':<12}{_format_mb(worker['rss'])}{_format_mb(worker['pss'])}{_format_mb(worker['uss'])}")
+    workers = report['workers']
+    if workers:
+        mean_uss = sum(worker['uss'] for worker in workers) / len(workers)
+        total_pss = master['pss'] + sum(worker['pss'] for worker in workers)
+        print(f"ワーカー平均USS: {mean_uss / 1024 / 1024:.1f}MB / 合計PSS: {total_pss / 1024 / 1024:.1f}MB")
+    print()
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description='fork前の読み込みの有無でワーカーごとのUSSを比較')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20, help='各ワーカーが処理するリクエスト数')
+    parser.add_argument('--master', type=int, default=None, help='起動中のgunicornマスターのPID')
+    parser.add_argument('--mode', choices=MODES, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print("✗ /proc/self/smaps_rollup がありません（Linux 4.14以降が必要です）")
+        return 1
+
+    if args.master is not None:
+        report = {
+            'mode': f'gunicorn pid={args.master}',
+            'master': read_process_memory(args.master),
+            'workers': [read_process_memory(pid) for pid in worker_pids(args.master)]
+        }
+        print_report(report)
+        return 0
+
+    if args.mode is not None:
+        # 方式ごとに新しいプロセスで測定し、読み込み済みのモジュールが結果に混ざらないようにする
+        print(json.dumps(simulate(args.mode, args.workers, args.requests)))
+        return 0
+
+    reports = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--workers', str(args.workers), '--requests', str(args.requests)],
+            check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        reports.append(report)
+        print_report(report)
+        if report['failed_workers']:
+            print(f"✗ {report['mode']}: {report['failed_workers']}個のワーカーが失敗しました")
+            return 1
+
+    mean_uss = {report['mode']: sum(w['uss'] for w in report['workers']) / len(report['workers'])
+                for report in reports}
+    saved = mean_uss['lazy'] - mean_uss['preload']
+    print(f"✓ fork前の読み込みでワーカーあたりのUSSが {saved / 1024 / 1024:.1f}MB 減りました "
+          f"({mean_uss['lazy'] / 1024 / 1024:.1f}MB -> {mean_uss['preload'] / 1024 / 1024:.1f}MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
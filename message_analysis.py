@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット メッセージ解析
+1つのメッセージについて、正規化・文字種の割合・言語・トークン・意図のキーワード照合を
+必要になった時点で1回だけ計算して保持する
+
+Webアプリで1つ作成し、ChatBot（言語・意図・フォローアップ判定）と
+FAISSVectorStore（埋め込みキャッシュのキー）に同じものを渡す
+
+検索デーモンを使うWebワーカーが numpy を読み込まないよう、
+numpy に依存するモジュール（query_cache / chunk_quality）は参照時にimportする
+"""
+
+import re
+import logging
+from functools import cached_property
+from typing import Dict, FrozenSet, Hashable, List, Optional, Tuple, Union
+
+from intent_matcher import IntentMatcher, default_matcher
+
+logger = logging.getLogger(__name__)
+
+# ひらがな・カタカナ・漢字を含む場合は日本語とみなす
+_JAPANESE_PATTERN = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]')
+
+
+class MessageAnalysis:
+    """
+    メッセージの解析結果（各属性は初回の参照時に計算して保持する）
+
+    作成後は読み取りのみのため、同じリクエストを処理するスレッド間で共有してよい
+    """
+
+    def __init__(self, text: str, matcher: IntentMatcher = default_matcher):
+        """
+        Args:
+            text: ユーザーのメッセージ（または検索クエリ）
+            matcher: 意図判定のキーワード照合
+        """
+        self.text = text
+        self.matcher = matcher
+
+    def __repr__(self) -> str:
+        return f"MessageAnalysis({self.text!r})"
+
+    @cached_property
+    def lowered(self) -> str:
+        """小文字化したテキスト（キーワード照合用）"""
+        return self.text.lower()
+
+    @cached_property
+    def normalized(self) -> str:
+        """NFKC正規化して空白をまとめたテキスト（埋め込みキャッシュのキー用）"""
+        from query_cache import normalize_query
+        return normalize_query(self.text)
+
+    @cached_property
+    def script_ratios(self) -> Dict[str, float]:
+        """空白以外の文字に占める各文字種の割合"""
+        from chunk_quality import script_ratios
+        return script_ratios(self.text)
+
+    @cached_property
+    def language(self) -> str:
+        """'ja' または 'en'"""
+        return 'ja' if _JAPANESE_PATTERN.search(self.text) else 'en'
+
+    @cached_property
+    def tokens(self) -> List[str]:
+        """空白で区切ったトークン"""
+        return self.text.split()
+
+    @cached_property
+    def intent_hits(self) -> FrozenSet[Hashable]:
+        """意図判定のキーワード照合で一致したラベル（トピック・フォローアップ・反応を1回の走査で求める）"""
+        return self.matcher.automaton.find_labels(self.lowered)
+
+    @cached_property
+    def topic(self) -> Tuple[str, Optional[str]]:
+        """(トピック, 感情)（感情のないトピックはNone）"""
+        return self.matcher.topic_from_hits(self.intent_hits)
+
+    @property
+    def intent(self) -> Dict[str, str]:
+        """ChatBot.analyze_question_intent と同じ形式の意図（呼び出し側で変更してもよいよう毎回作成）"""
+        topic, emotion = self.topic
+        return {
+            'topic': topic,
+            'emotion': emotion or 'neutral',
+            'specificity': 'general'
+        }
+
+    @property
+    def context_intent(self) -> str:
+        """'followup_question' / 'reaction' / 'new_topic'（会話履歴の有無は呼び出し側で判定する）"""
+        return self.matcher.context_from_hits(self.intent_hits) or 'new_topic'
+
+
+def analyze_message(message: Union[str, MessageAnalysis]) -> MessageAnalysis:
+    """文字列の場合は解析を作成し、作成済みの解析はそのまま返す"""
+    if isinstance(message, MessageAnalysis):
+        return message
+    return MessageAnalysis(message)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット Webアプリケーション（FAISS版・asyncio / ASGI）
+omae_app_faiss.py と同じエンドポイントを Quart で提供する
+
+意図の判定・埋め込み・検索と応答生成（CPU処理）は上限付きのスレッドプールで実行し、
+その間もイベントループは接続の受け付けとヘルスチェックに応答し続ける
+
+    uvicorn omae_app_async:app --host 0.0.0.0 --port 8000
+    hypercorn omae_app_async:app --bind 0.0.0.0:8000
+
+コンポーネントの初期化と状態は omae_app_faiss と共有する
+"""
+
+import os
+import sys
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from quart import Quart, Response, render_template, request, jsonify, session
+
+# プロジェクトのルートディレクトリをパスに追加
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import omae_app_faiss as sync_app
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.secret_key = sync_app.app.secret_key
+
+
+class ExecutorBusy(Exception):
+    """実行中と待機中の処理が上限に達している"""
+
+
+class BoundedExecutor:
+    """
+    同時に受け付ける処理数に上限のあるスレッドプール
+
+    max_workers 個を並列に実行し、さらに max_pending 個まで待機させる。
+    それを超えた分は待たせずに ExecutorBusy を送出し、呼び出し側で503を返す
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        """
+        Args:
+            max_workers: 並列に実行するスレッド数
+            max_pending: 実行待ちにできる処理数
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='omae-worker')
+        self._slots = asyncio.Semaphore(max_workers + max_pending)
+
+    async def run(self, func, *args, **kwargs):
+        """func をスレッドプールで実行して結果を待つ"""
+        if self._slots.locked():
+            raise ExecutorBusy(f"処理中のリクエストが上限（{self.max_workers + self.max_pending}件）に達しています")
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+executor = BoundedExecutor(
+    max_workers=int(os.environ.get('OMAE_EXECUTOR_WORKERS', min(4, os.cpu_count() or 1))),
+    max_pending=int(os.environ.get('OMAE_EXECUTOR_QUEUE', 16))
+)
+
+
+def _unavailable_response(message, status, phase=None, retry_after=5):
+    """503レスポンス（初期化中・混雑時）"""
+    response = jsonify({
+        'success': False,
+        'error': message,
+        'status': status,
+        'phase': phase
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _not_ready_response():
+    """初期化が終わるまでの503レスポンス"""
+    state = sync_app.get_init_state()
+    if state['status'] == 'failed':
+        message = f"初期化に失敗しました: {state['error']}"
+    else:
+        message = '起動中です。しばらくしてから再度お試しください'
+    return _unavailable_response(message, state['status'], state['phase'])
+
+
+@app.before_serving
+async def _start_initialization():
+    """サーバーの起動時に初期化を開始（fork前に読み込み済みの場合は何もしない）"""
+    if sync_app.get_init_state()['status'] == 'not_started':
+        sync_app.start_background_initialization()
+
+
+@app.after_serving
+async def _shutdown_executor():
+    executor.shutdown()
+
+
+@app.route('/')
+async def index():
+    """メインページ"""
+    return await render_template('omae_index.html')
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    """チャットAPI（検索と応答生成はスレッドプールで実行）"""
+    if not sync_app.is_ready():
+        return _not_ready_response()
+
+    try:
+        data = await request.get_json()
+        message = data.get('message', '').strip()
+
+        if not message:
+            return jsonify({
+                'success': False,
+                'error': 'メッセージが空です'
+            })
+
+        # 書籍・ページ範囲での絞り込み（省略時は全書籍が対象）
+        source = data.get('source') or None
+        try:
+            page_range = sync_app._parse_page_range(data.get('page_range'))
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            })
+
+        try:
+            # 意図の判定・（必要な場合だけ）検索・応答生成・会話の状態の更新
+            similar_docs, response = await executor.run(sync_app._answer, message, sync_app._session_id(session),
+                                                        source, page_range)
+        except ExecutorBusy as e:
+            return _unavailable_response(str(e), 'busy', retry_after=1)
+
+        return jsonify(sync_app._chat_payload(similar_docs, response, bool(data.get('template_ref'))))
+
+    except Exception as e:
+        logger.error(f"チャットAPIエラー: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'エラーが発生しました: {str(e)}'
+        })
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    """チャットAPI（Server-Sent Events版。イベントの形式は omae_app_faiss と同じ）"""
+    if not sync_app.is_ready():
+        return _not_ready_response()
+
+    try:
+        data = await request.get_json()
+        message = data.get('message', '').strip()
+
+        if not message:
+            return jsonify({
+                'success': False,
+                'error': 'メッセージが空です'
+            })
+
+        source = data.get('source') or None
+        try:
+            page_range = sync_app._parse_page_range(data.get('page_range'))
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            })
+
+        try:
+            # 意図の判定・（必要な場合だけ）検索・応答生成・会話の状態の更新
+            similar_docs, response = await executor.run(sync_app._answer, message, sync_app._session_id(session),
+                                                        source, page_range)
+        except ExecutorBusy as e:
+            return _unavailable_response(str(e), 'busy', retry_after=1)
+
+        events = sync_app._stream_chat_events(similar_docs, response, bool(data.get('template_ref')))
+
+    except Exception as e:
+        logger.error(f"チャットAPI（ストリーム）エラー: {str(e)}")
+        events = [sync_app._sse_event('error', {'error': f'エラーが発生しました: {str(e)}'})]
+
+    async def body():
+        for event in events:
+            yield event.encode('utf-8')
+
+    return Response(body(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/template/<topic>')
+async def template_answer(topic):
+    """固定の回答API（omae_app_faiss と同じく ETag / Cache-Control 付き）"""
+    if not sync_app.is_ready():
+        return _not_ready_response()
+
+    payload = sync_app.template_payloads.get((topic, request.args.get('lang', 'ja')))
+    if payload is None:
+        return jsonify({
+            'success': False,
+            'error': f'固定の回答がありません: {topic}'
+        }), 404
+
+    if request.if_none_match.contains(payload['etag']):
+        response = Response('', status=304)
+    else:
+        response = Response(payload['body'], mimetype='application/json')
+    response.set_etag(payload['etag'])
+    response.headers['Cache-Control'] = sync_app.TEMPLATE_CACHE_CONTROL
+    return response
+
+
+@app.route('/api/health')
+async def health_check():
+    """
+    ヘルスチェックAPI（omae_app_faiss と同じ形式）
+
+    スレッドプールを使わないため、検索が混み合っていても応答する
+    """
+    try:
+        state = sync_app.get_init_state()
+        ready = state['status'] == 'ready'
+        if state['status'] == 'failed':
+            status, message, code = 'error', f"初期化に失敗しました: {state['error']}", 500
+        elif ready:
+            status, message, code = 'healthy', '大前研一チャットボットは正常に動作しています', 200
+        else:
+            status, message, code = 'starting', '起動中です', 200
+
+        return jsonify({
+            'status': status,
+            'message': message,
+            'live': True,
+            'ready': ready,
+            'init_status': state['status'],
+            'phase': state['phase'],
+            'timings': state['timings'],
+            'started_at': state['started_at'],
+            'ready_at': state['ready_at'],
+            'timestamp': datetime.now().isoformat()
+        }), code
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'ヘルスチェックエラー: {str(e)}'
+        }), 500
+
+
+@app.route('/api/ready')
+async def readiness_check():
+    """レディネスチェックAPI（ロードバランサー向け。準備完了までは503）"""
+    if not sync_app.is_ready():
+        return _not_ready_response()
+    return jsonify({
+        'success': True,
+        'ready': True,
+        'timings': sync_app.get_init_state()['timings']
+    })
+
+
+@app.route('/api/stats')
+async def get_stats():
+    """統計情報API"""
+    if not sync_app.is_ready():
+        return _not_ready_response()
+
+    try:
+        stats = await executor.run(sync_app.vector_store.get_statistics)
+        stats['sessions'] = sync_app.session_states.stats()
+        return jsonify({
+            'success': True,
+            'stats': stats
+        })
+    except ExecutorBusy as e:
+        return _unavailable_response(str(e), 'busy', retry_after=1)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'統計情報取得エラー: {str(e)}'
+        })
+
+
+if __name__ == '__main__':
+    logger.info("大前研一チャットボット（asyncio版）を起動中...")
+    port = int(os.environ.get('PORT', 5000))
+    logger.info(f"アプリケーションをポート {port} で起動します")
+    app.run(host='0.0.0.0', port=port, debug=False)
@@ -5,18 +5,25 @@
 Colabで学習済みのFAISSインデックスを使用
 """
 
+import gc
 import os
+import hashlib
+import secrets
 import sys
+import time
 import logging
-from flask import Flask, render_template, request, jsonify, session
+import threading
+from flask import Flask, Response, render_template, request, jsonify, session
 from datetime import datetime
 import json
 
 # プロジェクトのルートディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from faiss_vector_store import FAISSVectorStore
-from chat_bot import ChatBot
+from session_backend import create_session_backend_from_env
+
+# faiss / sentence_transformers の読み込みは数十秒かかるため、
+# ポートを開いた後にバックグラウンドの初期化スレッドで読み込む
 
 # ログ設定
 logging.basicConfig(
@@ -32,39 +39,201 @@ app.secret_key = 'omae_kenichi_chatbot_secret_key_2024'
 # グローバル変数
 vector_store = None
 chatbot = None
+# 固定の回答のHTTPレスポンス本文とETag（(topic, lang) ごと）
+template_payloads = {}
+# セッションごとの会話の状態（ChatBot は全セッションで1つを共有し、状態を持たない）。
+# CookieにはセッションIDだけを入れ、履歴はサーバー側のバックエンド（memory / sqlite）に保存する
+session_states = create_session_backend_from_env()
+
+# 固定の回答はデプロイまで変わらないため、ブラウザ・CDNでキャッシュさせる
+TEMPLATE_CACHE_CONTROL = 'public, max-age=3600'
+
+# 初期化の状態（status: not_started / loading / ready / failed）
+_init_lock = threading.Lock()
+_init_thread = None
+_init_state = {
+    'status': 'not_started',
+    'phase': None,
+    'timings': {},
+    'error': None,
+    'started_at': None,
+    'ready_at': None
+}
+
+def _parse_page_range(value):
+    """
+    ページ範囲の指定を (開始ページ, 終了ページ) に変換
+    
+    [10, 50] / "10-50" / 12（1ページのみ）の形式に対応
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        start, end = value
+    elif isinstance(value, int) and not isinstance(value, bool):
+        start = end = value
+    elif isinstance(value, str):
+        start, _, end = value.partition('-')
+        end = end or start
+    else:
+        raise ValueError(f"ページ範囲の形式が正しくありません: {value}")
+    # JSONの true / false は int のサブクラスのため、int() に渡す前に除く
+    if isinstance(start, bool) or isinstance(end, bool):
+        raise ValueError(f"ページ範囲の形式が正しくありません: {value}")
+    start, end = int(start), int(end)
+    if start > end:
+        raise ValueError(f"ページ範囲の開始が終了より後になっています: {value}")
+    return start, end
+
+def _set_phase(phase):
+    """初期化中の段階を記録"""
+    with _init_lock:
+        _init_state['phase'] = phase
+
+def _record_timing(phase, start):
+    """初期化の段階にかかった時間（秒）を記録"""
+    with _init_lock:
+        _init_state['timings'][phase] = round(time.perf_counter() - start, 3)
+
+def is_ready():
+    """ベクトルストアとチャットボットが使用可能か"""
+    return _init_state['status'] == 'ready'
+
+def get_init_state():
+    """初期化の状態のコピーを取得"""
+    with _init_lock:
+        state = dict(_init_state)
+        state['timings'] = dict(_init_state['timings'])
+    return state
 
 def initialize_components():
     """コンポーネントの初期化"""
-    global vector_store, chatbot
+    global vector_store, chatbot, template_payloads
+    
+    with _init_lock:
+        _init_state.update(status='loading', error=None, started_at=datetime.now().isoformat())
     
     try:
+        _set_phase('imports')
+        start = time.perf_counter()
+        from chat_bot import ChatBot
+        _record_timing('imports', start)
+        
         # 学習結果ファイルのパスを設定
         base_path = os.path.join(os.path.dirname(__file__), "学習結果")
-        index_path = os.path.join(base_path, "faiss_index_ip.faiss")
-        meta_path = os.path.join(base_path, "faiss_meta.json")
-        texts_path = os.path.join(base_path, "faiss_texts.jsonl")
         
-        logger.info("FAISSベクトルストアを初期化中...")
-        vector_store = FAISSVectorStore(
-            index_path=index_path,
-            meta_path=meta_path,
-            texts_path=texts_path
-        )
+        _set_phase('vector_store')
+        start = time.perf_counter()
+        retrieval_socket = os.environ.get('OMAE_RETRIEVAL_SOCKET')
+        if retrieval_socket:
+            # 検索デーモン（retrieval_server.py）がモデルとインデックスを持ち、ワーカーは接続するだけ
+            from retrieval_server import RetrievalClient
+            logger.info(f"検索デーモンに接続中: {retrieval_socket}")
+            store = RetrievalClient(retrieval_socket)
+            store.wait_until_ready(timeout=float(os.environ.get('OMAE_RETRIEVAL_WAIT', 300)))
+        else:
+            from faiss_vector_store import create_vector_store_from_env
+            logger.info("FAISSベクトルストアを初期化中...")
+            store = create_vector_store_from_env(base_path)
+        _record_timing('vector_store', start)
+        with _init_lock:
+            # インデックス・コーパス・埋め込みモデルなど、ストア内部の段階ごとの時間
+            _init_state['timings'].update({f"vector_store.{phase}": seconds
+                                           for phase, seconds in getattr(store, 'load_timings', {}).items()})
         
         logger.info("チャットボットを初期化中...")
-        chatbot = ChatBot()
+        _set_phase('chatbot')
+        start = time.perf_counter()
+        bot = ChatBot()
+        payloads = _build_template_payloads(bot)
+        _record_timing('chatbot', start)
         
         # 統計情報をログ出力
-        stats = vector_store.get_statistics()
+        stats = store.get_statistics()
         logger.info(f"ベクトルストア統計: {stats}")
         
+        # 両方の準備ができてから公開し、リクエスト側が片方だけを見ることがないようにする
+        vector_store, chatbot, template_payloads = store, bot, payloads
+        with _init_lock:
+            _init_state.update(status='ready', phase=None, ready_at=datetime.now().isoformat())
         logger.info("初期化完了")
         return True
         
     except Exception as e:
         logger.error(f"初期化エラー: {str(e)}")
+        with _init_lock:
+            _init_state.update(status='failed', error=str(e))
         return False
 
+def start_background_initialization():
+    """
+    初期化をバックグラウンドスレッドで開始（開始済みの場合は何もしない）
+    
+    初期化中もポートは開いており、/api/health は応答し、/api/chat は503を返す
+    """
+    global _init_thread
+    with _init_lock:
+        if _init_thread is not None:
+            return _init_thread
+        _init_thread = threading.Thread(target=initialize_components, name='omae-init', daemon=True)
+        _init_thread.start()
+    return _init_thread
+
+def preload_components():
+    """
+    gunicornのマスターで、ワーカーをforkする前にコンポーネントを読み込む（gunicorn_config.py の when_ready から呼ぶ）
+
+    読み込み後に埋め込みモデルの重みを共有メモリへ移し、gc.freeze() で読み込み済みのオブジェクトを
+    GCの対象外（永続世代）にする。ワーカーのGCがこれらのオブジェクトのヘッダに書き込まなくなるため、
+    コピーオンライトのページが複製されずにワーカー間で共有されたままになる
+    
+    Returns:
+        初期化に成功した場合はTrue（失敗した場合、ワーカーは通常どおりバックグラウンドで再試行する）
+    """
+    with _init_lock:
+        if _init_thread is not None or _init_state['status'] != 'not_started':
+            return _init_state['status'] == 'ready'
+    
+    # 読み込み中のGCで世代間を移動したオブジェクトのページを汚さないよう、freezeまでGCを止める
+    gc.disable()
+    try:
+        ready = initialize_components()
+        if ready and hasattr(vector_store, 'share_memory'):
+            vector_store.share_memory()
+        if not ready:
+            # ワーカー側で初期化をやり直せるように戻す
+            with _init_lock:
+                _init_state.update(status='not_started')
+    finally:
+        gc.collect()
+        gc.freeze()
+        gc.enable()
+    logger.info(f"fork前の読み込みが完了しました（凍結したオブジェクト数: {gc.get_freeze_count()}）")
+    return ready
+
+def _not_ready_response():
+    """初期化が終わるまでの503レスポンス"""
+    state = get_init_state()
+    if state['status'] == 'failed':
+        message = f"初期化に失敗しました: {state['error']}"
+    else:
+        message = '起動中です。しばらくしてから再度お試しください'
+    response = jsonify({
+        'success': False,
+        'error': message,
+        'status': state['status'],
+        'phase': state['phase']
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+@app.before_request
+def _ensure_initialization_started():
+    """gunicornなど __main__ を通らない起動でも、最初のリクエストで初期化を開始する"""
+    if _init_thread is None and _init_state['status'] == 'not_started':
+        start_background_initialization()
+
 @app.route('/')
 def index():
     """メインページ"""
@@ -73,6 +242,9 @@ def index():
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """チャットAPI（コンテキスト対応版）"""
+    if not is_ready():
+        return _not_ready_response()
+    
     try:
         data = request.get_json()
         message = data.get('message', '').strip()
@@ -83,40 +255,21 @@ def chat():
                 'error': 'メッセージが空です'
             })
         
-        # セッションにメッセージ履歴を保存
-        if 'chat_history' not in session:
-            session['chat_history'] = []
-        
-        # 類似ドキュメントを検索（コンテキストを考慮）
-        enhanced_query = message
-        if session['chat_history']:
-            # 前の会話履歴からコンテキストを追加
-            last_entry = session['chat_history'][-1]
-            context_keywords = _extract_keywords_from_history(session['chat_history'][-3:])
-            if context_keywords:
-                enhanced_query = f"{message} {context_keywords}"
-        
-        similar_docs = vector_store.search_similar(enhanced_query, n_results=3)
-        
-        # チャットボットでレスポンス生成
-        response = chatbot.generate_response(message, similar_docs)
-        
-        # セッション履歴を更新
-        session['chat_history'].append({
-            'message': message,
-            'response': response,
-            'timestamp': datetime.now().isoformat()
-        })
+        # 書籍・ページ範囲での絞り込み（省略時は全書籍が対象）
+        source = data.get('source') or None
+        try:
+            page_range = _parse_page_range(data.get('page_range'))
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            })
         
-        # 履歴が長すぎる場合は古いものを削除
-        if len(session['chat_history']) > 10:
-            session['chat_history'] = session['chat_history'][-10:]
+        # 意図を先に判定し、検索結果を使う意図の場合だけ類似ドキュメントを検索（コンテキストを考慮）。
+        # 会話履歴はサーバー側のセッションバックエンドで更新する
+        similar_docs, response = _answer(message, _session_id(session), source, page_range)
         
-        return jsonify({
-            'success': True,
-            'response': response,
-            'similar_docs': similar_docs[:2]  # 最初の2件のみ返す
-        })
+        return jsonify(_chat_payload(similar_docs, response, bool(data.get('template_ref'))))
         
     except Exception as e:
         logger.error(f"チャットAPIエラー: {str(e)}")
@@ -125,54 +278,285 @@ def chat():
             'error': f'エラーが発生しました: {str(e)}'
         })
 
-def _extract_keywords_from_history(history_entries):
-    """会話履歴からキーワードを抽出"""
-    if not history_entries:
-        return ""
+def _session_id(current_session):
+    """
+    会話の状態のキー（Cookieのセッションにない場合は発行する）
     
-    keywords = []
-    for entry in history_entries:
-        message = entry.get('message', '')
-        response = entry.get('response', '')
+    Cookieに入れるのはこのIDだけで、会話履歴はサーバー側に保存する
+    """
+    session_id = current_session.get('session_id')
+    if session_id is None:
+        session_id = current_session['session_id'] = secrets.token_urlsafe(16)
+    return session_id
+
+def _answer(message, session_id=None, source=None, page_range=None):
+    """
+    意図を判定してから、必要な場合だけ検索して応答を生成し、会話の状態を更新
+    
+    固定の回答を返す意図（恐怖・失敗・成功など）では埋め込みとFAISS検索を行わない。
+    メッセージの解析（MessageAnalysis）は意図の判定・検索・応答生成で1つを共有する
+    
+    Args:
+        message: ユーザーのメッセージ（または ChatBot.analyze で解析済みのもの）
+        session_id: 会話の状態のキー（Noneの場合は履歴なしで応答し、状態を保存しない）
+    
+    Returns:
+        (類似ドキュメントのリスト, ChatBot.generate_response の応答データ)
+    """
+    analysis = chatbot.analyze(message)
+    state = session_states.get(session_id)
+    similar_docs = []
+    if chatbot.needs_retrieval(analysis.intent):
+        similar_docs = vector_store.search_similar(_build_search_query(analysis, state.history), n_results=3,
+                                                   source=source, page_range=page_range)
+    response = chatbot.generate_response(analysis, similar_docs, state)
+    
+    # 次の質問の検索クエリに加えるキーワードもここで抽出して履歴に保存し、
+    # 以後のリクエストで履歴のメッセージと応答を分割し直さないようにする
+    keywords = _keywords(analysis.tokens + response['response'].split())
+    # 同じセッションの他のリクエストが先に更新していても、その最新の状態に加える
+    session_states.update(session_id, lambda current: chatbot.update_state(current, analysis, response, keywords))
+    return similar_docs, response
+
+def _build_template_payloads(bot):
+    """固定の回答ごとにJSONの本文とETagを作成"""
+    payloads = {}
+    for (topic, lang), text in bot.template_responses.items():
+        body = json.dumps({
+            'success': True,
+            'topic': topic,
+            'lang': lang,
+            'response': text
+        }, ensure_ascii=False).encode('utf-8')
+        payloads[(topic, lang)] = {'body': body, 'etag': hashlib.sha1(body).hexdigest()}
+    return payloads
+
+def _template_url(response):
+    """
+    応答が固定の回答の場合、同じ本文をHTTPキャッシュ付きで返す /api/template/<topic> のURL（それ以外はNone）
+    """
+    key = (response.get('topic'), response.get('lang'))
+    if key not in template_payloads or chatbot.get_template_response(*key) != response.get('response'):
+        return None
+    return f"/api/template/{key[0]}?lang={key[1]}"
+
+def _chat_payload(similar_docs, response, template_ref=False):
+    """
+    /api/chat のJSON本文
+    
+    固定の回答には template_url を付ける。リクエストで template_ref を指定した場合は本文を省き、
+    クライアントは template_url から取得する（ブラウザのHTTPキャッシュ・ETagで再利用される）
+    """
+    template_url = _template_url(response)
+    if template_url is not None and template_ref:
+        response = {key: value for key, value in response.items() if key != 'response'}
+    payload = {
+        'success': True,
+        'response': response,
+        'similar_docs': similar_docs[:2]  # 最初の2件のみ返す
+    }
+    if template_url is not None:
+        payload['template_url'] = template_url
+    return payload
+
+# SSEで応答テキストを送る1イベントあたりの最大文字数
+STREAM_CHUNK_CHARS = 40
+
+def _sse_event(event, data):
+    """Server-Sent Events の1イベント（data はJSON）"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _citation(doc):
+    """検索結果から出典として返す項目だけを取り出す"""
+    return {
+        'source': doc.get('source', ''),
+        'page': doc.get('page', ''),
+        'content': doc.get('content', '')[:200],
+        'citations': doc.get('citations', [])
+    }
+
+def _response_chunks(text, max_chars=STREAM_CHUNK_CHARS):
+    """応答テキストを文末（。！？改行）で区切り、max_chars 文字以下の断片にする"""
+    chunks, current = [], ''
+    for char in text:
+        current += char
+        if char in '。！？!?\n' or len(current) >= max_chars:
+            chunks.append(current)
+            current = ''
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _stream_chat_events(similar_docs, response, template_ref=False):
+    """
+    出典 → 応答テキストの断片 → 完了 の順にSSEイベントを生成
+    
+    固定の回答で template_ref を指定した場合は、断片の代わりに template イベントでURLを送る
+    """
+    template_url = _template_url(response)
+    yield _sse_event('citations', {'similar_docs': [_citation(doc) for doc in similar_docs[:2]]})
+    if template_url is not None and template_ref:
+        yield _sse_event('template', {'topic': response['topic'], 'lang': response['lang'], 'url': template_url})
+    else:
+        for chunk in _response_chunks(response.get('response', '')):
+            yield _sse_event('delta', {'text': chunk})
+    yield _sse_event('done', {
+        'sources': response.get('sources', []),
+        'confidence': response.get('confidence'),
+        'topic': response.get('topic'),
+        'template_url': template_url,
+        'timestamp': datetime.now().isoformat()
+    })
+
+def _sse_response(events):
+    """SSEのレスポンス（プロキシでバッファリングされないようにする）"""
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    チャットAPI（Server-Sent Events版）
+    
+    /api/chat と同じリクエストを受け取り、citations（出典）→ delta（応答テキストの断片）→ done の順に送る。
+    セッションIDのCookieはストリームの開始時に送られるため、検索と応答生成はストリームの開始前に行う
+    （応答生成はテンプレートの組み立てのみで、所要時間のほとんどは検索）
+    """
+    if not is_ready():
+        return _not_ready_response()
+    
+    try:
+        data = request.get_json()
+        message = data.get('message', '').strip()
+        
+        if not message:
+            return jsonify({
+                'success': False,
+                'error': 'メッセージが空です'
+            })
+        
+        source = data.get('source') or None
+        try:
+            page_range = _parse_page_range(data.get('page_range'))
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            })
+        
+        similar_docs, response = _answer(message, _session_id(session), source, page_range)
         
-        # 簡単なキーワード抽出（実際の実装ではより高度な処理が必要）
-        words = (message + ' ' + response).split()
-        keywords.extend([w for w in words if len(w) > 3])
+        return _sse_response(_stream_chat_events(similar_docs, response, bool(data.get('template_ref'))))
+        
+    except Exception as e:
+        logger.error(f"チャットAPI（ストリーム）エラー: {str(e)}")
+        return _sse_response([_sse_event('error', {'error': f'エラーが発生しました: {str(e)}'})])
+
+def _build_search_query(analysis, history):
+    """
+    前の会話履歴のキーワードを加えた検索クエリ
     
-    return ' '.join(keywords[-5:])  # 最後の5つのキーワードのみ
+    キーワードを加えない場合は解析済みのメッセージをそのまま検索に渡す
+    """
+    if not history:
+        return analysis
+    context_keywords = _extract_keywords_from_history(history[-3:])
+    return f"{analysis.text} {context_keywords}" if context_keywords else analysis
+
+# 会話履歴1件・検索クエリに加えるキーワードの最大数
+MAX_CONTEXT_KEYWORDS = 5
+
+def _keywords(words):
+    """簡単なキーワード抽出（実際の実装ではより高度な処理が必要）"""
+    return [w for w in words if len(w) > 3][-MAX_CONTEXT_KEYWORDS:]
+
+def _extract_keywords_from_history(history_entries):
+    """会話履歴からキーワードを抽出（各履歴のキーワードは _answer で抽出済み）"""
+    keywords = [keyword for entry in history_entries for keyword in entry.get('keywords', ())]
+    return ' '.join(keywords[-MAX_CONTEXT_KEYWORDS:])  # 最後の5つのキーワードのみ
+
+@app.route('/api/template/<topic>')
+def template_answer(topic):
+    """
+    固定の回答API（GET /api/template/<topic>?lang=ja|en）
+    
+    事前に作成した本文を返し、ETag / Cache-Control でブラウザ・CDNにキャッシュさせる
+    """
+    if not is_ready():
+        return _not_ready_response()
+    
+    payload = template_payloads.get((topic, request.args.get('lang', 'ja')))
+    if payload is None:
+        return jsonify({
+            'success': False,
+            'error': f'固定の回答がありません: {topic}'
+        }), 404
+    
+    response = app.response_class(payload['body'], mimetype='application/json')
+    response.set_etag(payload['etag'])
+    response.headers['Cache-Control'] = TEMPLATE_CACHE_CONTROL
+    # If-None-Match が一致すれば本文なしの304を返す
+    return response.make_conditional(request)
 
 @app.route('/api/health')
 def health_check():
-    """ヘルスチェックAPI"""
+    """
+    ヘルスチェックAPI
+    
+    live はプロセスが応答できること、ready は検索・回答が可能なことを表す。
+    初期化中も200を返し（プラットフォームのヘルスチェックで再起動されないように）、
+    初期化に失敗した場合のみ500を返す
+    """
     try:
-        if vector_store is None or chatbot is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'コンポーネントが初期化されていません'
-            }), 500
+        state = get_init_state()
+        ready = state['status'] == 'ready'
+        if state['status'] == 'failed':
+            status, message, code = 'error', f"初期化に失敗しました: {state['error']}", 500
+        elif ready:
+            status, message, code = 'healthy', '大前研一チャットボットは正常に動作しています', 200
+        else:
+            status, message, code = 'starting', '起動中です', 200
         
         return jsonify({
-            'status': 'healthy',
-            'message': '大前研一チャットボットは正常に動作しています',
+            'status': status,
+            'message': message,
+            'live': True,
+            'ready': ready,
+            'init_status': state['status'],
+            'phase': state['phase'],
+            'timings': state['timings'],
+            'started_at': state['started_at'],
+            'ready_at': state['ready_at'],
             'timestamp': datetime.now().isoformat()
-        })
+        }), code
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f'ヘルスチェックエラー: {str(e)}'
         }), 500
 
+@app.route('/api/ready')
+def readiness_check():
+    """レディネスチェックAPI（ロードバランサー向け。準備完了までは503）"""
+    if not is_ready():
+        return _not_ready_response()
+    return jsonify({
+        'success': True,
+        'ready': True,
+        'timings': get_init_state()['timings']
+    })
+
 @app.route('/api/stats')
 def get_stats():
     """統計情報API"""
+    if not is_ready():
+        return _not_ready_response()
+    
     try:
-        if vector_store is None:
-            return jsonify({
-                'success': False,
-                'error': 'ベクトルストアが初期化されていません'
-            })
-        
         stats = vector_store.get_statistics()
+        stats['sessions'] = session_states.stats()
         return jsonify({
             'success': True,
             'stats': stats
@@ -187,10 +571,8 @@ def get_stats():
 if __name__ == '__main__':
     logger.info("大前研一チャットボットを起動中...")
     
-    # コンポーネント初期化
-    if not initialize_components():
-        logger.error("初期化に失敗しました。アプリケーションを終了します。")
-        sys.exit(1)
+    # コンポーネントはバックグラウンドで初期化し、その間もポートを開いてヘルスチェックに応答する
+    start_background_initialization()
     
     # ポート設定（Render用）
     port = int(os.environ.get('PORT', 5000))
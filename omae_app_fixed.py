@@ -6,20 +6,25 @@
 
 import os
 import json
-from flask import Flask, request, jsonify, render_template
+import secrets
+from flask import Flask, request, jsonify, render_template, session
 import logging
 import sys
 # sys.path.append('..')  # コメントアウト
 from chat_bot import ChatBot
+from session_state import SessionStateStore
 from simple_vector_store import SimpleVectorStore as VectorStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.secret_key = 'omae_kenichi_chatbot_secret_key_2024'
 
 vector_store = None
 chat_bot = None
+# セッションごとの会話の状態（CookieにはセッションIDだけを入れる）
+session_states = SessionStateStore()
 
 def init_components():
     global vector_store, chat_bot
@@ -56,7 +61,12 @@ def chat():
         similar_docs = vector_store.search_similar(message, n_results=3)
         logger.info(f"検索結果: {len(similar_docs)}件")
         
-        response_data = chat_bot.generate_response(message, similar_docs)
+        # このセッションの会話の状態を使い、応答後に更新（フォローアップ質問・「それを日本語で」用）
+        session_id = session.get('session_id')
+        if session_id is None:
+            session_id = session['session_id'] = secrets.token_urlsafe(16)
+        response_data = chat_bot.generate_response(message, similar_docs, session_states.get(session_id))
+        session_states.update(session_id, lambda state: chat_bot.update_state(state, message, response_data))
         
         return jsonify({
             'success': True,
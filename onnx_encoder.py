@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット ONNX Runtime 埋め込みエンコーダー
+intfloat/multilingual-e5-base をONNXに書き出して動的int8量子化し、
+PyTorchなしのCPU推論でクエリを埋め込む
+
+    python onnx_encoder.py                 # 書き出し + 量子化 + 一致率チェック + レイテンシ比較
+    python onnx_encoder.py --skip-export   # 書き出し済みモデルのチェックのみ
+
+FAISSVectorStore(encoder_backend='onnx') または環境変数 OMAE_ENCODER_BACKEND=onnx で使用する
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'intfloat/multilingual-e5-base'
+MAX_LENGTH = 512
+FLOAT_MODEL_FILE = 'model.onnx'
+INT8_MODEL_FILE = 'model_int8.onnx'
+
+
+class OnnxEncoder:
+    """
+    SentenceTransformer.encode 互換のONNX Runtimeエンコーダー
+
+    e5と同じく、最終層の隠れ状態をattention maskで平均プーリングする
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, max_length: int = MAX_LENGTH,
+                 num_threads: Optional[int] = None):
+        """
+        Args:
+            model_dir: export_onnx で書き出したディレクトリ（モデルとトークナイザー）
+            quantized: int8量子化モデルを使うか
+            max_length: 最大トークン数
+            num_threads: ONNX Runtimeのスレッド数（Noneの場合は既定値）
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, INT8_MODEL_FILE if quantized else FLOAT_MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNXモデルが見つかりません: {model_path}（python onnx_encoder.py で作成）")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        self.model_path = model_path
+        logger.info(f"ONNXエンコーダーを初期化しました: {model_path}")
+
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = False,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        文のリストを埋め込む
+
+        Returns:
+            (件数, 次元) のfloat32行列（単一の文字列を渡した場合は (次元,)）
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # パディングを減らすため長さ順にバッチを作り、最後に元の順序へ戻す
+        order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(sentences), batch_size):
+            batch_ids = order[start:start + batch_size]
+            encoded = self.tokenizer([sentences[i] for i in batch_ids], padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors='np')
+            attention_mask = encoded['attention_mask'].astype('int64')
+            hidden = self.session.run(None, {
+                'input_ids': encoded['input_ids'].astype('int64'),
+                'attention_mask': attention_mask
+            })[0]
+            mask = attention_mask[:, :, None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            for i, vector in zip(batch_ids, pooled):
+                embeddings[i] = vector
+
+        result = np.ascontiguousarray(np.stack(embeddings), dtype='float32') if embeddings \
+            else np.zeros((0, self.dimension), dtype='float32')
+        if normalize_embeddings and len(result):
+            result /= np.clip(np.linalg.norm(result, axis=1, keepdims=True), 1e-12, None)
+        return result[0] if single else result
+
+    @property
+    def dimension(self) -> int:
+        """埋め込みの次元数"""
+        return int(self.session.get_outputs()[0].shape[-1])
+
+
+def export_onnx(output_dir: str, model_name: str = MODEL_NAME, quantize: bool = True) -> str:
+    """
+    Hugging Faceのモデルを ONNX に書き出し、動的int8量子化したモデルも作成
+
+    Returns:
+        書き出したディレクトリ
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    class _LastHiddenState(torch.nn.Module):
+        """最終層の隠れ状態だけを出力するラッパー"""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    float_path = os.path.join(output_dir, FLOAT_MODEL_FILE)
+    dummy = tokenizer(["query: 戦略的思考とは何か"], return_tensors='pt')
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(model),
+            (dummy['input_ids'], dummy['attention_mask']),
+            float_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'last_hidden_state': {0: 'batch', 1: 'sequence'}
+            },
+            opset_version=14
+        )
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f"ONNXモデルを書き出しました: {float_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(output_dir, INT8_MODEL_FILE)
+        quantize_dynamic(float_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"int8量子化モデルを書き出しました: {int8_path}")
+
+    return output_dir
+
+
+def parity_check(reference, encoder, texts: List[str], batch_size: int = 32) -> Dict:
+    """
+    2つのエンコーダーの埋め込みのコサイン類似度を比較
+
+    Args:
+        reference: 基準のエンコーダー（PyTorchのSentenceTransformer）
+        encoder: 比較するエンコーダー
+
+    Returns:
+        コサイン類似度の最小値・平均値と、近傍の上位1件が一致した割合
+    """
+    expected = np.asarray(reference.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype='float32')
+    actual = np.asarray(encoder.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype='float32')
+    cosine = (expected * actual).sum(axis=1)
+
+    # 検索結果への影響: 各文に最も近い他の文が一致するか
+    expected_sim = expected @ expected.T
+    actual_sim = actual @ actual.T
+    np.fill_diagonal(expected_sim, -np.inf)
+    np.fill_diagonal(actual_sim, -np.inf)
+    top1_agreement = float(np.mean(expected_sim.argmax(axis=1) == actual_sim.argmax(axis=1)))
+
+    return {
+        'count': len(texts),
+        'cosine_min': float(cosine.min()),
+        'cosine_mean': float(cosine.mean()),
+        'top1_agreement': top1_agreement
+    }
+
+
+def measure_latency(encoder, queries: List[str], warmup: int = 3) -> Dict:
+    """1クエリずつ埋め込んだときのレイテンシ（ミリ秒）"""
+    for query in queries[:warmup]:
+        encoder.encode([query], normalize_embeddings=True)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        encoder.encode([query], normalize_embeddings=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.array(latencies)
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'mean_ms': float(latencies.mean())
+    }
+
+
+def _load_sample_texts(texts_path: str, limit: int) -> List[str]:
+    """一致率チェック用に学習結果のチャンクを読み込む（passageとqueryの両方の形式）"""
+    texts = []
+    with open(texts_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                texts.append(json.loads(line).get('text', ''))
+            if len(texts) >= limit:
+                break
+    return [f"passage: {text}" for text in texts] + [f"query: {text[:64]}" for text in texts]
+
+
+def main():
+    """メイン関数"""
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='e5エンコーダーをONNX + int8に変換し、一致率とレイテンシを測定')
+    parser.add_argument('--output-dir', default=os.path.join(base_path, 'onnx_e5'))
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--skip-export', action='store_true', help='書き出し済みのモデルを使う')
+    parser.add_argument('--texts', default=os.path.join(base_path, 'faiss_texts.jsonl'))
+    parser.add_argument('--n-texts', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--min-cosine', type=float, default=0.98, help='一致率チェックの合格ライン（コサイン類似度の最小値）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if not args.skip_export:
+        export_onnx(args.output_dir, args.model)
+        print(f"✓ ONNXモデルを書き出しました: {args.output_dir}")
+
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(args.model)
+    encoders = {
+        'onnx-fp32': OnnxEncoder(args.output_dir, quantized=False, num_threads=args.threads),
+        'onnx-int8': OnnxEncoder(args.output_dir, quantized=True, num_threads=args.threads)
+    }
+
+    texts = _load_sample_texts(args.texts, args.n_texts)
+    queries = [text for text in texts if text.startswith('query: ')]
+
+    passed = True
+    print(f"{'encoder':<12}{'cos_min':>10}{'cos_mean':>10}{'top1':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'mean(ms)':>10}")
+    print("-" * 70)
+    latency = measure_latency(reference, queries)
+    print(f"{'torch':<12}{1.0:>10.4f}{1.0:>10.4f}{1.0:>8.3f}"
+          f"{latency['p50_ms']:>10.2f}{latency['p95_ms']:>10.2f}{latency['mean_ms']:>10.2f}")
+    for name, encoder in encoders.items():
+        parity = parity_check(reference, encoder, texts)
+        latency = measure_latency(encoder, queries)
+        print(f"{name:<12}{parity['cosine_min']:>10.4f}{parity['cosine_mean']:>10.4f}{parity['top1_agreement']:>8.3f}"
+              f"{latency['p50_ms']:>10.2f}{latency['p95_ms']:>10.2f}{latency['mean_ms']:>10.2f}")
+        passed = passed and parity['cosine_min'] >= args.min_cosine
+
+    if not passed:
+        print(f"✗ コサイン類似度が {args.min_cosine} を下回る文がありました")
+        return 1
+    print(f"✓ 一致率チェック合格（コサイン類似度 >= {args.min_cosine}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
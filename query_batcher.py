@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット クエリのマイクロバッチ化
+同時に届いた検索リクエストを最大 window_ms ミリ秒 / max_batch_size 件まで集め、
+FAISSVectorStore.search_similar_batch で1回のencodeと1回のindex.searchにまとめる
+
+    python query_batcher.py --threads 16 --window-ms 5 --max-batch-size 16   # 逐次実行との比較
+
+Webアプリと検索デーモンでは環境変数 OMAE_BATCH_WINDOW_MS（0で無効）と
+OMAE_BATCH_MAX_SIZE で有効にする
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_MS = 5.0
+DEFAULT_MAX_BATCH_SIZE = 16
+
+
+class _PendingQuery:
+    """バッチに入れる1件分のリクエストと、その結果の受け渡し"""
+
+    __slots__ = ('query', 'n_results', 'source', 'page_range', 'done', 'result')
+
+    def __init__(self, query: str, n_results: int, source: Optional[str],
+                 page_range: Optional[Tuple[int, int]]):
+        self.query = query
+        self.n_results = n_results
+        self.source = source
+        self.page_range = page_range
+        self.done = threading.Event()
+        self.result: List[Dict] = []
+
+    @property
+    def group_key(self) -> Tuple:
+        """同じ条件（件数・絞り込み）のクエリだけを1回の検索にまとめる"""
+        return (self.n_results, self.source, tuple(self.page_range) if self.page_range is not None else None)
+
+
+class QueryBatcher:
+    """
+    FAISSVectorStore の前段に置くリクエスト集約スケジューラ
+
+    search_similar は FAISSVectorStore と同じシグネチャで、呼び出したスレッドは
+    自分のクエリを含むバッチの検索が終わるまで待つ。それ以外の属性はストアに委譲する
+    """
+
+    def __init__(self, vector_store, window_ms: float = DEFAULT_WINDOW_MS,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        """
+        Args:
+            vector_store: FAISSVectorStore
+            window_ms: 最初のクエリが届いてから後続のクエリを待つ時間（ミリ秒、0でバッチ化しない）
+            max_batch_size: 1バッチの最大件数（達した時点で待たずに検索する）
+        """
+        self.vector_store = vector_store
+        self.window_ms = window_ms
+        self.max_batch_size = max(1, max_batch_size)
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+        self._batches = 0
+        self._batched_queries = 0
+        self._max_observed_batch = 0
+
+    def __getattr__(self, name):
+        # get_statistics 以外の属性（load_timings / share_memory / add_documents など）はストアのもの
+        if name == 'vector_store':
+            raise AttributeError(name)
+        return getattr(self.vector_store, name)
+
+    def _ensure_dispatcher(self) -> queue.Queue:
+        """
+        集約スレッドを起動（fork後のプロセスでは作り直す）
+
+        gunicornのマスターで作成してforkした場合、スレッドは子プロセスに引き継がれないため
+        最初の検索で起動する
+        """
+        with self._lock:
+            if self._dispatcher is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._dispatcher = threading.Thread(target=self._run, args=(self._queue,),
+                                                    name='omae-query-batcher', daemon=True)
+                self._dispatcher.start()
+            return self._queue
+
+    def search_similar(self, query: str, n_results: int = 5, source: Optional[str] = None,
+                       page_range: Optional[Tuple[int, int]] = None) -> List[Dict]:
+        """
+        類似ドキュメントの検索（同時に届いた他のクエリと1回の検索にまとめる）
+
+        Returns:
+            FAISSVectorStore.search_similar と同じ形式の類似ドキュメントのリスト
+        """
+        if self.window_ms <= 0 or self.max_batch_size == 1 or self._closed:
+            return self.vector_store.search_similar(query, n_results=n_results, source=source,
+                                                    page_range=page_range)
+
+        pending = _PendingQuery(query, n_results, source, page_range)
+        self._ensure_dispatcher().put(pending)
+        pending.done.wait()
+        return pending.result
+
+    def _collect(self, requests: queue.Queue) -> List[_PendingQuery]:
+        """最初のクエリを待ち、窓の時間内に届いたクエリを max_batch_size 件まで集める"""
+        batch = [requests.get()]
+        deadline = time.monotonic() + self.window_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, requests: queue.Queue) -> None:
+        """集約スレッド: バッチを集めて条件ごとに search_similar_batch を呼ぶ"""
+        while True:
+            batch = self._collect(requests)
+            groups: Dict[Tuple, List[_PendingQuery]] = {}
+            for pending in batch:
+                groups.setdefault(pending.group_key, []).append(pending)
+
+            for members in groups.values():
+                first = members[0]
+                try:
+                    results = self.vector_store.search_similar_batch(
+                        [pending.query for pending in members], n_results=first.n_results,
+                        batch_size=self.max_batch_size, source=first.source, page_range=first.page_range)
+                except Exception as e:
+                    logger.error(f"バッチ検索エラー: {str(e)}")
+                    results = [[] for _ in members]
+                for pending, result in zip(members, results):
+                    pending.result = result
+                    pending.done.set()
+
+            with self._lock:
+                self._batches += 1
+                self._batched_queries += len(batch)
+                self._max_observed_batch = max(self._max_observed_batch, len(batch))
+
+    def get_statistics(self) -> Dict:
+        """ベクトルストアの統計情報にバッチ化の集計を加える"""
+        stats = self.vector_store.get_statistics()
+        with self._lock:
+            stats['batching'] = {
+                'window_ms': self.window_ms,
+                'max_batch_size': self.max_batch_size,
+                'batches': self._batches,
+                'queries': self._batched_queries,
+                'mean_batch_size': self._batched_queries / self._batches if self._batches else 0.0,
+                'max_observed_batch_size': self._max_observed_batch
+            }
+        return stats
+
+    def close(self) -> None:
+        """以後の検索はバッチ化せずに直接ストアで実行する（集約スレッドはデーモンのため待たない）"""
+        self._closed = True
+
+
+def run_benchmark(search, queries: List[str], n_threads: int, n_results: int = 3) -> Dict:
+    """
+    n_threads 個のスレッドから同時に検索し、スループットとレイテンシを測定
+
+    Args:
+        search: search_similar と同じシグネチャの関数
+    """
+    latencies: List[float] = []
+    lock = threading.Lock()
+    position = iter(range(len(queries)))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            search(queries[i], n_results=n_results)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    return {
+        'qps': len(queries) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95))
+    }
+
+
+def main():
+    """メイン関数"""
+    from faiss_vector_store import create_vector_store_from_env
+
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果")
+    parser = argparse.ArgumentParser(description='同時検索をマイクロバッチ化した場合のスループットを比較')
+    parser.add_argument('--base-path', default=base_path)
+    parser.add_argument('--threads', type=int, default=16, help='同時に検索するスレッド数')
+    parser.add_argument('--queries', type=int, default=256)
+    parser.add_argument('--window-ms', type=float, default=DEFAULT_WINDOW_MS)
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # 埋め込みキャッシュに当たると encode の比較にならないため無効にし、バッチ化はここで比較する
+    os.environ['OMAE_QUERY_CACHE_SIZE'] = '0'
+    os.environ['OMAE_BATCH_WINDOW_MS'] = '0'
+    vector_store = create_vector_store_from_env(args.base_path)
+    batcher = QueryBatcher(vector_store, window_ms=args.window_ms, max_batch_size=args.max_batch_size)
+
+    topics = ['戦略的思考', '副業', '日本企業の課題', '3C分析', 'リーダーシップ', '英語', '老後の準備', '教育']
+    queries = [f"{topics[i % len(topics)]}について教えてください（{i}）" for i in range(args.queries)]
+
+    print(f"{'mode':<10}{'qps':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+    print("-" * 40)
+    for name, search in (('direct', vector_store.search_similar), ('batched', batcher.search_similar)):
+        result = run_benchmark(search, queries, args.threads)
+        print(f"{name:<10}{result['qps']:>10.1f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}")
+
+    batching = batcher.get_statistics()['batching']
+    print(f"✓ 平均バッチサイズ {batching['mean_batch_size']:.1f}（最大 {batching['max_observed_batch_size']}、"
+          f"窓 {args.window_ms}ms / 上限 {args.max_batch_size}件）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット クエリ埋め込みキャッシュ
+同じ質問の埋め込み計算（e5-baseの順伝播）を省略するためのLRU/TTLキャッシュ
+"""
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_query(text: str) -> str:
+    """
+    キャッシュキー用にクエリを正規化
+
+    NFKC正規化で全角英数字・半角カナなどの文字幅を揃え、
+    全角スペースを含む連続空白を1つの半角スペースにまとめる
+    """
+    text = unicodedata.normalize('NFKC', text)
+    return _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+class QueryEmbeddingCache:
+    """スレッドセーフなLRU/TTL埋め込みキャッシュ"""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = 3600):
+        """
+        Args:
+            max_size: 保持する最大エントリ数
+            ttl_seconds: エントリの有効期間（秒）。Noneの場合は無期限
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """キャッシュから埋め込みを取得（存在しなければNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            embedding, stored_at = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        """埋め込みをキャッシュに追加し、上限を超えた分を古い順に削除"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """キャッシュを空にする（カウンタは保持）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """ヒット率などの統計情報"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
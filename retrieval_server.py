@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット 検索デーモン
+埋め込みモデルとFAISSインデックスを1プロセスだけが持ち、gunicornの各ワーカーには
+Unixドメインソケット経由で検索結果を返す
+
+    python retrieval_server.py --socket /tmp/omae_retrieval.sock
+    OMAE_RETRIEVAL_SOCKET=/tmp/omae_retrieval.sock gunicorn --config gunicorn_config.py omae_app_faiss:app
+
+プロトコル（すべてビッグエンディアン、1接続で複数のリクエストを送れる）:
+    リクエスト  ヘッダ !BBHiiHI = 命令, フラグ, 件数, 開始ページ, 終了ページ, source長, query長
+                続けて source, query（UTF-8）
+    レスポンス  ヘッダ !BI = 状態（0: 成功 / 1: エラー）, 本文長
+                検索の本文は !H = 件数、続けて1件ごとに
+                !iifff = index, page, distance, lexical_score, rrf_score（該当しない値はNaN / -1）
+                !HII   = source長, content長, citations長（citationsはJSON）と各文字列
+
+このモジュールは標準ライブラリだけを読み込むため、クライアント側（Webワーカー）は
+faiss / numpy / sentence_transformers を読み込まない
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = '/tmp/omae_retrieval.sock'
+# ソケットの権限（所有者とグループのみ接続可能）。Webワーカーが別ユーザーの場合はグループを合わせる
+DEFAULT_SOCKET_MODE = 0o660
+
+# 命令
+OP_SEARCH = 1
+OP_STATS = 2
+OP_PING = 3
+
+# 状態
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# リクエストのフラグ
+FLAG_PAGE_RANGE = 0x01
+
+_REQUEST_HEADER = struct.Struct('!BBHiiHI')
+_RESPONSE_HEADER = struct.Struct('!BI')
+_COUNT = struct.Struct('!H')
+_DOC_NUMBERS = struct.Struct('!iifff')
+# citationsは重複除去で統合したチャンクで64KBを超えることがあるため、contentと同じく32ビットにする
+_DOC_LENGTHS = struct.Struct('!HII')
+
+# 1メッセージの上限（壊れたヘッダで巨大な読み込みをしないため）
+_MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """指定バイト数を受信（途中で切断された場合は ConnectionError）"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            raise ConnectionError("接続が切断されました")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def encode_request(op: int, query: str = '', n_results: int = 5, source: Optional[str] = None,
+                   page_range: Optional[Tuple[int, int]] = None) -> bytes:
+    """リクエストをバイト列に変換"""
+    query_bytes = query.encode('utf-8')
+    source_bytes = (source or '').encode('utf-8')
+    flags = FLAG_PAGE_RANGE if page_range is not None else 0
+    start, end = page_range if page_range is not None else (0, 0)
+    header = _REQUEST_HEADER.pack(op, flags, n_results, int(start), int(end), len(source_bytes), len(query_bytes))
+    return header + source_bytes + query_bytes
+
+
+def read_request(sock: socket.socket) -> Dict:
+    """ソケットからリクエストを1件読む"""
+    op, flags, n_results, start, end, source_length, query_length = \
+        _REQUEST_HEADER.unpack(_recv_exact(sock, _REQUEST_HEADER.size))
+    if query_length > _MAX_MESSAGE_BYTES:
+        raise ValueError(f"クエリが大きすぎます: {query_length}バイト")
+    source = _recv_exact(sock, source_length).decode('utf-8') if source_length else None
+    query = _recv_exact(sock, query_length).decode('utf-8') if query_length else ''
+    return {
+        'op': op,
+        'query': query,
+        'n_results': n_results,
+        'source': source,
+        'page_range': (start, end) if flags & FLAG_PAGE_RANGE else None
+    }
+
+
+def _optional_float(value) -> float:
+    return float(value) if value is not None else math.nan
+
+
+def encode_documents(documents: List[Dict]) -> bytes:
+    """search_similar の結果をバイト列に変換"""
+    parts = [_COUNT.pack(len(documents))]
+    for doc in documents:
+        page = doc.get('page', '')
+        source_bytes = str(doc.get('source', '')).encode('utf-8')
+        content_bytes = str(doc.get('content', '')).encode('utf-8')
+        citations = doc.get('citations') or []
+        citations_bytes = json.dumps(citations, ensure_ascii=False).encode('utf-8') if citations else b''
+        parts.append(_DOC_NUMBERS.pack(
+            int(doc.get('index', -1)),
+            int(page) if page != '' else -1,
+            _optional_float(doc.get('distance')),
+            _optional_float(doc.get('lexical_score')),
+            _optional_float(doc.get('rrf_score'))
+        ))
+        parts.append(_DOC_LENGTHS.pack(len(source_bytes), len(content_bytes), len(citations_bytes)))
+        parts.extend((source_bytes, content_bytes, citations_bytes))
+    return b''.join(parts)
+
+
+def decode_documents(payload: bytes) -> List[Dict]:
+    """encode_documents の逆変換（FAISSVectorStore.search_similar と同じ形式の辞書）"""
+    (count,) = _COUNT.unpack_from(payload, 0)
+    offset = _COUNT.size
+    documents = []
+    for _ in range(count):
+        index, page, distance, lexical_score, rrf_score = _DOC_NUMBERS.unpack_from(payload, offset)
+        offset += _DOC_NUMBERS.size
+        source_length, content_length, citations_length = _DOC_LENGTHS.unpack_from(payload, offset)
+        offset += _DOC_LENGTHS.size
+        source = payload[offset:offset + source_length].decode('utf-8')
+        offset += source_length
+        content = payload[offset:offset + content_length].decode('utf-8')
+        offset += content_length
+        citations = json.loads(payload[offset:offset + citations_length]) if citations_length else []
+        offset += citations_length
+
+        doc = {
+            'content': content,
+            'source': source,
+            'page': page if page >= 0 else '',
+            'citations': citations,
+            'distance': distance,
+            'index': index
+        }
+        # ハイブリッド検索のときだけ存在する項目
+        if not math.isnan(lexical_score):
+            doc['lexical_score'] = lexical_score
+        if not math.isnan(rrf_score):
+            doc['rrf_score'] = rrf_score
+        documents.append(doc)
+    return documents
+
+
+class _RetrievalHandler(socketserver.BaseRequestHandler):
+    """1接続分のリクエストを順に処理"""
+
+    def handle(self):
+        store = self.server.vector_store
+        while True:
+            try:
+                request = read_request(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                if request['op'] == OP_SEARCH:
+                    payload = encode_documents(store.search_similar(
+                        request['query'], n_results=request['n_results'],
+                        source=request['source'], page_range=request['page_range']))
+                elif request['op'] == OP_STATS:
+                    payload = json.dumps(store.get_statistics(), ensure_ascii=False, default=str).encode('utf-8')
+                elif request['op'] == OP_PING:
+                    payload = b''
+                else:
+                    raise ValueError(f"未対応の命令です: {request['op']}")
+                status = STATUS_OK
+            except Exception as e:
+                logger.error(f"検索デーモンのリクエスト処理エラー: {str(e)}")
+                status, payload = STATUS_ERROR, str(e).encode('utf-8')
+
+            try:
+                self.request.sendall(_RESPONSE_HEADER.pack(status, len(payload)) + payload)
+            except OSError:
+                return
+
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ベクトルストアを1つだけ持つスレッド型のUnixソケットサーバー"""
+
+    daemon_threads = True
+    # gunicornの全ワーカーが同時に接続しても取りこぼさないよう、listenのキューを大きくする
+    request_queue_size = 128
+
+    def __init__(self, socket_path: str, vector_store, mode: int = DEFAULT_SOCKET_MODE,
+                 group: Optional[str] = None):
+        """
+        Args:
+            socket_path: Unixドメインソケットのパス（既存のソケットファイルは置き換える）
+            vector_store: FAISSVectorStore
+            mode: ソケットの権限（接続には書き込み権限が必要）
+            group: ソケットのグループ（グループ名またはGID。Noneの場合は変更しない）
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.vector_store = vector_store
+        super().__init__(socket_path, _RetrievalHandler)
+        try:
+            # 接続できるのは所有者と、指定したグループ（Webワーカーのユーザーのグループ）だけにする
+            if group is not None:
+                os.chown(socket_path, -1, _group_id(group))
+            os.chmod(socket_path, mode)
+        except Exception:
+            self.server_close()
+            os.unlink(socket_path)
+            raise
+
+
+def _group_id(group: str) -> int:
+    """グループ名またはGIDの文字列をGIDに変換"""
+    if group.isdigit():
+        return int(group)
+    import grp
+    return grp.getgrnam(group).gr_gid
+
+
+class RetrievalClient:
+    """
+    検索デーモンのクライアント
+
+    FAISSVectorStore.search_similar / get_statistics と同じシグネチャで呼び出せる。
+    接続はスレッドごとに保持し、切断された場合は1回だけ再接続して再送する
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 30.0):
+        """
+        Args:
+            socket_path: retrieval_server.py のソケットのパス
+            timeout: 1リクエストのタイムアウト（秒）
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.load_timings: Dict[str, float] = {}
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None and getattr(self._local, 'pid', None) != os.getpid():
+            # gunicornのマスターで接続した後にforkした場合、ソケットをワーカー間で共有しないよう作り直す
+            # （閉じるのはこのプロセスのファイルディスクリプタだけで、親の接続には影響しない）
+            self._close()
+            sock = None
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _close(self) -> None:
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _call(self, message: bytes) -> bytes:
+        """リクエストを送ってレスポンスの本文を返す"""
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(message)
+                status, length = _RESPONSE_HEADER.unpack(_recv_exact(sock, _RESPONSE_HEADER.size))
+                payload = _recv_exact(sock, length)
+                break
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt == 1:
+                    raise
+        if status != STATUS_OK:
+            raise RuntimeError(f"検索デーモンのエラー: {payload.decode('utf-8', 'replace')}")
+        return payload
+
+    def search_similar(self, query, n_results: int = 5, source: Optional[str] = None,
+                       page_range: Optional[Tuple[int, int]] = None) -> List[Dict]:
+        """
+        類似ドキュメントの検索（FAISSVectorStore.search_similar と同じ）
+
+        通信エラーの場合もFAISSVectorStoreと同様に空リストを返す。
+        query には文字列と message_analysis.MessageAnalysis のどちらも渡せる
+        （numpyを読み込まないよう、ここでは message_analysis をimportしない）
+        """
+        try:
+            text = getattr(query, 'text', query)
+            payload = self._call(encode_request(OP_SEARCH, text, n_results, source, page_range))
+            return decode_documents(payload)
+        except Exception as e:
+            logger.error(f"検索デーモンでの検索エラー: {str(e)}")
+            return []
+
+    def get_statistics(self) -> Dict:
+        """検索デーモン側のベクトルストアの統計情報"""
+        try:
+            stats = json.loads(self._call(encode_request(OP_STATS)))
+            stats['retrieval_socket'] = self.socket_path
+            return stats
+        except Exception as e:
+            logger.error(f"検索デーモンの統計情報取得エラー: {str(e)}")
+            return {}
+
+    def ping(self) -> bool:
+        """検索デーモンが応答するか"""
+        try:
+            self._call(encode_request(OP_PING))
+            return True
+        except (ConnectionError, OSError, RuntimeError):
+            return False
+
+    def wait_until_ready(self, timeout: float = 300.0, interval: float = 0.5) -> None:
+        """
+        検索デーモンが起動してソケットに応答するまで待つ
+
+        Raises:
+            TimeoutError: timeout 秒以内に応答しなかった場合
+        """
+        deadline = time.monotonic() + timeout
+        while not self.ping():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"検索デーモンが応答しません: {self.socket_path}")
+            time.sleep(interval)
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description='埋め込みモデルとFAISSインデックスを持つ検索デーモン')
+    parser.add_argument('--socket', default=os.environ.get('OMAE_RETRIEVAL_SOCKET', DEFAULT_SOCKET_PATH))
+    parser.add_argument('--socket-mode', type=lambda value: int(value, 8),
+                        default=os.environ.get('OMAE_RETRIEVAL_SOCKET_MODE', f"{DEFAULT_SOCKET_MODE:o}"),
+                        help='ソケットの権限（8進数、例: 660 / 600）')
+    parser.add_argument('--socket-group', default=os.environ.get('OMAE_RETRIEVAL_SOCKET_GROUP') or None,
+                        help='ソケットのグループ（Webワーカーが別ユーザーの場合、そのユーザーが属するグループ）')
+    parser.add_argument('--base-path', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "学習結果"))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    from faiss_vector_store import create_vector_store_from_env
+
+    # ソケットはストアの読み込み完了後に作るため、クライアントは ping で準備完了を判定できる
+    vector_store = create_vector_store_from_env(args.base_path)
+    server = RetrievalServer(args.socket, vector_store, mode=args.socket_mode, group=args.socket_group)
+    print(f"✓ 検索デーモンを起動しました: {args.socket}（権限 {args.socket_mode:o}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
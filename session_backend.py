@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット サーバー側のセッションバックエンド
+CookieにはセッションIDだけを入れ、会話の状態（session_state.ConversationState）はサーバー側に保存する
+
+    memory  session_state.SessionStateStore（プロセス内。合計サイズの上限とLRU/TTLで削除）
+    sqlite  SQLiteSessionBackend（ローカルのファイル。gunicornの複数ワーカーで同じ会話を参照できる）
+
+どちらも get / update / discard / clear / stats の同じメソッドを持ち、
+環境変数 OMAE_SESSION_BACKEND で選ぶ（OMAE_SESSION_DB / OMAE_SESSION_MAX_BYTES / OMAE_SESSION_TTL）
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, Optional
+
+from session_state import (DEFAULT_MAX_BYTES, DEFAULT_TTL_SECONDS, EMPTY_STATE, ConversationState,
+                           SessionStateStore)
+
+logger = logging.getLogger(__name__)
+
+# 会話履歴を他のユーザーから読み書きされないよう、共有の /tmp ではなくアプリのディレクトリの下に置く
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions', 'omae_sessions.sqlite3')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS session_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO session_counters (name, value) VALUES ('total_bytes', 0), ('evictions', 0), ('expirations', 0);
+"""
+
+
+class SQLiteSessionBackend:
+    """
+    SQLiteファイルに会話の状態を保存するセッションバックエンド（SessionStateStore と同じメソッド）
+
+    状態は ConversationState.to_dict のJSONで保存し、合計サイズ（JSONのバイト数）が max_bytes を
+    超えた場合は最後の更新が古いセッションから削除する。ttl_seconds の間更新されなかったセッションは
+    期限切れとして扱い、次の更新時に削除する
+
+    接続はスレッドごと・プロセスごとに作るため、スレッドプールとgunicornの複数ワーカーから同時に使ってよい
+    （WALモードで読み込みは書き込みを待たず、更新は BEGIN IMMEDIATE で直列化する）
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS, busy_timeout: float = 5.0):
+        """
+        Args:
+            path: SQLiteファイルのパス（存在しない場合は所有者のみ読み書きできるファイルとして作成する）
+            max_bytes: 全セッションの状態の合計サイズの上限（バイト）
+            ttl_seconds: 最後の更新からの有効期間（秒）。Noneの場合は無期限
+            busy_timeout: 他のプロセスの更新を待つ最大時間（秒）
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+        # ディレクトリがない場合は所有者だけが使えるディレクトリを作り、新しいファイルも所有者だけが読み書きできるようにする
+        # （WAL・共有メモリのファイルはSQLiteがデータベースと同じ権限で作成する）
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700)
+            os.chmod(directory, 0o700)
+        created = not os.path.exists(path)
+
+        # gunicornのマスターで作成した場合も接続をワーカーに引き継がないよう、表の作成後すぐに閉じる
+        with closing(self._connect()) as conn:
+            if created:
+                os.chmod(path, 0o600)
+            conn.executescript(_SCHEMA)
+        logger.info(f"セッションバックエンド（SQLite）を開きました: {path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        """このスレッドの接続（fork後のプロセスでは作り直す）"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """書き込みのトランザクション（開始時に書き込みロックを取り、他のプロセスの更新と直列化する）"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            # COMMIT に失敗した場合も含め、このスレッドの接続をトランザクションの外に戻す
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                # ROLLBACK もできない接続は捨て、次の呼び出しで作り直す
+                self._local.connection = None
+                conn.close()
+            raise
+
+    @staticmethod
+    def _add_counter(conn: sqlite3.Connection, name: str, delta: int) -> None:
+        if delta:
+            conn.execute('UPDATE session_counters SET value = value + ? WHERE name = ?', (delta, name))
+
+    def _is_expired(self, updated_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - updated_at > self.ttl_seconds
+
+    def _remove_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        """有効期間を過ぎたセッションを削除（トランザクション内で呼ぶ）"""
+        if self.ttl_seconds is None:
+            return
+        cutoff = now - self.ttl_seconds
+        count, nbytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM sessions WHERE updated_at < ?',
+                                     (cutoff,)).fetchone()
+        if count:
+            conn.execute('DELETE FROM sessions WHERE updated_at < ?', (cutoff,))
+            self._add_counter(conn, 'total_bytes', -nbytes)
+            self._add_counter(conn, 'expirations', count)
+
+    def _evict(self, conn: sqlite3.Connection, keep_session_id: str) -> None:
+        """合計サイズが上限を超えた分を、最後の更新が古いセッションから削除（トランザクション内で呼ぶ）"""
+        excess = conn.execute("SELECT value FROM session_counters WHERE name = 'total_bytes'").fetchone()[0] \
+            - self.max_bytes
+        if excess <= 0:
+            return
+        evicted, freed = [], 0
+        rows = conn.execute('SELECT session_id, nbytes FROM sessions WHERE session_id != ? ORDER BY updated_at',
+                            (keep_session_id,))
+        for session_id, nbytes in rows:
+            if freed >= excess:
+                break
+            evicted.append((session_id,))
+            freed += nbytes
+        conn.executemany('DELETE FROM sessions WHERE session_id = ?', evicted)
+        self._add_counter(conn, 'total_bytes', -freed)
+        self._add_counter(conn, 'evictions', len(evicted))
+
+    def get(self, session_id: Optional[str]) -> ConversationState:
+        """セッションの状態（存在しない・期限切れ・読み込みエラーの場合は EMPTY_STATE）"""
+        if not session_id:
+            return EMPTY_STATE
+        try:
+            row = self._connection().execute('SELECT data, updated_at FROM sessions WHERE session_id = ?',
+                                              (session_id,)).fetchone()
+            if row is None or self._is_expired(row[1], time.time()):
+                return EMPTY_STATE
+            return ConversationState.from_dict(json.loads(row[0]))
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"セッション読み込みエラー: {str(e)}")
+            return EMPTY_STATE
+
+    def update(self, session_id: Optional[str],
+               func: Callable[[ConversationState], ConversationState]) -> ConversationState:
+        """
+        セッションの状態を func(現在の状態) で置き換え、期限切れと上限を超えた分を削除
+
+        他のプロセス・スレッドの更新とは直列化されるため、同じセッションへの同時のリクエストの更新も失われない。
+        保存に失敗した場合はエラーをログに出し、保存されなかった状態を返す（応答は返せるようにする）
+        """
+        if not session_id:
+            return func(EMPTY_STATE)
+        state = None
+        try:
+            now = time.time()
+            with self._transaction() as conn:
+                self._remove_expired(conn, now)
+                row = conn.execute('SELECT data, nbytes FROM sessions WHERE session_id = ?',
+                                   (session_id,)).fetchone()
+                current = ConversationState.from_dict(json.loads(row[0])) if row is not None else EMPTY_STATE
+                state = func(current)
+
+                data = json.dumps(state.to_dict(), ensure_ascii=False)
+                nbytes = len(data.encode('utf-8'))
+                conn.execute('INSERT OR REPLACE INTO sessions (session_id, data, nbytes, updated_at) '
+                             'VALUES (?, ?, ?, ?)', (session_id, data, nbytes, now))
+                self._add_counter(conn, 'total_bytes', nbytes - (row[1] if row is not None else 0))
+                self._evict(conn, session_id)
+            return state
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"セッション保存エラー: {str(e)}")
+            return state if state is not None else func(EMPTY_STATE)
+
+    def discard(self, session_id: str) -> None:
+        """セッションの状態を削除"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT nbytes FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+                self._add_counter(conn, 'total_bytes', -row[0])
+
+    def clear(self) -> None:
+        """全セッションを削除（カウンタは保持）"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM sessions')
+            conn.execute("UPDATE session_counters SET value = 0 WHERE name = 'total_bytes'")
+
+    def stats(self) -> Dict:
+        """セッション数と合計サイズなどの統計情報（全プロセスの合計）"""
+        conn = self._connection()
+        counters = dict(conn.execute('SELECT name, value FROM session_counters').fetchall())
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'sessions': conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0],
+            'total_bytes': counters['total_bytes'],
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'evictions': counters['evictions'],
+            'expirations': counters['expirations']
+        }
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+def create_session_backend_from_env():
+    """
+    環境変数の設定でセッションバックエンドを作成
+
+    OMAE_SESSION_BACKEND: memory（既定）/ sqlite
+    （memory はワーカーごとに別の状態になるため、gunicorn_config.py はワーカーが複数の場合に sqlite を既定にする）
+    """
+    backend = os.environ.get('OMAE_SESSION_BACKEND', 'memory')
+    max_bytes = int(os.environ.get('OMAE_SESSION_MAX_BYTES', DEFAULT_MAX_BYTES))
+    ttl = float(os.environ.get('OMAE_SESSION_TTL', DEFAULT_TTL_SECONDS))
+    ttl_seconds = ttl if ttl > 0 else None
+
+    if backend == 'sqlite':
+        return SQLiteSessionBackend(os.environ.get('OMAE_SESSION_DB', DEFAULT_DB_PATH),
+                                    max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    if backend == 'memory':
+        return SessionStateStore(max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    raise ValueError(f"未対応のセッションバックエンドです: {backend}")
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大前研一チャットボット セッションごとの会話の状態
+ChatBot は状態を持たず、会話履歴と前の回答（「それを日本語で」用）はセッションIDごとにここで保持する
+（CookieにはセッションIDだけを入れる）
+
+SessionStateStore はプロセス内のメモリに保持するバックエンドで、全セッションの合計サイズの上限
+（LRUで削除）と、最後の利用からの有効期間（TTL）でメモリ使用量を抑える。
+スレッドプール・スレッドワーカーから同時に使ってよい。
+複数のワーカープロセスで共有する場合は session_backend.SQLiteSessionBackend を使う
+
+    python session_state.py --sessions 2000 --threads 8 --max-bytes 1048576   # 上限と分離の確認
+    python session_state.py --backend sqlite --db /tmp/omae_sessions_test.sqlite3
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 1800.0
+
+# 状態1件あたりの固定の大きさ（オブジェクト・タプル・辞書のおおよその大きさ）
+_STATE_OVERHEAD = 200
+_ENTRY_OVERHEAD = 300
+
+
+def _text_nbytes(text: Optional[str]) -> int:
+    """文字列のおおよそのメモリ使用量"""
+    return sys.getsizeof(text) if text else 0
+
+
+class ConversationState:
+    """
+    1セッション分の会話の状態
+
+    作成後は変更せず、更新時は add_turn で新しい状態を作る
+    （検索・応答生成中のスレッドが読んでいる状態を他のスレッドが書き換えない）
+    """
+
+    __slots__ = ('history', 'last_response', 'nbytes')
+
+    def __init__(self, history: Tuple[Dict[str, str], ...] = (), last_response: Optional[str] = None):
+        """
+        Args:
+            history: {'message', 'response', 'keywords', 'timestamp'} の会話履歴（古い順）
+            last_response: 前の回答（「それを日本語で」で使う）
+        """
+        self.history = tuple(history)
+        self.last_response = last_response
+        self.nbytes = _STATE_OVERHEAD + sum(
+            _ENTRY_OVERHEAD + _text_nbytes(entry['message']) + _text_nbytes(entry['response'])
+            + sum(_text_nbytes(keyword) for keyword in entry.get('keywords', ()))
+            for entry in self.history)
+        # 前の回答は通常、履歴の最後の応答と同じ文字列オブジェクト
+        if last_response is not None and not (self.history and self.history[-1]['response'] is last_response):
+            self.nbytes += _text_nbytes(last_response)
+
+    def add_turn(self, message: str, response: str, remember_response: bool = True,
+                 max_history: int = 10, keywords: Sequence[str] = ()) -> 'ConversationState':
+        """
+        1往復を加えた新しい状態
+
+        Args:
+            message: ユーザーのメッセージ
+            response: 応答テキスト
+            remember_response: 前の回答として記憶するか
+            max_history: 保持する履歴の最大長（古いものから削除）
+            keywords: 次の質問の検索クエリに加えるキーワード
+        """
+        entry = {
+            'message': message,
+            'response': response,
+            'keywords': list(keywords),
+            'timestamp': datetime.now().isoformat()
+        }
+        return ConversationState((self.history + (entry,))[-max_history:],
+                                 response if remember_response else self.last_response)
+
+    def to_dict(self) -> Dict:
+        """JSONで保存する形式"""
+        return {'history': list(self.history), 'last_response': self.last_response}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ConversationState':
+        """to_dict の形式から復元"""
+        return cls(data.get('history', ()), data.get('last_response'))
+
+
+# 新しいセッション（履歴なし）の状態
+EMPTY_STATE = ConversationState()
+
+
+class SessionStateStore:
+    """
+    スレッドセーフなセッションIDごとの ConversationState の保持
+
+    合計サイズが max_bytes を超えた場合は最後の利用が古いセッションから削除し、
+    ttl_seconds の間利用されなかったセッションは削除する
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS):
+        """
+        Args:
+            max_bytes: 全セッションの状態の合計サイズの上限（バイト、おおよその値）
+            ttl_seconds: 最後の利用からの有効期間（秒）。Noneの場合は無期限
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # セッションID -> (状態, 最後の利用時刻)。最後の利用が古い順に並ぶ
+        self._entries: "OrderedDict[str, Tuple[ConversationState, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove_expired(self, now: float) -> None:
+        """有効期間を過ぎたセッションを削除（ロックを取得してから呼ぶ）"""
+        if self.ttl_seconds is None:
+            return
+        # 最後の利用が古い順に並んでいるため、先頭から期限切れでないものまで削除すればよい
+        while self._entries:
+            session_id, (state, accessed_at) = next(iter(self._entries.items()))
+            if now - accessed_at <= self.ttl_seconds:
+                break
+            del self._entries[session_id]
+            self.total_bytes -= state.nbytes
+            self.expirations += 1
+
+    def get(self, session_id: Optional[str]) -> ConversationState:
+        """セッションの状態（存在しない・期限切れの場合は EMPTY_STATE）"""
+        if not session_id:
+            return EMPTY_STATE
+        with self._lock:
+            now = time.monotonic()
+            self._remove_expired(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return EMPTY_STATE
+            self._entries[session_id] = (entry[0], now)
+            self._entries.move_to_end(session_id)
+            return entry[0]
+
+    def update(self, session_id: Optional[str],
+               func: Callable[[ConversationState], ConversationState]) -> ConversationState:
+        """
+        セッションの状態を func(現在の状態) で置き換え、上限を超えた分を古い順に削除
+
+        func はロックを取得した状態で呼ぶため、同じセッションへの同時のリクエストの更新も失われない
+        （func は状態を作るだけの短い処理にする）
+        """
+        if not session_id:
+            return func(EMPTY_STATE)
+        with self._lock:
+            now = time.monotonic()
+            self._remove_expired(now)
+            previous = self._entries.get(session_id)
+            current = previous[0] if previous is not None else EMPTY_STATE
+            state = func(current)
+
+            if previous is not None:
+                self.total_bytes -= current.nbytes
+            self._entries[session_id] = (state, now)
+            self._entries.move_to_end(session_id)
+            self.total_bytes += state.nbytes
+
+            # 今回更新したセッション（末尾）は残す
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self.evictions += 1
+            return state
+
+    def discard(self, session_id: str) -> None:
+        """セッションの状態を削除"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry[0].nbytes
+
+    def clear(self) -> None:
+        """全セッションを削除（カウンタは保持）"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict:
+        """セッション数と合計サイズなどの統計情報"""
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'sessions': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description='複数スレッドから同時に更新した場合の上限とセッションの分離を確認')
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--turns', type=int, default=20, help='セッションごとの往復数')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--max-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--response-chars', type=int, default=400)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--db', default='/tmp/omae_sessions_test.sqlite3', help='sqlite の場合のファイル（作り直す）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.backend == 'sqlite':
+        from session_backend import SQLiteSessionBackend
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        store = SQLiteSessionBackend(args.db, max_bytes=args.max_bytes, ttl_seconds=None)
+    else:
+        store = SessionStateStore(max_bytes=args.max_bytes, ttl_seconds=None)
+    mixed = []
+    lock = threading.Lock()
+
+    def converse(session_number: int) -> None:
+        session_id = f"session-{session_number}"
+        for turn in range(args.turns):
+            message = f"{session_id} の質問 {turn}"
+            response = f"{session_id} への回答 {turn} " + 'あ' * random.randint(1, args.response_chars)
+            state = store.update(session_id, lambda state: state.add_turn(message, response))
+            if any(not entry['message'].startswith(f"{session_id} ") for entry in state.history):
+                with lock:
+                    mixed.append(session_id)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(converse, range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    stats = store.stats()
+    print(f"{args.backend}: {args.sessions * args.turns}回の更新: {elapsed:.2f}秒（{args.sessions * args.turns / elapsed:.0f}回/秒）")
+    print(f"保持 {stats['sessions']}セッション / {stats['total_bytes'] / 1024:.0f}KB"
+          f"（上限 {args.max_bytes / 1024:.0f}KB、削除 {stats['evictions']}セッション）")
+
+    if mixed or stats['total_bytes'] > args.max_bytes:
+        print(f"✗ 他のセッションの履歴が混ざった / 上限を超えました（{len(mixed)}件）")
+        return 1
+    print("✓ セッションごとの履歴が分離され、合計サイズが上限内に収まりました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,7 @@
 import json
 import logging
 from chat_bot import ChatBot
+from session_state import EMPTY_STATE
 from simple_vector_store import SimpleVectorStore
 
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +29,9 @@ def main():
         print(f"❌ 初期化エラー: {str(e)}")
         return
     
+    # この対話の会話の状態（フォローアップ質問・「それを日本語で」に使う）
+    state = EMPTY_STATE
+    
     # チャットループ
     while True:
         try:
@@ -45,7 +49,8 @@ def main():
             print("🤔 大前研一の知恵を探しています...")
             
             similar_docs = vector_store.search_similar(user_input, n_results=3)
-            response_data = chat_bot.generate_response(user_input, similar_docs)
+            response_data = chat_bot.generate_response(user_input, similar_docs, state)
+            state = chat_bot.update_state(state, user_input, response_data)
             
             # 応答表示
             print(f"大前研一: {response_data['response']}")
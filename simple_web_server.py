@@ -5,11 +5,14 @@
 """
 
 import http.server
+import http.cookies
+import secrets
 import socketserver
 import json
 import urllib.parse
 import logging
 from chat_bot import ChatBot
+from session_state import SessionStateStore
 from simple_vector_store import SimpleVectorStore
 
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +21,10 @@ logger = logging.getLogger(__name__)
 # グローバル変数
 vector_store = None
 chat_bot = None
+# セッションごとの会話の状態（CookieのセッションIDをキーにする）
+session_states = SessionStateStore()
+
+SESSION_COOKIE = 'omae_session'
 
 class ChatHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
@@ -57,9 +64,12 @@ class ChatHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_json_response({'success': False, 'error': 'メッセージが空です'})
                 return
             
-            # チャットボットの応答生成
+            # チャットボットの応答生成（このセッションの会話の状態を使い、応答後に更新）
+            session_id = self.session_id()
             similar_docs = vector_store.search_similar(message, n_results=3)
-            response_data = chat_bot.generate_response(message, similar_docs)
+            response_data = chat_bot.generate_response(message, similar_docs, session_states.get(session_id))
+            session_states.update(session_id,
+                                  lambda state: chat_bot.update_state(state, message, response_data))
             
             # レスポンス送信
             self.send_json_response({
@@ -73,10 +83,22 @@ class ChatHandler(http.server.SimpleHTTPRequestHandler):
             logger.error(f"チャットエラー: {str(e)}")
             self.send_json_response({'success': False, 'error': str(e)})
     
+    def session_id(self):
+        """CookieのセッションID（ない場合は発行し、レスポンスで Set-Cookie する）"""
+        self.new_session_id = None
+        cookie = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        if SESSION_COOKIE in cookie:
+            return cookie[SESSION_COOKIE].value
+        self.new_session_id = secrets.token_urlsafe(16)
+        return self.new_session_id
+    
     def send_json_response(self, data):
         """JSONレスポンスの送信"""
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
+        new_session_id = getattr(self, 'new_session_id', None)
+        if new_session_id:
+            self.send_header('Set-Cookie', f"{SESSION_COOKIE}={new_session_id}; Path=/; HttpOnly; SameSite=Lax")
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
@@ -8,8 +8,11 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // ローカル会話履歴を保持
     let localConversationHistory = [];
+    
+    // 固定の回答の本文（template_url ごと）。ページ内では再取得せず、再読み込み後はHTTPキャッシュを使う
+    const templateCache = new Map();
 
-    // メッセージ送信処理
+    // メッセージ送信処理（SSEで出典と応答テキストを受け取り次第表示）
     async function sendMessage() {
         const message = messageInput.value.trim();
         if (!message) return;
@@ -28,44 +31,23 @@ document.addEventListener('DOMContentLoaded', function() {
             // コンテキスト情報を含めて送信
             const requestData = {
                 message: message,
-                context: localConversationHistory.slice(-3) // 最新3件の履歴を送信
+                context: localConversationHistory.slice(-3), // 最新3件の履歴を送信
+                template_ref: true // 固定の回答は本文の代わりに template_url を受け取る
             };
             
-            const response = await fetch('/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(requestData)
-            });
+            let response = await postJson('/api/chat/stream', requestData);
+            const contentType = response.headers.get('Content-Type') || '';
 
-            const data = await response.json();
-
-            // 処理中メッセージを削除
-            processingMessage.remove();
-
-            if (data.success) {
-                // ボットの応答を表示
-                addMessage(data.response, 'bot');
-                
-                // ローカル履歴を更新
-                localConversationHistory.push({
-                    message: message,
-                    response: data.response,
-                    timestamp: data.timestamp
-                });
-                
-                // 履歴が長すぎる場合は古いものを削除
-                if (localConversationHistory.length > 10) {
-                    localConversationHistory = localConversationHistory.slice(-10);
-                }
-                
-                // 信頼度が低い場合の警告表示
-                if (data.confidence && data.confidence < 0.7) {
-                    showConfidenceWarning();
-                }
+            if (contentType.includes('text/event-stream')) {
+                await renderStream(response, message, processingMessage);
             } else {
-                addMessage('申し訳ございません。エラーが発生しました。', 'bot');
+                // ストリーム版がないサーバー（omae_app_simple）では通常のAPIを使う
+                if (response.status === 404) {
+                    response = await postJson('/api/chat', requestData);
+                }
+                const data = await response.json();
+                processingMessage.remove();
+                await renderJsonResponse(data, message);
             }
         } catch (error) {
             console.error('Error:', error);
@@ -76,6 +58,195 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // JSONをPOSTする
+    function postJson(url, data) {
+        return fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(data)
+        });
+    }
+
+    // 固定の回答の本文を取得（/api/template は Cache-Control / ETag 付きのため、ブラウザのキャッシュが使われる）
+    async function fetchTemplate(url) {
+        if (!templateCache.has(url)) {
+            const response = await fetch(url);
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            templateCache.set(url, data.response);
+        }
+        return templateCache.get(url);
+    }
+
+    // SSEのレスポンスを読み、イベントごとに表示を更新
+    async function renderStream(response, message, processingMessage) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let botMessage = null;
+        let responseText = '';
+
+        // 最初のイベントで処理中メッセージを応答用の吹き出しに置き換える
+        const ensureBotMessage = () => {
+            if (!botMessage) {
+                processingMessage.remove();
+                botMessage = createStreamingMessage();
+            }
+            return botMessage;
+        };
+
+        const handleEvent = async (event, data) => {
+            if (event === 'citations') {
+                renderCitations(ensureBotMessage().citations, data.similar_docs || []);
+            } else if (event === 'delta') {
+                responseText += data.text;
+                ensureBotMessage().text.textContent = responseText;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'template') {
+                responseText = await fetchTemplate(data.url);
+                ensureBotMessage().text.textContent = responseText;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'done') {
+                ensureBotMessage();
+                updateHistory(message, responseText, data.timestamp);
+                if (data.confidence && data.confidence < 0.7) {
+                    showConfidenceWarning();
+                }
+            } else if (event === 'error') {
+                ensureBotMessage().text.textContent = '申し訳ございません。エラーが発生しました。';
+                console.error('Error:', data.error);
+            }
+        };
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // イベントは空行で区切られる
+            let separator;
+            while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separator);
+                buffer = buffer.slice(separator + 2);
+                const parsed = parseSseEvent(rawEvent);
+                if (parsed) {
+                    await handleEvent(parsed.event, parsed.data);
+                }
+            }
+        }
+
+        if (!botMessage) {
+            processingMessage.remove();
+            addMessage('申し訳ございません。エラーが発生しました。', 'bot');
+        }
+    }
+
+    // "event: ..." / "data: ..." の行からイベント名とJSONを取り出す
+    function parseSseEvent(rawEvent) {
+        let event = 'message';
+        const dataLines = [];
+        rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (!dataLines.length) return null;
+        try {
+            return { event: event, data: JSON.parse(dataLines.join('\n')) };
+        } catch (error) {
+            console.error('SSE parse error:', error);
+            return null;
+        }
+    }
+
+    // ストリーム表示用の吹き出し（出典と応答テキストの領域）
+    function createStreamingMessage() {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message bot-message';
+        
+        const contentDiv = document.createElement('div');
+        contentDiv.className = 'message-content';
+        
+        const citations = document.createElement('div');
+        citations.className = 'message-citations';
+        
+        const text = document.createElement('p');
+        text.className = 'japanese streaming-text';
+        
+        contentDiv.appendChild(citations);
+        contentDiv.appendChild(text);
+        messageDiv.appendChild(contentDiv);
+        chatMessages.appendChild(messageDiv);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+        
+        return { message: messageDiv, citations: citations, text: text };
+    }
+
+    // 出典（書籍名とページ）を表示
+    function renderCitations(container, docs) {
+        container.textContent = '';
+        if (!docs.length) return;
+        
+        const label = document.createElement('span');
+        label.textContent = '📚 出典: ';
+        container.appendChild(label);
+        
+        docs.forEach((doc, i) => {
+            const item = document.createElement('span');
+            item.className = 'citation';
+            item.textContent = doc.page !== '' ? `${doc.source} p.${doc.page}` : doc.source;
+            item.title = doc.content || '';
+            container.appendChild(item);
+            if (i < docs.length - 1) {
+                container.appendChild(document.createTextNode(' / '));
+            }
+        });
+    }
+
+    // /api/chat のJSONレスポンスを表示
+    async function renderJsonResponse(data, message) {
+        if (data.success) {
+            // omae_app_faiss は ChatBot の応答データ（辞書）、omae_app_simple は文字列を返す
+            const result = typeof data.response === 'object' ? data.response : { response: data.response };
+            // 固定の回答は本文が省かれているため template_url から取得する
+            if (result.response === undefined && data.template_url) {
+                result.response = await fetchTemplate(data.template_url);
+            }
+            
+            // ボットの応答を表示
+            addMessage(result.response, 'bot');
+            updateHistory(message, result.response, data.timestamp);
+            
+            // 信頼度が低い場合の警告表示
+            const confidence = result.confidence || data.confidence;
+            if (confidence && confidence < 0.7) {
+                showConfidenceWarning();
+            }
+        } else {
+            addMessage('申し訳ございません。エラーが発生しました。', 'bot');
+        }
+    }
+
+    // ローカル履歴を更新
+    function updateHistory(message, responseText, timestamp) {
+        localConversationHistory.push({
+            message: message,
+            response: responseText,
+            timestamp: timestamp
+        });
+        
+        // 履歴が長すぎる場合は古いものを削除
+        if (localConversationHistory.length > 10) {
+            localConversationHistory = localConversationHistory.slice(-10);
+        }
+    }
+
     // メッセージをチャットに追加
     function addMessage(text, sender) {
         const messageDiv = document.createElement('div');
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""テスト共通の設定（リポジトリ直下のモジュールをimportできるようにする）"""
+
+import os
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeEncoder:
+    """文字列から決まる正規化済みのベクトルを返すエンコーダー（SentenceTransformer の代わり）"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True):
+        vectors = np.stack([np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(self.dim)
+                            for text in texts]).astype('float32')
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def no_embedding_model(monkeypatch):
+    """FAISSVectorStore の初期化でモデルを読み込まない"""
+    from faiss_vector_store import FAISSVectorStore
+    monkeypatch.setattr(FAISSVectorStore, 'init_embedding_model', lambda self, backend=None: None)
+
+
+@pytest.fixture
+def artifacts(tmp_path):
+    """
+    2つのソースに分かれた小さな学習結果（フラットインデックス・メタデータ・テキスト）を書き出す
+
+    Returns:
+        (出力ディレクトリ, ベクトル)
+    """
+    from build_faiss_index import write_artifacts
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((400, 32)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"チャンク{i}の本文です。" for i in range(len(vectors))]
+    metadata = [{'source': 'a.pdf' if i < 250 else 'b.pdf', 'page': i // 10 + 1, 'len': len(text)}
+                for i, text in enumerate(texts)]
+    write_artifacts(vectors, texts, metadata, str(tmp_path))
+    return str(tmp_path), vectors
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""asyncio版Webアプリの上限付きスレッドプールと、混雑時の503・ヘルスチェック"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('quart')
+
+import omae_app_async
+import omae_app_faiss
+from omae_app_async import BoundedExecutor, ExecutorBusy
+from test_app_faiss import FakeVectorStore, _init_state
+
+
+class Blocker:
+    """release されるまで戻らない処理（スレッドプールを埋めるため）"""
+
+    def __init__(self):
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def __call__(self, value=None, *args):
+        self.started.release()
+        self.release.wait(timeout=10)
+        return value
+
+    async def wait_started(self, count=1):
+        for _ in range(count):
+            assert await asyncio.to_thread(self.started.acquire, timeout=5)
+
+
+def test_executor_rejects_beyond_workers_and_pending():
+    async def scenario():
+        executor = BoundedExecutor(max_workers=2, max_pending=1)
+        blocker = Blocker()
+        tasks = [asyncio.ensure_future(executor.run(blocker, i)) for i in range(3)]
+        # 2件が実行中、1件が待機中
+        await blocker.wait_started(2)
+        await asyncio.sleep(0)
+
+        with pytest.raises(ExecutorBusy):
+            await executor.run(blocker, 'rejected')
+
+        blocker.release.set()
+        assert await asyncio.gather(*tasks) == [0, 1, 2]
+        # 空きができれば再び受け付ける
+        assert await executor.run(lambda: 'ok') == 'ok'
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_executor_propagates_exceptions_and_frees_slot():
+    def fail():
+        raise RuntimeError('search failed')
+
+    async def scenario():
+        executor = BoundedExecutor(max_workers=1, max_pending=0)
+        with pytest.raises(RuntimeError, match='search failed'):
+            await executor.run(fail)
+        assert await executor.run(lambda x: x * 2, 21) == 42
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def ready_app(monkeypatch):
+    """初期化済みにして、1スレッド・待機なしのスレッドプールにしたアプリ"""
+    from chat_bot import ChatBot
+    from session_state import SessionStateStore
+
+    bot = ChatBot()
+    monkeypatch.setattr(omae_app_faiss, 'vector_store', FakeVectorStore())
+    monkeypatch.setattr(omae_app_faiss, 'chatbot', bot)
+    monkeypatch.setattr(omae_app_faiss, 'template_payloads', omae_app_faiss._build_template_payloads(bot))
+    monkeypatch.setattr(omae_app_faiss, 'session_states', SessionStateStore())
+    monkeypatch.setattr(omae_app_faiss, '_init_state', _init_state('ready'))
+    executor = BoundedExecutor(max_workers=1, max_pending=0)
+    monkeypatch.setattr(omae_app_async, 'executor', executor)
+    yield omae_app_async.app
+    executor.shutdown()
+
+
+def test_chat_after_ready(ready_app):
+    async def scenario():
+        client = ready_app.test_client()
+        response = await client.post('/api/chat', json={'message': '戦略的思考とは？'})
+        assert response.status_code == 200
+        body = await response.get_json()
+        assert body['success'] is True and body['response']['response']
+
+    asyncio.run(scenario())
+    assert omae_app_faiss.vector_store.queries == ['戦略的思考とは？']
+
+
+@pytest.mark.parametrize('path', ['/api/chat', '/api/chat/stream'])
+def test_busy_pool_returns_503_and_health_still_answers(ready_app, monkeypatch, path):
+    blocker = Blocker()
+    monkeypatch.setattr(omae_app_faiss, '_answer', lambda message, *args: blocker(([], {'response': message})))
+
+    async def scenario():
+        client = ready_app.test_client()
+        first = asyncio.ensure_future(client.post('/api/chat', json={'message': '最初の質問'}))
+        await blocker.wait_started()
+
+        # 実行中1件 + 待機0件の上限に達しているため、待たせずに503を返す
+        response = await asyncio.wait_for(client.post(path, json={'message': '次の質問'}), timeout=5)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        body = await response.get_json()
+        assert (body['success'], body['status']) == (False, 'busy')
+
+        stats = await asyncio.wait_for(client.get('/api/stats'), timeout=5)
+        assert stats.status_code == 503
+
+        # ヘルスチェックとレディネスチェックはスレッドプールを使わないため応答する
+        health = await asyncio.wait_for(client.get('/api/health'), timeout=5)
+        assert health.status_code == 200
+        assert (await health.get_json())['ready'] is True
+        assert (await asyncio.wait_for(client.get('/api/ready'), timeout=5)).status_code == 200
+
+        blocker.release.set()
+        response = await asyncio.wait_for(first, timeout=5)
+        assert response.status_code == 200
+        assert (await response.get_json())['response']['response'] == '最初の質問'
+
+    asyncio.run(scenario())
+
+
+def test_health_answers_while_loading(monkeypatch):
+    monkeypatch.setattr(omae_app_faiss, '_init_state', _init_state('loading'))
+
+    async def scenario():
+        client = omae_app_async.app.test_client()
+        health = await client.get('/api/health')
+        assert health.status_code == 200
+        assert (await health.get_json())['ready'] is False
+
+        response = await client.post('/api/chat', json={'message': '戦略的思考とは？'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+
+    asyncio.run(scenario())
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Webアプリ（FAISS版）のリクエストの解釈と応答"""
+
+import pytest
+
+import omae_app_faiss
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('', None),
+    ([10, 50], (10, 50)),
+    ('10-50', (10, 50)),
+    ('12', (12, 12)),
+    (12, (12, 12)),
+])
+def test_parse_page_range(value, expected):
+    assert omae_app_faiss._parse_page_range(value) == expected
+
+
+@pytest.mark.parametrize('value', [True, False, [True, 5], [1, False], '50-10', 1.5, {'start': 1}])
+def test_parse_page_range_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        omae_app_faiss._parse_page_range(value)
+
+
+class FakeVectorStore:
+    """検索したクエリを記録し、固定のドキュメントを返すベクトルストア"""
+
+    def __init__(self):
+        self.queries = []
+
+    def search_similar(self, query, n_results=5, source=None, page_range=None):
+        self.queries.append(getattr(query, 'text', query))
+        return [{'content': '日本の企業は経営戦略を見直す必要がある。', 'source': 'a.pdf', 'page': 1,
+                 'citations': [], 'distance': 0.9, 'index': 0}]
+
+    def get_statistics(self):
+        return {'total_vectors': 1}
+
+
+def _init_state(status, error=None):
+    return {'status': status, 'phase': 'vector_store' if status == 'loading' else None, 'timings': {},
+            'error': error, 'started_at': None, 'ready_at': None}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """初期化を開始しない（読み込み中のままの）アプリのテストクライアント"""
+    monkeypatch.setattr(omae_app_faiss, 'start_background_initialization', lambda: None)
+    monkeypatch.setattr(omae_app_faiss, '_init_state', _init_state('loading'))
+    return omae_app_faiss.app.test_client()
+
+
+@pytest.fixture
+def ready_client(client, monkeypatch):
+    """検索を FakeVectorStore に置き換えて初期化済みにしたアプリのテストクライアント"""
+    from chat_bot import ChatBot
+    from session_state import SessionStateStore
+
+    bot = ChatBot()
+    monkeypatch.setattr(omae_app_faiss, 'vector_store', FakeVectorStore())
+    monkeypatch.setattr(omae_app_faiss, 'chatbot', bot)
+    monkeypatch.setattr(omae_app_faiss, 'template_payloads', omae_app_faiss._build_template_payloads(bot))
+    monkeypatch.setattr(omae_app_faiss, 'session_states', SessionStateStore())
+    monkeypatch.setattr(omae_app_faiss, '_init_state', _init_state('ready'))
+    return client
+
+
+@pytest.mark.parametrize('path', ['/api/chat', '/api/chat/stream'])
+def test_chat_returns_503_before_ready(client, path):
+    response = client.post(path, json={'message': '戦略的思考とは？'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    body = response.get_json()
+    assert body['success'] is False
+    assert (body['status'], body['phase']) == ('loading', 'vector_store')
+
+
+def test_health_is_200_while_loading(client):
+    response = client.get('/api/health')
+
+    assert response.status_code == 200
+    assert response.get_json()['live'] is True
+    assert response.get_json()['ready'] is False
+    assert client.get('/api/ready').status_code == 503
+
+
+def test_chat_returns_503_with_error_after_failed_initialization(client, monkeypatch):
+    monkeypatch.setattr(omae_app_faiss, '_init_state', _init_state('failed', error='index not found'))
+
+    response = client.post('/api/chat', json={'message': '戦略的思考とは？'})
+
+    assert response.status_code == 503
+    assert 'index not found' in response.get_json()['error']
+    assert client.get('/api/health').status_code == 500
+
+
+def test_chat_after_ready(ready_client):
+    response = ready_client.post('/api/chat', json={'message': '戦略的思考とは？'})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is True
+    assert body['response']['response']
+    assert omae_app_faiss.vector_store.queries == ['戦略的思考とは？']
+
+
+def _sse_events(response):
+    import json
+    events = []
+    for raw in response.get_data(as_text=True).strip().split('\n\n'):
+        event, data = raw.split('\n', 1)
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_template_answer_is_reachable_from_chat(ready_client):
+    body = ready_client.post('/api/chat', json={'message': '失敗を乗り越えるには？'}).get_json()
+
+    assert body['response']['topic'] == 'failure_overcoming'
+    assert body['template_url'] == '/api/template/failure_overcoming?lang=ja'
+    # 検索を行わない
+    assert omae_app_faiss.vector_store.queries == []
+
+    template = ready_client.get(body['template_url'])
+    assert template.status_code == 200
+    assert template.headers['Cache-Control'] == omae_app_faiss.TEMPLATE_CACHE_CONTROL
+    assert template.get_json()['response'] == body['response']['response']
+    assert ready_client.get(body['template_url'], headers={'If-None-Match': template.headers['ETag']}).status_code == 304
+
+
+def test_template_ref_omits_text(ready_client):
+    body = ready_client.post('/api/chat', json={'message': '失敗を乗り越えるには？', 'template_ref': True}).get_json()
+
+    assert 'response' not in body['response']
+    assert body['template_url'] == '/api/template/failure_overcoming?lang=ja'
+
+    events = _sse_events(ready_client.post('/api/chat/stream',
+                                           json={'message': '失敗を乗り越えるには？', 'template_ref': True}))
+    assert [event for event, _ in events] == ['citations', 'template', 'done']
+    assert events[1][1]['url'] == body['template_url']
+    assert events[2][1]['template_url'] == body['template_url']
+
+
+def test_non_template_answer_has_no_template_url(ready_client):
+    body = ready_client.post('/api/chat', json={'message': '戦略的思考とは？', 'template_ref': True}).get_json()
+
+    assert body['response']['response']
+    assert 'template_url' not in body
+
+    events = _sse_events(ready_client.post('/api/chat/stream', json={'message': '戦略的思考とは？'}))
+    assert 'delta' in [event for event, _ in events]
+    assert events[-1][1]['template_url'] is None
+
+
+def _post_with_seed(client, path, payload, seed=0):
+    """応答の前置きの選択（random.choice）を揃えて送る"""
+    import random
+    random.seed(seed)
+    return client.post(path, json=payload)
+
+
+def test_stream_events_match_chat_response(ready_client):
+    payload = {'message': '戦略的思考とは？'}
+    body = _post_with_seed(ready_client, '/api/chat', payload).get_json()
+    # 会話履歴で応答が変わらないよう、別のセッション（別のクライアント）から送る
+    response = _post_with_seed(omae_app_faiss.app.test_client(), '/api/chat/stream', payload)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    events = _sse_events(response)
+    names = [event for event, _ in events]
+    assert names[0] == 'citations' and names[-1] == 'done'
+    assert set(names[1:-1]) == {'delta'} and len(names) > 3
+
+    assert events[0][1]['similar_docs'] == [omae_app_faiss._citation(doc) for doc in body['similar_docs']]
+    deltas = [data['text'] for event, data in events if event == 'delta']
+    assert ''.join(deltas) == body['response']['response']
+    assert all(len(text) <= omae_app_faiss.STREAM_CHUNK_CHARS for text in deltas)
+
+    done = events[-1][1]
+    assert done['sources'] == body['response'].get('sources', [])
+    assert done['confidence'] == body['response'].get('confidence')
+    assert done['topic'] == body['response']['topic']
+
+
+def test_stream_template_answer_sends_full_text_without_template_ref(ready_client):
+    payload = {'message': '失敗を乗り越えるには？'}
+    body = _post_with_seed(ready_client, '/api/chat', payload).get_json()
+    events = _sse_events(_post_with_seed(omae_app_faiss.app.test_client(), '/api/chat/stream', payload))
+
+    assert 'template' not in [event for event, _ in events]
+    assert ''.join(data['text'] for event, data in events if event == 'delta') == body['response']['response']
+    assert events[-1][1]['template_url'] == body['template_url']
+
+
+def test_stream_error_event(ready_client, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('search failed')
+    monkeypatch.setattr(omae_app_faiss, '_answer', fail)
+
+    response = ready_client.post('/api/chat/stream', json={'message': '戦略的思考とは？'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = _sse_events(response)
+    assert [event for event, _ in events] == ['error']
+    assert 'search failed' in events[0][1]['error']
+
+
+@pytest.mark.parametrize('payload, error', [
+    ({'message': '  '}, 'メッセージが空です'),
+    ({'message': '戦略', 'page_range': '50-10'}, None),
+])
+def test_stream_rejects_invalid_requests_as_json(ready_client, payload, error):
+    response = ready_client.post('/api/chat/stream', json=payload)
+
+    assert response.mimetype == 'application/json'
+    body = response.get_json()
+    assert body['success'] is False
+    assert error is None or body['error'] == error
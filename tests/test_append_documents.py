@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""add_documents の追記・検索と、再起動後の追記ログからの復元（書き込み失敗時を含む）"""
+
+import builtins
+import errno
+import os
+
+import numpy as np
+import pytest
+
+import faiss_vector_store
+from conftest import FakeEncoder
+from faiss_vector_store import FAISSVectorStore
+
+
+@pytest.fixture
+def open_store(artifacts, no_embedding_model):
+    directory, vectors = artifacts
+
+    def open_store(**kwargs):
+        store = FAISSVectorStore(index_path=os.path.join(directory, 'faiss_index_ip.faiss'),
+                                 meta_path=os.path.join(directory, 'faiss_meta.json'),
+                                 texts_path=os.path.join(directory, 'faiss_texts.jsonl'), **kwargs)
+        store.embedding_model = FakeEncoder(vectors.shape[1])
+        return store
+    return open_store
+
+
+def _chunk(name, source='c.pdf', page=1):
+    return {'text': f"{name}についての追加の本文です。", 'source': source, 'page': page}
+
+
+def _passage_vectors(store, chunks):
+    return store.embedding_model.encode([f"passage: {chunk['text']}" for chunk in chunks])
+
+
+def _assert_delta_matches(store, chunks):
+    """追加分のドキュメントとベクトルが同じ順序で対応している"""
+    delta_index, docs = store._appended
+    assert [doc['text'] for doc in docs] == [chunk['text'] for chunk in chunks]
+    np.testing.assert_allclose(delta_index.reconstruct_n(0, delta_index.ntotal),
+                               _passage_vectors(store, chunks), atol=1e-6)
+
+
+class FailingLogFile:
+    """書き込みの途中で容量不足になる追記ログのファイル"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        self.f.write(data[:len(data) // 2])
+        self.f.flush()
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.f.close()
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+@pytest.fixture
+def failing_log_write(monkeypatch):
+    """次の1回だけ追記ログの書き込みを失敗させる"""
+    def install(store):
+        remaining = [1]
+
+        def fake_open(path, mode='r', *args, **kwargs):
+            f = builtins.open(path, mode, *args, **kwargs)
+            if path == store.append_log_path and 'a' in mode and remaining[0]:
+                remaining[0] -= 1
+                return FailingLogFile(f)
+            return f
+        monkeypatch.setattr(faiss_vector_store, 'open', fake_open, raising=False)
+    return install
+
+
+def test_appended_documents_are_searchable(open_store):
+    store = open_store()
+    chunks = [_chunk('半導体'), _chunk('人口減少', page=2)]
+    assert store.add_documents(chunks) == 2
+    assert store._document_count() == 402
+
+    # 追加分のベクトルと同じクエリベクトルで検索すると追加分が最上位になる
+    query = _passage_vectors(store, chunks[1:])
+    distances, indices = store._search_index(query, 5)
+    assert indices[0, 0] == 401
+    assert distances[0, 0] == pytest.approx(1.0, abs=1e-5)
+
+    results = store.search_similar('半導体', n_results=5, source='c.pdf')
+    assert sorted(doc['index'] for doc in results) == [400, 401]
+    assert all(doc['source'] == 'c.pdf' for doc in results)
+
+
+def test_appended_documents_are_restored_after_restart(open_store):
+    store = open_store()
+    chunks = [_chunk('半導体'), _chunk('人口減少')]
+    store.add_documents(chunks[:1])
+    store.add_documents(chunks[1:])
+
+    restarted = open_store()
+    _assert_delta_matches(restarted, chunks)
+    assert restarted.get_document_by_index(401)['content'] == chunks[1]['text']
+
+
+def test_failed_log_write_does_not_shift_later_appends(open_store, failing_log_write):
+    store = open_store()
+    store.add_documents([_chunk('半導体')])
+
+    failing_log_write(store)
+    with pytest.raises(OSError):
+        store.add_documents([_chunk('失敗する追加')])
+    assert len(store._appended[1]) == 1
+
+    # 失敗した追加のベクトルと途中まで書いたログ行は次の追加の前に取り除かれる
+    chunks = [_chunk('半導体'), _chunk('人口減少')]
+    store.add_documents(chunks[1:])
+    _assert_delta_matches(store, chunks)
+    _assert_delta_matches(open_store(), chunks)
+
+
+def test_failed_log_write_is_removed_on_restart(open_store, failing_log_write):
+    store = open_store()
+    store.add_documents([_chunk('半導体')])
+    failing_log_write(store)
+    with pytest.raises(OSError):
+        store.add_documents([_chunk('失敗する追加')])
+
+    # 失敗したまま再起動した場合も、ログ行のないベクトルは読み込み時に取り除かれる
+    restarted = open_store()
+    _assert_delta_matches(restarted, [_chunk('半導体')])
+    assert os.path.getsize(restarted.append_vectors_path) == 1 * 32 * 4
+
+    chunks = [_chunk('半導体'), _chunk('人口減少')]
+    restarted.add_documents(chunks[1:])
+    _assert_delta_matches(open_store(), chunks)
+
+
+def test_torn_last_log_line_is_ignored(open_store):
+    store = open_store()
+    chunks = [_chunk('半導体'), _chunk('人口減少')]
+    store.add_documents(chunks)
+    with open(store.append_log_path, 'a', encoding='utf-8') as f:
+        f.write('{"text": "途中で切れた')
+
+    restarted = open_store()
+    _assert_delta_matches(restarted, chunks)
+    with open(restarted.append_log_path, 'r', encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 2
+
+
+def test_vectors_without_log_are_removed(open_store):
+    store = open_store()
+    # 最初の追加でログを書く前に失敗した場合（ベクトルのみが残っている）
+    _passage_vectors(store, [_chunk('失敗する追加')]).tofile(store.append_vectors_path)
+
+    restarted = open_store()
+    assert restarted._appended[1] == []
+    assert os.path.getsize(restarted.append_vectors_path) == 0
+
+    restarted.add_documents([_chunk('人口減少')])
+    _assert_delta_matches(open_store(), [_chunk('人口減少')])
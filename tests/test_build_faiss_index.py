@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""再構築時の派生インデックスの作り直し"""
+
+import os
+
+import faiss
+import numpy as np
+
+from ann_index import ann_index_path, build_ann_index
+from build_faiss_index import rebuild_derived_artifacts, write_artifacts
+from dim_reduction import (Projection, build_reduced_index, make_projection, projection_path,
+                           reduced_index_path)
+
+
+def test_rebuild_derived_artifacts_after_chunk_count_change(artifacts):
+    directory, vectors = artifacts
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+    for index_type in ('ivf', 'hnsw', 'sq8'):
+        faiss.write_index(build_ann_index(vectors, index_type), ann_index_path(flat_path, index_type))
+    reduced_path = reduced_index_path(flat_path, 'pca', 8)
+    projection = make_projection(vectors, 'pca', 8)
+    faiss.write_index(build_reduced_index(vectors, projection), reduced_path)
+    projection.save(projection_path(reduced_path))
+    # 対になるインデックスのない射影
+    orphan = projection_path(reduced_index_path(flat_path, 'truncate', 16))
+    make_projection(vectors, 'truncate', 16).save(orphan)
+
+    # 品質フィルタ・重複の統合でチャンク数が減った再構築
+    kept = vectors[:300]
+    write_artifacts(kept, [f"t{i}" for i in range(300)], [{'source': 'a.pdf', 'page': 1}] * 300, directory)
+    result = rebuild_derived_artifacts(kept, directory)
+
+    assert sorted(result['rebuilt']) == ['faiss_index_hnsw.faiss', 'faiss_index_ivf.faiss',
+                                         'faiss_index_pca8.faiss', 'faiss_index_sq8.faiss']
+    assert result['removed'] == [os.path.basename(orphan)]
+    assert not os.path.exists(orphan)
+    for index_type in ('ivf', 'hnsw', 'sq8'):
+        assert faiss.read_index(ann_index_path(flat_path, index_type)).ntotal == 300
+    assert faiss.read_index(reduced_path).ntotal == 300
+    np.testing.assert_allclose(Projection.load(projection_path(reduced_path)).mean,
+                               make_projection(kept, 'pca', 8).mean, rtol=1e-4, atol=1e-6)
+
+
+def test_unbuildable_derived_index_is_removed(artifacts):
+    directory, vectors = artifacts
+    path = ann_index_path(os.path.join(directory, 'faiss_index_ip.faiss'), 'pq')
+    faiss.write_index(build_ann_index(vectors, 'pq'), path)
+
+    # PQ（8ビット）は256件未満のベクトルでは学習できない
+    result = rebuild_derived_artifacts(vectors[:100], directory)
+
+    assert result == {'rebuilt': [], 'removed': ['faiss_index_pq.faiss']}
+    assert not os.path.exists(path)
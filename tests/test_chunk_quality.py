@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""低品質なチャンクの削除・統合と、既存の成果物の圧縮"""
+
+import os
+
+import faiss
+import numpy as np
+
+from ann_index import ann_index_path, build_ann_index
+from build_faiss_index import write_artifacts
+from chunk_quality import compact_artifacts, prune_chunks
+from corpus_store import CorpusStore, write_corpus
+from faiss_vector_store import FAISSVectorStore
+
+BODY = '日本の企業は経営戦略を見直す必要がある。グローバル化の時代において、リーダーの役割はますます重要になっている。'
+NOISE = '| { @ # 』 」'
+
+
+def _chunks(count):
+    """3件ごとに本文・OCRノイズ・同じページの短い補足が並ぶチャンク"""
+    texts, metadata = [], []
+    for i in range(count):
+        text = [f"{BODY}（{i}）", NOISE, f"短い補足{i}です。"][i % 3]
+        texts.append(text)
+        metadata.append({'source': 'a.pdf', 'page': i // 3 + 1, 'len': len(text)})
+    return texts, metadata
+
+
+def test_prune_chunks_id_map():
+    texts, metadata = _chunks(6)
+    kept_texts, kept_metadata, id_map, report = prune_chunks(texts, metadata)
+
+    # ノイズは削除、短い補足は同じページの本文へ統合
+    assert id_map.tolist() == [0, -1, 0, 1, -1, 1]
+    assert kept_texts[0] == f"{BODY}（0）\n短い補足2です。"
+    assert kept_metadata[1]['len'] == len(kept_texts[1])
+    assert (report['before'], report['after'], report['dropped'], report['merged']) == (6, 2, 2, 2)
+
+
+def test_compact_artifacts_rewrites_corpus_and_derived_indexes(tmp_path, no_embedding_model):
+    texts, metadata = _chunks(600)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(texts), 16)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    directory = str(tmp_path)
+    write_artifacts(vectors, texts, metadata, directory)
+    write_corpus(texts, metadata, os.path.join(directory, 'corpus'))
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+    faiss.write_index(build_ann_index(vectors, 'hnsw'), ann_index_path(flat_path, 'hnsw'))
+
+    # --corpus を指定しなくても既存の corpus/ は書き直す
+    report = compact_artifacts(flat_path, os.path.join(directory, 'faiss_meta.json'),
+                               os.path.join(directory, 'faiss_texts.jsonl'), directory)
+
+    assert report['after'] == 200
+    assert report['derived'] == {'rebuilt': ['faiss_index_hnsw.faiss'], 'removed': []}
+    assert len(CorpusStore(os.path.join(directory, 'corpus'))) == 200
+    assert faiss.read_index(ann_index_path(flat_path, 'hnsw')).ntotal == 200
+    id_map = np.load(os.path.join(directory, 'faiss_id_remap.npy'))
+    # 統合先のベクトルはそのまま使う
+    np.testing.assert_array_equal(faiss.read_index(flat_path).reconstruct(1), vectors[3])
+    assert id_map[3] == id_map[5] == 1
+
+    store = FAISSVectorStore(index_path=flat_path, meta_path=os.path.join(directory, 'faiss_meta.json'),
+                             texts_path=os.path.join(directory, 'faiss_texts.jsonl'),
+                             corpus_dir=os.path.join(directory, 'corpus'), index_type='hnsw')
+    assert store.corpus.text(1) == f"{BODY}（3）\n短い補足5です。"
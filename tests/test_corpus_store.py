@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""コンパクトコーパスの書き出しと読み込み"""
+
+from corpus_store import CorpusStore, write_corpus
+
+
+def test_round_trip(tmp_path):
+    texts = ['大前研一の著作', '', 'English text', '絵文字🙂を含むチャンク']
+    metadata = [
+        {'source': 'a.pdf', 'page': 1, 'len': 7},
+        {'source': 'b.pdf', 'page': 2, 'len': 0},
+        {'source': 'a.pdf', 'page': 3, 'len': 12,
+         'citations': [{'source': 'b.pdf', 'page': 9}]},
+        {'source': 'c.pdf', 'page': 4, 'len': 11}
+    ]
+    write_corpus(texts, metadata, str(tmp_path))
+    store = CorpusStore(str(tmp_path))
+
+    assert len(store) == len(texts)
+    assert [store.text(i) for i in range(len(store))] == texts
+    assert [store.meta(i) for i in range(len(store))] == metadata
+
+
+def test_rewrite_removes_stale_citations(tmp_path):
+    write_corpus(['a'], [{'source': 'a.pdf', 'page': 1, 'len': 1, 'citations': [{'source': 'b.pdf'}]}],
+                 str(tmp_path))
+    write_corpus(['a', 'b'], [{'source': 'a.pdf', 'page': 1, 'len': 1}, {'source': 'a.pdf', 'page': 2, 'len': 1}],
+                 str(tmp_path))
+    store = CorpusStore(str(tmp_path))
+
+    assert len(store) == 2
+    assert 'citations' not in store.meta(0)
+
+
+def test_empty_corpus(tmp_path):
+    write_corpus([], [], str(tmp_path))
+    assert len(CorpusStore(str(tmp_path))) == 0
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""重複チャンクの統合と、品質フィルタとのIDの対応の合成"""
+
+import numpy as np
+
+from chunk_quality import prune_chunks
+from dedup import compose_id_maps, dedup_chunks
+
+BODY = '日本の企業は経営戦略を見直す必要がある。グローバル化の時代において、リーダーの役割はますます重要になっている。'
+OTHER = '教育制度の改革には、答えのない問題を考える力を育てることが欠かせない。二十一世紀の人材に必要な能力である。'
+
+
+def test_dedup_keeps_longest_and_records_citations():
+    texts = [BODY, OTHER, BODY + '。', BODY]
+    metadata = [{'source': 'a.pdf', 'page': 1}, {'source': 'a.pdf', 'page': 2},
+                {'source': 'b.pdf', 'page': 5}, {'source': 'c.pdf', 'page': 9}]
+    kept_texts, kept_metadata, id_map, report = dedup_chunks(texts, metadata)
+
+    assert kept_texts == [OTHER, BODY + '。']
+    assert id_map.tolist() == [1, 0, 1, 1]
+    assert kept_metadata[1]['citations'] == [{'source': 'a.pdf', 'page': 1}, {'source': 'c.pdf', 'page': 9}]
+    assert (report['removed'], report['groups']) == (2, 1)
+
+
+def test_compose_id_maps():
+    first = np.array([0, -1, 1, 2, -1, 3])
+    second = np.array([0, 0, -1, 1])
+    assert compose_id_maps(first, second).tolist() == [0, -1, 0, -1, -1, 1]
+
+
+def test_prune_then_dedup_maps_every_old_id_to_its_chunk():
+    noise = '| { @ # 』 」'
+    texts = [BODY, noise, OTHER, BODY, noise, OTHER + '追記', BODY]
+    metadata = [{'source': 'a.pdf', 'page': i + 1, 'len': len(text)} for i, text in enumerate(texts)]
+
+    pruned_texts, pruned_metadata, prune_map, _ = prune_chunks(texts, metadata)
+    kept_texts, _, dedup_map, _ = dedup_chunks(pruned_texts, pruned_metadata)
+    id_map = compose_id_maps(prune_map, dedup_map)
+
+    assert len(id_map) == len(texts)
+    assert id_map[1] == id_map[4] == -1
+    # 残ったIDは、同じ本文（または統合先の重複）のチャンクを指す
+    for old_id, new_id in enumerate(id_map):
+        if new_id >= 0:
+            assert texts[old_id] in kept_texts[new_id]
+    assert id_map[0] == id_map[3] == id_map[6]
+    assert id_map[2] == id_map[5]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""次元削減の射影と、次元削減インデックスでの検索・追加分の射影"""
+
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from conftest import FakeEncoder
+from dim_reduction import (Projection, build_reduced_index, fit_pca, make_projection, projection_path,
+                           reduced_index_path, truncation)
+from faiss_vector_store import FAISSVectorStore
+
+QUERIES = ['経営戦略', '日本の教育', 'グローバル化']
+
+
+def test_truncation_keeps_leading_dimensions():
+    vectors = np.random.default_rng(0).standard_normal((5, 8)).astype('float32')
+    projected = truncation(8, 3).apply(vectors)
+
+    expected = vectors[:, :3] / np.linalg.norm(vectors[:, :3], axis=1, keepdims=True)
+    np.testing.assert_allclose(projected, expected, rtol=1e-5)
+    with pytest.raises(ValueError):
+        truncation(8, 9)
+
+
+def test_pca_components_are_orthonormal_and_ordered(artifacts):
+    _, vectors = artifacts
+    projection = fit_pca(vectors, 8)
+
+    assert (projection.input_dim, projection.output_dim) == (32, 8)
+    np.testing.assert_allclose(projection.matrix @ projection.matrix.T, np.eye(8), atol=1e-5)
+    variances = ((vectors - projection.mean) @ projection.matrix.T).var(axis=0)
+    assert np.all(np.diff(variances) <= 1e-6)
+    np.testing.assert_allclose(np.linalg.norm(projection.apply(vectors), axis=1), 1.0, rtol=1e-5)
+    with pytest.raises(ValueError):
+        fit_pca(vectors, 33)
+
+
+def test_projection_save_and_load(tmp_path, artifacts):
+    _, vectors = artifacts
+    projection = make_projection(vectors, 'pca', 8)
+    path = str(tmp_path / 'faiss_index_pca8.proj.npz')
+    projection.save(path)
+    loaded = Projection.load(path)
+
+    assert loaded.kind == 'pca'
+    np.testing.assert_array_equal(loaded.apply(vectors), projection.apply(vectors))
+    assert not os.path.exists(path + '.tmp.npz')
+
+
+@pytest.fixture
+def open_reduced_store(artifacts, no_embedding_model):
+    """次元削減インデックスと射影を書き出し、reduction を指定したストアを開く"""
+    directory, vectors = artifacts
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+
+    def open_store(kind='pca', dim=16, **kwargs):
+        path = reduced_index_path(flat_path, kind, dim)
+        if not os.path.exists(path):
+            projection = make_projection(vectors, kind, dim)
+            faiss.write_index(build_reduced_index(vectors, projection), path)
+            projection.save(projection_path(path))
+        store = FAISSVectorStore(index_path=flat_path,
+                                 meta_path=os.path.join(directory, 'faiss_meta.json'),
+                                 texts_path=os.path.join(directory, 'faiss_texts.jsonl'),
+                                 reduction=kind, reduced_dim=dim, **kwargs)
+        store.embedding_model = FakeEncoder(vectors.shape[1])
+        return store
+    return open_store
+
+
+def _expected_top(store, vectors, query, k, allowed=None):
+    """射影したベクトルの全件の内積から求めた上位k件"""
+    query_vector = store.embedding_model.encode([f"query: {query}"])
+    scores = store.projection.apply(vectors) @ store.projection.apply(query_vector)[0]
+    if allowed is not None:
+        scores = np.where(allowed, scores, -np.inf)
+    top = np.argsort(-scores, kind='stable')[:k]
+    return top.tolist(), scores[top]
+
+
+@pytest.mark.parametrize('kind', ['pca', 'truncate'])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_projected_queries_search_reduced_index(open_reduced_store, artifacts, kind, use_mmap):
+    _, vectors = artifacts
+    store = open_reduced_store(kind, use_mmap=use_mmap)
+
+    assert store.index.d == 16 and store.projection.input_dim == 32
+    for query in QUERIES:
+        results = store.search_similar(query, n_results=5)
+        expected_ids, expected_scores = _expected_top(store, vectors, query, 5)
+
+        assert [doc['index'] for doc in results] == expected_ids
+        np.testing.assert_allclose([doc['distance'] for doc in results], expected_scores, atol=1e-5)
+
+
+def test_projected_queries_with_filters(open_reduced_store, artifacts):
+    _, vectors = artifacts
+    store = open_reduced_store()
+    pages = np.arange(len(vectors)) // 10 + 1
+    allowed = (np.arange(len(vectors)) >= 250) & (pages >= 30) & (pages <= 32)
+
+    for query in QUERIES:
+        results = store.search_similar(query, n_results=5, source='b.pdf', page_range=(30, 32))
+        assert [doc['index'] for doc in results] == _expected_top(store, vectors, query, 5, allowed)[0]
+
+
+def test_appended_vectors_are_projected(open_reduced_store):
+    store = open_reduced_store()
+    chunks = [{'text': f"追加の本文{i}。", 'source': 'c.pdf', 'page': i} for i in range(1, 4)]
+    store.add_documents(chunks)
+    raw = store.embedding_model.encode([f"passage: {chunk['text']}" for chunk in chunks])
+
+    # 追加分のインデックスは射影後の次元、追記ログには射影前の埋め込みを保存する
+    delta_index = store._appended[0]
+    assert delta_index.d == 16
+    np.testing.assert_allclose(delta_index.reconstruct_n(0, 3), store.projection.apply(raw), atol=1e-6)
+    assert os.path.getsize(store.append_vectors_path) == 3 * 32 * 4
+
+    # 追加分の埋め込みと同じ向きのクエリでは、その追加分が最上位になる
+    distances, indices = store._search_index(raw[1:2], 5)
+    assert indices[0, 0] == 401
+    assert distances[0, 0] == pytest.approx(1.0, abs=1e-5)
+
+    # 再起動後も追記ログの埋め込みを射影して復元する
+    restarted = open_reduced_store()
+    np.testing.assert_allclose(restarted._appended[0].reconstruct_n(0, 3), store.projection.apply(raw), atol=1e-6)
+    query = restarted.projection.apply(restarted.embedding_model.encode(['query: 追加']))[0]
+    expected = np.argsort(-(store.projection.apply(raw) @ query), kind='stable') + 400
+    results = restarted.search_similar('追加', n_results=5, source='c.pdf')
+    assert [doc['index'] for doc in results] == expected.tolist()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""書籍・ページ範囲で絞り込んだ検索（全インデックス種別）"""
+
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from ann_index import INDEX_TYPES, ann_index_path, build_ann_index
+from conftest import FakeEncoder
+from faiss_vector_store import FAISSVectorStore
+
+
+@pytest.fixture
+def open_store(artifacts, no_embedding_model):
+    directory, vectors = artifacts
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+
+    def open_store(index_type, **kwargs):
+        if index_type != 'flat':
+            faiss.write_index(build_ann_index(vectors, index_type), ann_index_path(flat_path, index_type))
+        store = FAISSVectorStore(index_path=flat_path,
+                                 meta_path=os.path.join(directory, 'faiss_meta.json'),
+                                 texts_path=os.path.join(directory, 'faiss_texts.jsonl'),
+                                 index_type=index_type, **kwargs)
+        store.embedding_model = FakeEncoder(vectors.shape[1])
+        return store
+    return open_store
+
+
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+@pytest.mark.parametrize('source, page_range, expected', [
+    ('b.pdf', None, 5),
+    ('b.pdf', (30, 32), 5),
+    (None, (3, 3), 5),
+    ('a.pdf', (7, 7), 5),
+    ('b.pdf', (40, 40), 5),
+    ('a.pdf', (25, 25), 5),
+])
+def test_filtered_results_are_in_range(open_store, index_type, source, page_range, expected):
+    store = open_store(index_type, nprobe=1, ef_search=8)
+    for query in ('経営戦略', '日本の教育', 'グローバル化'):
+        results = store.search_similar(query, n_results=5, source=source, page_range=page_range)
+
+        assert len(results) == expected
+        for doc in results:
+            assert source is None or doc['source'] == source
+            assert page_range is None or page_range[0] <= doc['page'] <= page_range[1]
+
+
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+def test_filter_smaller_than_k_returns_all_matches(open_store, index_type):
+    store = open_store(index_type, nprobe=1, ef_search=8)
+    results = store.search_similar('経営戦略', n_results=20, source='a.pdf', page_range=(7, 7))
+
+    assert sorted(doc['index'] for doc in results) == list(range(60, 70))
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'sq8', 'pq'])
+def test_filtered_matches_exhaustive_search(open_store, artifacts, index_type):
+    _, vectors = artifacts
+    store = open_store(index_type)
+    query = FakeEncoder(vectors.shape[1]).encode(['query: 経営戦略'])[0]
+    expected = np.argsort(-(vectors[250:] @ query))[:5] + 250
+
+    results = store.search_similar('経営戦略', n_results=5, source='b.pdf')
+
+    # 圧縮インデックスも候補をfloatベクトルで再ランキングするため、上位はほぼ一致する
+    assert len(set(doc['index'] for doc in results) & set(expected.tolist())) >= 4
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Aho-Corasick の意図判定と、置き換え前のキーワードの if/elif の結果の一致"""
+
+import random
+
+import pytest
+
+from benchmark_intent import legacy_analyze_question_intent, legacy_context_intent, make_messages
+from chat_bot import ChatBot
+from intent_matcher import AhoCorasick, IntentMatcher
+from message_analysis import MessageAnalysis
+
+EDGE_CASES = [
+    '',
+    'それを日本語で',
+    'Can you say THAT in JAPANESE?',
+    '失敗が怖いです',              # 複数のトピック（恐怖が優先）
+    '成功したビジネスの戦略',
+    'I am SCARED of failure',
+    'ageing and 2030s future',
+    '日立とヤマハとパナソニック',
+    '松下幸之助の経営',
+    'もっと詳しく教えて',
+    'なるほど、ありがとう',
+    'İstanbul business',          # 小文字化で文字数が変わる文字
+    '①②③ｆｅａｒ',
+]
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return IntentMatcher()
+
+
+def test_matches_legacy_chain(matcher):
+    mismatches = [
+        message for message in EDGE_CASES + make_messages(3000, seed=1)
+        if matcher.analyze(message) != legacy_analyze_question_intent(message)
+        or (matcher.context_from_hits(matcher.match(message)) or 'new_topic') != legacy_context_intent(message)
+    ]
+    assert mismatches == []
+
+
+def test_chatbot_and_message_analysis_use_the_same_rules():
+    bot = ChatBot()
+    for message in EDGE_CASES + make_messages(500, seed=2):
+        analysis = MessageAnalysis(message)
+        assert bot.analyze_question_intent(message) == analysis.intent == legacy_analyze_question_intent(message)
+        assert analysis.context_intent == legacy_context_intent(message)
+
+
+def test_aho_corasick_matches_naive_substring_search():
+    rng = random.Random(0)
+    alphabet = 'abcあいう'
+    for _ in range(300):
+        patterns = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        automaton = AhoCorasick((pattern, i) for i, pattern in enumerate(patterns))
+
+        assert automaton.find_labels(text) == {i for i, pattern in enumerate(patterns) if pattern in text}
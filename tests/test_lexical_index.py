@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""文字n-gram BM25・RRFと、ハイブリッド検索での統合"""
+
+import os
+
+import numpy as np
+import pytest
+
+from build_faiss_index import write_artifacts
+from conftest import FakeEncoder
+from faiss_vector_store import FAISSVectorStore
+from lexical_index import CharNgramBM25, char_ngrams, reciprocal_rank_fusion
+
+# 固有名詞を含むチャンク（ID -> テキスト）。ID 250 以降は b.pdf
+PROPER_NOUNS = {
+    17: 'ヤマハは楽器からオートバイまで手がける。',
+    42: '日立の社会イノベーション事業について。',
+    260: 'ヤマハ発動機の海外戦略を考える。',
+    300: '3C分析（Customer, Competitor, Company）の基本。',
+}
+
+
+def _texts():
+    texts = [f"チャンク{i}の本文です。経営と戦略の一般的な話題。" for i in range(400)]
+    for doc_id, text in PROPER_NOUNS.items():
+        texts[doc_id] = text
+    return texts
+
+
+@pytest.fixture
+def open_store(tmp_path, no_embedding_model):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((400, 32)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = _texts()
+    metadata = [{'source': 'a.pdf' if i < 250 else 'b.pdf', 'page': i // 10 + 1, 'len': len(text)}
+                for i, text in enumerate(texts)]
+    write_artifacts(vectors, texts, metadata, str(tmp_path))
+
+    def open_store(**kwargs):
+        store = FAISSVectorStore(index_path=os.path.join(tmp_path, 'faiss_index_ip.faiss'),
+                                 meta_path=os.path.join(tmp_path, 'faiss_meta.json'),
+                                 texts_path=os.path.join(tmp_path, 'faiss_texts.jsonl'), **kwargs)
+        store.embedding_model = FakeEncoder(32)
+        return store
+    return open_store
+
+
+def test_char_ngrams_skip_single_character_tokens():
+    assert char_ngrams('ＡＢＣ | 川') == ['ab', 'bc', 'abc']
+
+
+def test_bm25_finds_exact_proper_nouns():
+    index = CharNgramBM25(_texts())
+    scores, ids = index.search('ヤマハ', k=10)
+
+    assert sorted(ids.tolist()) == [17, 260]
+    assert np.all(np.diff(scores) <= 0)
+    assert index.search('日立', k=10)[1].tolist() == [42]
+    # NFKC正規化と小文字化で全角・大文字の表記揺れも一致する
+    assert index.search('３ｃ', k=10)[1].tolist() == [300]
+    assert len(index.search('存在しない語', k=10)[1]) == 0
+
+
+def test_bm25_id_ranges():
+    index = CharNgramBM25(_texts())
+    assert index.search('ヤマハ', k=10, id_ranges=[(250, 400)])[1].tolist() == [260]
+    assert len(index.search('ヤマハ', k=10, id_ranges=[(0, 10), (100, 250)])[1]) == 0
+
+
+def test_extended_equals_full_build():
+    texts = _texts()
+    full = CharNgramBM25(texts)
+    extended = CharNgramBM25(texts[:250]).extended(texts[250:300]).extended(texts[300:])
+
+    assert extended.vocabulary == full.vocabulary
+    for name in ('doc_lengths', 'term_offsets', 'posting_docs', 'posting_tfs'):
+        np.testing.assert_array_equal(getattr(extended, name), getattr(full, name))
+    np.testing.assert_allclose(extended.posting_weights, full.posting_weights, rtol=1e-6)
+    for query in ('ヤマハ', '日立', '経営と戦略'):
+        np.testing.assert_array_equal(extended.search(query, k=20)[1], full.search(query, k=20)[1])
+
+
+def test_extended_does_not_change_original():
+    index = CharNgramBM25(_texts()[:10])
+    extended = index.extended(['ヤマハの新製品。', ''])
+
+    assert index.doc_count == 10 and extended.doc_count == 12
+    assert len(index.search('ヤマハ', k=10)[1]) == 0
+    assert extended.search('ヤマハ', k=10)[1].tolist() == [10]
+    assert CharNgramBM25([]).extended(['ヤマハ']).search('ヤマハ')[1].tolist() == [0]
+
+
+def test_reciprocal_rank_fusion_ordering():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], k=60)
+
+    # 両方の結果に含まれるドキュメントが上位になり、片方だけのものは順位の高い順に続く
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2, 4]
+    scores = dict(fused)
+    assert scores[1] == pytest.approx(1 / 61 + 1 / 63)
+    assert scores[3] == pytest.approx(1 / 63 + 1 / 61)
+    assert scores[2] == pytest.approx(1 / 62) and scores[4] == pytest.approx(1 / 62)
+
+    # 両方で2位のドキュメントは、片方だけで1位のドキュメントより上になる（同じスコアは先の結果の順）
+    fused = reciprocal_rank_fusion([[5, 6, 7], [8, 6]], k=1)
+    assert [doc_id for doc_id, _ in fused] == [6, 5, 8, 7]
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_hybrid_search_recalls_proper_nouns(open_store):
+    vector_only = open_store()
+    hybrid = open_store(hybrid=True)
+
+    # ランダムな埋め込みでは固有名詞のチャンクは上位に来ないが、n-gramの一致で拾える
+    assert not {17, 260} & {doc['index'] for doc in vector_only.search_similar('ヤマハ', n_results=5)}
+    results = hybrid.search_similar('ヤマハ', n_results=5)
+    assert {17, 260} <= {doc['index'] for doc in results}
+    assert [doc['rrf_score'] for doc in results] == sorted((doc['rrf_score'] for doc in results), reverse=True)
+
+
+def test_lexical_only_hits_have_no_distance(open_store):
+    store = open_store(hybrid=True)
+    results = store.search_similar('日立', n_results=25)
+    by_index = {doc['index']: doc for doc in results}
+
+    # ベクトル検索の候補（上位20件）に入らないチャンクは、ベクトル類似度を持たない
+    dense_ids = set(store._search_index(store._encode_queries(['日立']), store._candidate_count(25))[1][0])
+    assert 42 in by_index and 42 not in dense_ids
+    assert by_index[42]['distance'] is None
+    assert by_index[42]['lexical_score'] > 0
+    assert all(doc['distance'] is not None for doc in results if doc['index'] in dense_ids)
+
+
+def test_hybrid_filters_apply_to_lexical_hits(open_store):
+    store = open_store(hybrid=True)
+
+    results = store.search_similar('ヤマハ', n_results=10, source='b.pdf')
+    assert 260 in {doc['index'] for doc in results}
+    assert all(doc['source'] == 'b.pdf' for doc in results)
+
+    results = store.search_similar('ヤマハ', n_results=10, source='a.pdf', page_range=(3, 5))
+    assert 17 not in {doc['index'] for doc in results}
+    assert all(doc['source'] == 'a.pdf' and 3 <= doc['page'] <= 5 for doc in results)
+
+
+def test_appended_documents_are_found_by_lexical_search(open_store):
+    store = open_store(hybrid=True)
+    store.add_documents([{'text': '日立製作所の事業再編。', 'source': 'c.pdf', 'page': 1}])
+
+    assert store.lexical_index.doc_count == 401
+    assert {42, 400} <= {doc['index'] for doc in store.search_similar('日立', n_results=5)}
+    assert [doc['index'] for doc in store.search_similar('日立', n_results=5, source='c.pdf')] == [400]
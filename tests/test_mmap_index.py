@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""MmapFlatIndex と faiss.IndexFlatIP の検索結果の一致"""
+
+import faiss
+import numpy as np
+import pytest
+
+from faiss_vector_store import MmapFlatIndex
+
+
+@pytest.fixture
+def flat_index(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16)).astype('float32')
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(16)
+    index.add(vectors)
+    path = str(tmp_path / 'faiss_index_ip.faiss')
+    faiss.write_index(index, path)
+    return index, path, vectors
+
+
+@pytest.mark.parametrize('k', [1, 5, 50, 60])
+def test_search_matches_index_flat_ip(flat_index, k):
+    index, path, vectors = flat_index
+    mmap_index = MmapFlatIndex(path)
+    queries = vectors[:4] + 0.01
+
+    expected_distances, expected_indices = index.search(queries, k)
+    distances, indices = mmap_index.search(queries, k)
+
+    assert distances.shape == indices.shape == (4, k)
+    np.testing.assert_array_equal(indices, expected_indices)
+    valid = expected_indices >= 0
+    np.testing.assert_allclose(distances[valid], expected_distances[valid], rtol=1e-5)
+    # ベクトル数を超える分は -1 と -inf
+    assert np.all(distances[~valid] == -np.inf)
+
+
+def test_search_ranges_pads_to_k(flat_index):
+    _, path, vectors = flat_index
+    distances, indices = MmapFlatIndex(path).search_ranges(vectors[:2], 5, [(10, 13)])
+
+    assert indices.shape == (2, 5)
+    assert set(indices[0, :3]) == {10, 11, 12}
+    assert np.all(indices[:, 3:] == -1)
+    assert np.all(distances[:, 3:] == -np.inf)
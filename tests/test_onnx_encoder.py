@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""OnnxEncoder の平均プーリングと、parity_check の一致率"""
+
+import numpy as np
+import pytest
+
+from conftest import FakeEncoder
+from onnx_encoder import OnnxEncoder, parity_check
+
+DIM = 8
+VOCAB = 64
+TEXTS = ['戦略', '日本の教育改革について', 'AI', 'グローバル化と企業経営', 'a']
+
+
+class CharTokenizer:
+    """1文字を1トークンにする transformers のトークナイザー互換の最小実装（右側をパディング）"""
+
+    def __call__(self, texts, padding=True, truncation=True, max_length=512, return_tensors='np'):
+        ids = [[1 + ord(char) % (VOCAB - 1) for char in text][:max_length] for text in texts]
+        length = max(len(row) for row in ids)
+        input_ids = np.zeros((len(ids), length), dtype='int64')
+        attention_mask = np.zeros((len(ids), length), dtype='int64')
+        for i, row in enumerate(ids):
+            input_ids[i, :len(row)] = row
+            attention_mask[i, :len(row)] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+
+class ReferenceEncoder:
+    """トークンの埋め込みの平均（OnnxEncoder と同じ計算をnumpyで行う基準）"""
+
+    def __init__(self, table, max_length=512):
+        self.table = table
+        self.tokenizer = CharTokenizer()
+        self.max_length = max_length
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True):
+        vectors = []
+        for text in texts:
+            ids = self.tokenizer([text], max_length=self.max_length)['input_ids'][0]
+            vectors.append(self.table[ids].mean(axis=0))
+        vectors = np.stack(vectors).astype('float32')
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+@pytest.fixture
+def table():
+    return np.random.default_rng(0).standard_normal((VOCAB, DIM)).astype('float32')
+
+
+@pytest.fixture
+def encoder(table):
+    """
+    トークンIDの埋め込みを引くだけのONNXモデル（最終層の隠れ状態の代わり）を使う OnnxEncoder
+
+    トークナイザーとモデルの読み込み（__init__）は transformers と書き出し済みのモデルが必要なため、
+    セッションとトークナイザーを直接設定する
+    """
+    pytest.importorskip('onnx')
+    ort = pytest.importorskip('onnxruntime')
+    from onnx import TensorProto, helper, numpy_helper
+
+    graph = helper.make_graph(
+        [helper.make_node('Gather', ['table', 'input_ids'], ['last_hidden_state'], axis=0)],
+        'embedding_lookup',
+        [helper.make_tensor_value_info('input_ids', TensorProto.INT64, ['batch', 'sequence']),
+         helper.make_tensor_value_info('attention_mask', TensorProto.INT64, ['batch', 'sequence'])],
+        [helper.make_tensor_value_info('last_hidden_state', TensorProto.FLOAT, ['batch', 'sequence', DIM])],
+        initializer=[numpy_helper.from_array(table, name='table')])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 14)])
+    model.ir_version = 8
+
+    encoder = object.__new__(OnnxEncoder)
+    encoder.session = ort.InferenceSession(model.SerializeToString(), providers=['CPUExecutionProvider'])
+    encoder.tokenizer = CharTokenizer()
+    encoder.max_length = 512
+    encoder.model_path = '<memory>'
+    return encoder
+
+
+def test_mean_pooling_ignores_padding(encoder, table):
+    # 長さの違う文を同じバッチに入れると短い文はパディングされるが、平均には含めない
+    actual = encoder.encode(TEXTS, batch_size=len(TEXTS))
+    expected = ReferenceEncoder(table).encode(TEXTS, normalize_embeddings=False)
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+    assert encoder.dimension == DIM
+
+
+def test_encode_keeps_input_order_across_batches(encoder):
+    whole = encoder.encode(TEXTS, batch_size=len(TEXTS), normalize_embeddings=True)
+    for batch_size in (1, 2, 3):
+        np.testing.assert_allclose(encoder.encode(TEXTS, batch_size=batch_size, normalize_embeddings=True),
+                                   whole, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(np.linalg.norm(whole, axis=1), 1.0, rtol=1e-5)
+
+
+def test_encode_single_string_and_empty_list(encoder):
+    single = encoder.encode('戦略')
+    assert single.shape == (DIM,)
+    np.testing.assert_allclose(single, encoder.encode(['戦略'])[0])
+    assert encoder.encode([]).shape == (0, DIM)
+
+
+def test_onnx_encoder_parity_with_reference(encoder, table):
+    parity = parity_check(ReferenceEncoder(table), encoder, TEXTS, batch_size=2)
+
+    assert parity['count'] == len(TEXTS)
+    assert parity['cosine_min'] == pytest.approx(1.0, abs=1e-5)
+    assert parity['top1_agreement'] == 1.0
+
+
+def test_parity_check_detects_mismatch(table):
+    reference = ReferenceEncoder(table)
+    identical = parity_check(reference, ReferenceEncoder(table.copy()), TEXTS)
+    assert identical['cosine_min'] == pytest.approx(1.0, abs=1e-6)
+    assert identical['cosine_mean'] == pytest.approx(1.0, abs=1e-6)
+
+    noisy_table = table + np.random.default_rng(1).standard_normal(table.shape).astype('float32') * 0.05
+    noisy = parity_check(reference, ReferenceEncoder(noisy_table), TEXTS)
+    assert 0.9 < noisy['cosine_min'] < 1.0
+    assert noisy['cosine_min'] <= noisy['cosine_mean'] < 1.0
+
+    unrelated = parity_check(reference, FakeEncoder(DIM), TEXTS)
+    assert unrelated['cosine_mean'] < 0.9
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""QueryBatcher の同時検索の集約と、エラー・close・fork後の動作"""
+
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from query_batcher import QueryBatcher
+
+
+class StubStore:
+    """クエリと条件をそのまま結果に入れて返すストア（search_similar_batch の呼び出しを記録する）"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batch_calls = []
+        self.direct_calls = []
+        self._lock = threading.Lock()
+
+    def _result(self, query, n_results, source, page_range):
+        return [{'content': f"{query}:{rank}", 'source': source, 'page_range': page_range}
+                for rank in range(n_results)]
+
+    def search_similar(self, query, n_results=5, source=None, page_range=None):
+        with self._lock:
+            self.direct_calls.append(query)
+        return self._result(query, n_results, source, page_range)
+
+    def search_similar_batch(self, queries, n_results=5, batch_size=32, source=None, page_range=None):
+        with self._lock:
+            self.batch_calls.append((list(queries), n_results, source, page_range))
+        if self.fail:
+            raise RuntimeError('index error')
+        return [self._result(query, n_results, source, page_range) for query in queries]
+
+    def get_statistics(self):
+        return {'total_vectors': 0}
+
+
+def _search_concurrently(batcher, requests):
+    """requests（(query, n_results, source, page_range)）を同時に検索し、同じ順序の結果を返す"""
+    results = [None] * len(requests)
+    barrier = threading.Barrier(len(requests))
+
+    def worker(i):
+        query, n_results, source, page_range = requests[i]
+        barrier.wait()
+        results[i] = batcher.search_similar(query, n_results=n_results, source=source, page_range=page_range)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    return results
+
+
+REQUESTS = [(f"質問{i}", 1 + i % 3, 'a.pdf' if i % 2 else None, (1, 10) if i % 4 == 0 else None)
+            for i in range(12)]
+
+
+def test_concurrent_callers_get_their_own_results():
+    store = StubStore()
+    batcher = QueryBatcher(store, window_ms=200, max_batch_size=len(REQUESTS))
+    results = _search_concurrently(batcher, REQUESTS)
+
+    for (query, n_results, source, page_range), result in zip(REQUESTS, results):
+        assert result == store._result(query, n_results, source, page_range)
+
+
+def test_concurrent_queries_are_batched_by_condition():
+    store = StubStore()
+    batcher = QueryBatcher(store, window_ms=200, max_batch_size=len(REQUESTS))
+    _search_concurrently(batcher, REQUESTS)
+
+    # 同じ件数・絞り込み条件のクエリは1回の search_similar_batch にまとまる
+    conditions = {(n_results, source, page_range) for _, n_results, source, page_range in REQUESTS}
+    assert len(store.batch_calls) == len(conditions) < len(REQUESTS)
+    assert sorted(query for queries, *_ in store.batch_calls for query in queries) == \
+        sorted(query for query, *_ in REQUESTS)
+    assert store.direct_calls == []
+
+    batching = batcher.get_statistics()['batching']
+    assert batching['queries'] == len(REQUESTS)
+    assert batching['batches'] == 1
+    assert batching['max_observed_batch_size'] == len(REQUESTS)
+
+
+def test_max_batch_size_splits_batches():
+    store = StubStore()
+    batcher = QueryBatcher(store, window_ms=200, max_batch_size=4)
+    requests = [(f"質問{i}", 3, None, None) for i in range(8)]
+    results = _search_concurrently(batcher, requests)
+
+    assert all(len(queries) <= 4 for queries, *_ in store.batch_calls)
+    assert batcher.get_statistics()['batching']['max_observed_batch_size'] <= 4
+    assert results == [store._result(query, 3, None, None) for query, *_ in requests]
+
+
+def test_batch_error_wakes_every_waiter_with_empty_result():
+    store = StubStore(fail=True)
+    batcher = QueryBatcher(store, window_ms=200, max_batch_size=len(REQUESTS))
+
+    assert _search_concurrently(batcher, REQUESTS) == [[] for _ in REQUESTS]
+    # エラーの後も集約スレッドは動き続ける
+    store.fail = False
+    assert batcher.search_similar('次の質問', n_results=2) == store._result('次の質問', 2, None, None)
+
+
+def test_close_falls_back_to_direct_search():
+    store = StubStore()
+    batcher = QueryBatcher(store, window_ms=200, max_batch_size=4)
+    batcher.close()
+
+    assert batcher.search_similar('質問', n_results=2, source='a.pdf') == store._result('質問', 2, 'a.pdf', None)
+    assert store.direct_calls == ['質問'] and store.batch_calls == []
+
+
+@pytest.mark.parametrize('window_ms, max_batch_size', [(0, 16), (5, 1)])
+def test_disabled_batching_searches_directly(window_ms, max_batch_size):
+    store = StubStore()
+    batcher = QueryBatcher(store, window_ms=window_ms, max_batch_size=max_batch_size)
+    batcher.search_similar('質問')
+
+    assert store.direct_calls == ['質問'] and store.batch_calls == []
+    assert batcher._dispatcher is None
+
+
+def test_attributes_are_delegated_to_store():
+    store = StubStore()
+    batcher = QueryBatcher(store)
+    assert batcher.batch_calls is store.batch_calls
+    assert batcher.get_statistics()['total_vectors'] == 0
+
+
+def _search_in_child(batcher):
+    result = batcher.search_similar('子プロセスの質問', n_results=1)
+    os._exit(0 if result and result[0]['content'] == '子プロセスの質問:0' else 1)
+
+
+def test_dispatcher_is_recreated_after_fork():
+    # gunicornのマスターで集約スレッドを起動してからforkした場合も、ワーカーで作り直して応答する
+    batcher = QueryBatcher(StubStore(), window_ms=1, max_batch_size=4)
+    batcher.search_similar('親プロセスの質問')
+    parent_dispatcher = batcher._dispatcher
+
+    child = multiprocessing.get_context('fork').Process(target=_search_in_child, args=(batcher,))
+    child.start()
+    child.join(timeout=10)
+    if child.is_alive():
+        child.kill()
+    assert child.exitcode == 0
+    assert batcher._dispatcher is parent_dispatcher
+
+
+def test_dispatcher_is_recreated_when_pid_changes(monkeypatch):
+    batcher = QueryBatcher(StubStore(), window_ms=1, max_batch_size=4)
+    batcher.search_similar('質問')
+    dispatcher, requests = batcher._dispatcher, batcher._queue
+
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    assert batcher.search_similar('質問', n_results=1) == [{'content': '質問:0', 'source': None,
+                                                          'page_range': None}]
+    assert batcher._dispatcher is not dispatcher and batcher._queue is not requests
+    assert batcher._pid == pid + 1
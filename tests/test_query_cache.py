@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""クエリ埋め込みキャッシュのLRU・有効期間・キーの正規化と、FAISSVectorStore._encode_queries での利用"""
+
+import os
+
+import numpy as np
+import pytest
+
+import query_cache
+from conftest import FakeEncoder
+from faiss_vector_store import FAISSVectorStore
+from query_cache import QueryEmbeddingCache, normalize_query
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(query_cache.time, 'monotonic', clock)
+    return clock
+
+
+class CountingEncoder(FakeEncoder):
+    """encode に渡されたテキストを記録するエンコーダー"""
+
+    def __init__(self, dim):
+        super().__init__(dim)
+        self.calls = []
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True):
+        self.calls.append(list(texts))
+        return super().encode(texts, batch_size, normalize_embeddings)
+
+
+@pytest.fixture
+def store(artifacts, no_embedding_model):
+    directory, vectors = artifacts
+    store = FAISSVectorStore(index_path=os.path.join(directory, 'faiss_index_ip.faiss'),
+                             meta_path=os.path.join(directory, 'faiss_meta.json'),
+                             texts_path=os.path.join(directory, 'faiss_texts.jsonl'))
+    store.embedding_model = CountingEncoder(vectors.shape[1])
+    return store
+
+
+def _vector(value):
+    return np.full(4, value, dtype='float32')
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = QueryEmbeddingCache(max_size=2, ttl_seconds=None)
+    cache.put('a', _vector(1))
+    cache.put('b', _vector(2))
+    assert cache.get('a') is not None
+    cache.put('c', _vector(3))
+
+    # 最後の利用が古い 'b' が削除される
+    assert cache.get('b') is None
+    assert cache.get('a')[0] == 1 and cache.get('c')[0] == 3
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = QueryEmbeddingCache(max_size=10, ttl_seconds=60)
+    cache.put('a', _vector(1))
+    clock.now += 60
+    assert cache.get('a') is not None
+
+    clock.now += 1
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert cache.stats()['expirations'] == 1
+
+    # 上書きすると保存時刻も更新される
+    cache.put('b', _vector(2))
+    clock.now += 50
+    cache.put('b', _vector(3))
+    clock.now += 50
+    assert cache.get('b')[0] == 3
+
+
+def test_zero_size_disables_cache():
+    cache = QueryEmbeddingCache(max_size=0)
+    cache.put('a', _vector(1))
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_hit_rate_stats(clock):
+    cache = QueryEmbeddingCache(max_size=10)
+    assert cache.stats()['hit_rate'] == 0.0
+    cache.put('a', _vector(1))
+    for key in ('a', 'a', 'a', 'b'):
+        cache.get(key)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (3, 1, 1)
+    assert stats['hit_rate'] == pytest.approx(0.75)
+
+    # clear してもカウンタは残る
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()['hits'] == 3
+
+
+@pytest.mark.parametrize('text', ['ＡＩ戦略', ' AI戦略 ', 'AI戦略', 'ＡＩ戦略　'])
+def test_normalize_query_width_and_whitespace(text):
+    assert normalize_query(text) == 'AI戦略'
+
+
+def test_normalize_query_collapses_inner_whitespace():
+    assert normalize_query('日本の　 教育\n改革') == '日本の 教育 改革'
+    assert normalize_query('ｶﾀｶﾅ') == 'カタカナ'
+
+
+def test_encode_queries_uses_normalized_keys(store):
+    first = store._encode_queries(['ＡＩ戦略とは'])
+    second = store._encode_queries(['AI戦略とは  '])
+
+    assert store.embedding_model.calls == [['query: AI戦略とは']]
+    np.testing.assert_array_equal(first, second)
+    assert store.query_cache.stats()['hits'] == 1
+
+
+def test_encode_queries_dedups_within_batch(store):
+    store._encode_queries(['経営'])
+    embeddings = store._encode_queries(['教育', '経営', '教 育', '教育', 'ＡＩ'])
+
+    # キャッシュにないクエリだけを、重複を除いて1回のencodeで計算する
+    assert store.embedding_model.calls[-1] == ['query: 教育', 'query: 教 育', 'query: AI']
+    assert embeddings.shape == (5, 32)
+    np.testing.assert_array_equal(embeddings[0], embeddings[3])
+    np.testing.assert_array_equal(embeddings[1], store._encode_queries(['経営'])[0])
+    assert len(store.embedding_model.calls) == 2
+
+
+def test_cached_embeddings_are_not_shared_with_callers(store):
+    embeddings = store._encode_queries(['経営'])
+    embeddings[0] = 0.0
+    assert np.any(store._encode_queries(['経営'])[0] != 0.0)
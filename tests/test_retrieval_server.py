@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""検索デーモンのプロトコルとソケット"""
+
+import json
+import math
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+from retrieval_server import (DEFAULT_SOCKET_MODE, OP_SEARCH, RetrievalClient, RetrievalServer,
+                              decode_documents, encode_documents, encode_request, read_request)
+
+DOCUMENTS = [
+    {'content': '大前研一の著作より。絵文字🙂も含む', 'source': 'omae_kenichi_01.pdf', 'page': 12,
+     'citations': [{'source': 'omae_kenichi_02.pdf', 'page': 3}], 'distance': 0.75, 'index': 42},
+    {'content': '', 'source': '', 'page': '', 'citations': [], 'distance': -0.5, 'index': 0,
+     'lexical_score': 1.25, 'rrf_score': 0.03125},
+]
+
+
+class StubStore:
+    def search_similar(self, query, n_results=5, source=None, page_range=None):
+        self.last_call = (query, n_results, source, page_range)
+        return DOCUMENTS[:n_results]
+
+    def get_statistics(self):
+        return {'total_vectors': 2}
+
+
+def test_documents_round_trip():
+    decoded = decode_documents(encode_documents(DOCUMENTS))
+
+    assert decoded == DOCUMENTS
+    assert decode_documents(encode_documents([])) == []
+
+
+def test_large_citations_round_trip():
+    # 重複除去で多数のチャンクを統合すると、citationsのJSONが64KBを超えることがある
+    citations = [{'source': f"omae_kenichi_{i % 40:02d}.pdf", 'page': i} for i in range(5000)]
+    documents = [dict(DOCUMENTS[0], citations=citations), DOCUMENTS[1]]
+    assert len(json.dumps(citations, ensure_ascii=False).encode('utf-8')) > 65535
+
+    assert decode_documents(encode_documents(documents)) == documents
+
+
+def test_missing_scores_are_omitted():
+    decoded = decode_documents(encode_documents([{'content': 'a', 'distance': None}]))
+
+    assert math.isnan(decoded[0]['distance'])
+    assert 'lexical_score' not in decoded[0] and 'rrf_score' not in decoded[0]
+
+
+@pytest.mark.parametrize('source, page_range', [(None, None), ('omae_kenichi_01.pdf', (10, 50)), ('本', (0, 0))])
+def test_request_round_trip(source, page_range):
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(encode_request(OP_SEARCH, '戦略的思考とは？', 7, source, page_range))
+        request = read_request(right)
+
+    assert request == {'op': OP_SEARCH, 'query': '戦略的思考とは？', 'n_results': 7,
+                       'source': source, 'page_range': page_range}
+
+
+@pytest.fixture
+def socket_path():
+    # Unixソケットのパス長の上限（約108バイト）を超えないよう短いパスにする
+    path = f"/tmp/omae_test_{os.getpid()}.sock"
+    yield path
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_server_and_client(socket_path):
+    store = StubStore()
+    server = RetrievalServer(socket_path, store)
+    _serve(server)
+    try:
+        client = RetrievalClient(socket_path)
+        assert client.search_similar('質問', n_results=1, source='a.pdf', page_range=(1, 2)) == DOCUMENTS[:1]
+        assert store.last_call == ('質問', 1, 'a.pdf', (1, 2))
+        assert client.get_statistics()['total_vectors'] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_socket_is_not_world_accessible(socket_path):
+    server = RetrievalServer(socket_path, StubStore())
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == DEFAULT_SOCKET_MODE == 0o660
+    finally:
+        server.server_close()
+
+    server = RetrievalServer(socket_path, StubStore(), mode=0o600, group=str(os.getgid()))
+    try:
+        info = os.stat(socket_path)
+        assert stat.S_IMODE(info.st_mode) == 0o600
+        assert info.st_gid == os.getgid()
+    finally:
+        server.server_close()
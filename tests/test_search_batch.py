@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""search_similar_batch が1件ずつの search_similar と同じ結果を返すこと"""
+
+import os
+
+import faiss
+import pytest
+
+from ann_index import ann_index_path, build_ann_index
+from conftest import FakeEncoder
+from faiss_vector_store import FAISSVectorStore
+
+QUERIES = ['経営戦略', '日本の教育', 'グローバル化', 'チャンク12', '経営戦略', 'ＡＩの未来']
+
+
+@pytest.fixture
+def open_store(artifacts, no_embedding_model):
+    directory, vectors = artifacts
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+
+    def open_store(index_type='flat', **kwargs):
+        if index_type != 'flat':
+            faiss.write_index(build_ann_index(vectors, index_type), ann_index_path(flat_path, index_type))
+        store = FAISSVectorStore(index_path=flat_path,
+                                 meta_path=os.path.join(directory, 'faiss_meta.json'),
+                                 texts_path=os.path.join(directory, 'faiss_texts.jsonl'),
+                                 index_type=index_type, **kwargs)
+        store.embedding_model = FakeEncoder(vectors.shape[1])
+        return store
+    return open_store
+
+
+def _assert_batch_matches(store, **kwargs):
+    batch = store.search_similar_batch(QUERIES, batch_size=4, **kwargs)
+    single = [store.search_similar(query, **kwargs) for query in QUERIES]
+
+    assert len(batch) == len(QUERIES)
+    for batch_docs, single_docs in zip(batch, single):
+        assert [doc['index'] for doc in batch_docs] == [doc['index'] for doc in single_docs]
+        for batch_doc, single_doc in zip(batch_docs, single_docs):
+            assert batch_doc.keys() == single_doc.keys()
+            for key, value in single_doc.items():
+                if isinstance(value, float):
+                    assert batch_doc[key] == pytest.approx(value, abs=1e-5)
+                else:
+                    assert batch_doc[key] == value
+    return batch
+
+
+FILTERS = [
+    {},
+    {'n_results': 8},
+    {'source': 'b.pdf'},
+    {'page_range': (3, 7)},
+    {'source': 'a.pdf', 'page_range': (20, 30)},
+]
+
+
+@pytest.mark.parametrize('hybrid', [False, True])
+@pytest.mark.parametrize('kwargs', FILTERS)
+def test_batch_matches_single_queries(open_store, hybrid, kwargs):
+    batch = _assert_batch_matches(open_store(hybrid=hybrid), **kwargs)
+    assert all(batch)
+
+
+@pytest.mark.parametrize('index_type', ['ivf', 'hnsw', 'sq8', 'pq'])
+def test_batch_matches_single_queries_for_ann_indexes(open_store, index_type):
+    store = open_store(index_type, nprobe=2, ef_search=16)
+    for kwargs in FILTERS:
+        _assert_batch_matches(store, **kwargs)
+
+
+@pytest.mark.parametrize('hybrid', [False, True])
+def test_batch_matches_single_queries_with_appended_documents(open_store, hybrid):
+    store = open_store(hybrid=hybrid)
+    store.add_documents([{'text': f"追加の本文{i}。経営戦略について。", 'source': 'c.pdf', 'page': i}
+                         for i in range(1, 11)])
+
+    for kwargs in FILTERS + [{'source': 'c.pdf'}, {'source': 'c.pdf', 'page_range': (2, 4)}]:
+        _assert_batch_matches(store, **kwargs)
+
+    batch = store.search_similar_batch(QUERIES, source='c.pdf', page_range=(2, 4))
+    assert all({doc['index'] for doc in docs} == {401, 402, 403} for docs in batch)
+
+
+def test_batch_with_no_matching_filter(open_store):
+    store = open_store()
+    assert store.search_similar_batch(QUERIES, source='missing.pdf') == [[] for _ in QUERIES]
+    assert store.search_similar_batch([]) == []
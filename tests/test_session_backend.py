@@ -0,0 +1,240 @@
+"""SQLiteSessionBackend の上限・有効期間・障害時の復帰と、複数プロセスでのセッションの共有"""
+
+import os
+import runpy
+import sqlite3
+import multiprocessing
+
+import pytest
+
+import session_backend
+from session_backend import SQLiteSessionBackend, create_session_backend_from_env
+from session_state import EMPTY_STATE, SessionStateStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeTime:
+    """session_backend.time.time の代わりに進める時刻"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(session_backend.time, 'time', fake)
+    return fake
+
+
+def _backend(tmp_path, **kwargs):
+    return SQLiteSessionBackend(str(tmp_path / 'sessions.sqlite3'), **kwargs)
+
+
+def _add(backend, session_id, message, response='回答'):
+    return backend.update(session_id, lambda state: state.add_turn(message, response))
+
+
+def test_sessions_are_isolated(tmp_path):
+    backend = _backend(tmp_path)
+    _add(backend, 'a', 'aの質問1')
+    _add(backend, 'b', 'bの質問1')
+    _add(backend, 'a', 'aの質問2')
+
+    assert [entry['message'] for entry in backend.get('a').history] == ['aの質問1', 'aの質問2']
+    assert [entry['message'] for entry in backend.get('b').history] == ['bの質問1']
+    assert backend.get('unknown') is EMPTY_STATE
+    assert backend.get(None) is EMPTY_STATE
+
+
+def test_eviction_keeps_total_bytes_under_limit(tmp_path, clock):
+    backend = _backend(tmp_path, max_bytes=2000, ttl_seconds=None)
+    for i in range(20):
+        clock.now += 1
+        _add(backend, f"session-{i}", f"質問{i}", 'あ' * 100)
+
+    stats = backend.stats()
+    assert stats['total_bytes'] <= 2000
+    assert stats['evictions'] > 0
+    assert stats['sessions'] == len(backend) < 20
+    # 最後に更新したセッションは残り、古いものから削除される
+    assert backend.get('session-19').history
+    assert backend.get('session-0') is EMPTY_STATE
+
+
+def test_updated_session_is_kept_even_if_larger_than_limit(tmp_path, clock):
+    backend = _backend(tmp_path, max_bytes=100, ttl_seconds=None)
+    _add(backend, 'old', '質問')
+    clock.now += 1
+    _add(backend, 'large', '質問', 'あ' * 500)
+
+    assert backend.get('old') is EMPTY_STATE
+    assert backend.get('large').history
+    assert len(backend) == 1
+
+
+def test_expired_sessions_are_not_returned_and_removed(tmp_path, clock):
+    backend = _backend(tmp_path, ttl_seconds=60)
+    _add(backend, 'old', '古い質問')
+    clock.now += 30
+    _add(backend, 'recent', '新しい質問')
+
+    clock.now += 40
+    assert backend.get('old') is EMPTY_STATE
+    assert backend.get('recent').history
+
+    # 期限切れのセッションは次の更新時に削除される
+    _add(backend, 'other', '別の質問')
+    stats = backend.stats()
+    assert stats['expirations'] == 1
+    assert stats['sessions'] == 2
+
+    # 期限切れのセッションへの更新は新しいセッションとして始まる
+    clock.now += 100
+    state = _add(backend, 'recent', '続きの質問')
+    assert [entry['message'] for entry in state.history] == ['続きの質問']
+
+
+def test_discard_and_clear(tmp_path):
+    backend = _backend(tmp_path)
+    _add(backend, 'a', '質問')
+    _add(backend, 'b', '質問')
+
+    backend.discard('a')
+    assert backend.get('a') is EMPTY_STATE
+    assert len(backend) == 1
+
+    backend.clear()
+    stats = backend.stats()
+    assert stats['sessions'] == 0
+    assert stats['total_bytes'] == 0
+
+
+def test_default_path_is_under_app_directory():
+    app_dir = os.path.dirname(os.path.abspath(session_backend.__file__))
+    assert os.path.dirname(os.path.dirname(session_backend.DEFAULT_DB_PATH)) == app_dir
+    assert not session_backend.DEFAULT_DB_PATH.startswith('/tmp/')
+
+
+def test_new_directory_and_file_are_private(tmp_path):
+    path = tmp_path / 'sessions' / 'sessions.sqlite3'
+    backend = SQLiteSessionBackend(str(path))
+    _add(backend, 'a', '質問')
+
+    assert os.stat(path.parent).st_mode & 0o777 == 0o700
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+class FailingCommitConnection:
+    """最初の COMMIT だけ失敗する接続"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fail_commit = True
+
+    def execute(self, sql, *args):
+        if sql == 'COMMIT' and self.fail_commit:
+            self.fail_commit = False
+            raise sqlite3.OperationalError('disk I/O error')
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_commit_failure_rolls_back_and_next_update_succeeds(tmp_path, monkeypatch):
+    backend = _backend(tmp_path)
+    connect = backend._connect
+    monkeypatch.setattr(backend, '_connect', lambda: FailingCommitConnection(connect()))
+
+    # 保存に失敗しても応答用の状態は返す
+    state = _add(backend, 'a', '失敗する質問')
+    assert [entry['message'] for entry in state.history] == ['失敗する質問']
+    assert not backend._connection().in_transaction
+    assert backend.get('a') is EMPTY_STATE
+
+    # 同じスレッドの接続で次の更新ができる
+    _add(backend, 'a', '次の質問')
+    assert [entry['message'] for entry in backend.get('a').history] == ['次の質問']
+    assert backend.stats()['total_bytes'] > 0
+
+
+class BrokenConnection(FailingCommitConnection):
+    """COMMIT も ROLLBACK も失敗する接続"""
+
+    def execute(self, sql, *args):
+        if sql in ('COMMIT', 'ROLLBACK'):
+            raise sqlite3.OperationalError('disk I/O error')
+        return self.conn.execute(sql, *args)
+
+
+def test_connection_is_dropped_if_rollback_also_fails(tmp_path):
+    backend = _backend(tmp_path)
+    backend._local.connection = BrokenConnection(backend._connect())
+    backend._local.pid = os.getpid()
+
+    _add(backend, 'a', '失敗する質問')
+    assert backend._local.connection is None
+
+    _add(backend, 'a', '次の質問')
+    assert [entry['message'] for entry in backend.get('a').history] == ['次の質問']
+
+
+def _converse_in_child(backend, message):
+    _add(backend, 'shared', message)
+
+
+def test_sessions_are_shared_between_processes(tmp_path):
+    # gunicorn の preload_app と同じく、親プロセスで作成したバックエンドをfork後のワーカーで使う
+    backend = _backend(tmp_path)
+    _add(backend, 'shared', '親の質問')
+    context = multiprocessing.get_context('fork')
+
+    messages = ['ワーカー1の質問', 'ワーカー2の質問']
+    for message in messages:
+        worker = context.Process(target=_converse_in_child, args=(backend, message))
+        worker.start()
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    # 別のワーカーの更新した履歴を次のワーカーが引き継いでいる
+    assert [entry['message'] for entry in backend.get('shared').history] == ['親の質問'] + messages
+    assert backend.stats()['sessions'] == 1
+
+
+def test_create_session_backend_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('OMAE_SESSION_DB', str(tmp_path / 'env.sqlite3'))
+    monkeypatch.setenv('OMAE_SESSION_MAX_BYTES', '4096')
+    monkeypatch.setenv('OMAE_SESSION_TTL', '0')
+
+    monkeypatch.setenv('OMAE_SESSION_BACKEND', 'sqlite')
+    backend = create_session_backend_from_env()
+    assert isinstance(backend, SQLiteSessionBackend)
+    assert backend.max_bytes == 4096
+    assert backend.ttl_seconds is None
+
+    monkeypatch.setenv('OMAE_SESSION_BACKEND', 'memory')
+    assert isinstance(create_session_backend_from_env(), SessionStateStore)
+
+    monkeypatch.setenv('OMAE_SESSION_BACKEND', 'redis')
+    with pytest.raises(ValueError):
+        create_session_backend_from_env()
+
+
+def test_gunicorn_config_defaults_to_sqlite_with_multiple_workers(monkeypatch):
+    # 終了時に元の状態（未設定）に戻す
+    monkeypatch.setenv('OMAE_SESSION_BACKEND', 'unset')
+    monkeypatch.delenv('OMAE_SESSION_BACKEND')
+
+    config = runpy.run_path(os.path.join(ROOT, 'gunicorn_config.py'))
+    assert config['workers'] > 1
+    assert os.environ['OMAE_SESSION_BACKEND'] == 'sqlite'
+
+    # 明示した場合はそのまま
+    monkeypatch.setenv('OMAE_SESSION_BACKEND', 'memory')
+    runpy.run_path(os.path.join(ROOT, 'gunicorn_config.py'))
+    assert os.environ['OMAE_SESSION_BACKEND'] == 'memory'
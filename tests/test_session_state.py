@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""セッションごとの会話の状態と、メモリ内のセッションストアの上限・有効期間"""
+
+import pytest
+
+import session_state
+from chat_bot import ChatBot
+from session_state import EMPTY_STATE, ConversationState, SessionStateStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(session_state.time, 'monotonic', clock)
+    return clock
+
+
+def _add(store, session_id, text='質問', response='回答'):
+    return store.update(session_id, lambda state: state.add_turn(text, response))
+
+
+def test_add_turn_keeps_the_last_turns():
+    state = EMPTY_STATE
+    for i in range(12):
+        state = state.add_turn(f"質問{i}", f"回答{i}", max_history=10, keywords=[f"キーワード{i}"])
+
+    assert len(state.history) == 10
+    assert state.history[0]['message'] == '質問2'
+    assert state.history[-1]['keywords'] == ['キーワード11']
+    assert state.last_response == '回答11'
+    assert EMPTY_STATE.history == ()
+
+    repeated = state.add_turn('それを日本語で', '翻訳', remember_response=False)
+    assert repeated.last_response == '回答11'
+    assert ConversationState.from_dict(repeated.to_dict()).to_dict() == repeated.to_dict()
+
+
+def test_update_state_does_not_remember_repeat_answers():
+    bot = ChatBot()
+    state = bot.update_state(EMPTY_STATE, 'What is business strategy?', {'response': 'Strategy is ...'})
+    state = bot.update_state(state, 'Can you say that in Japanese?', {'response': '戦略とは...'})
+
+    assert state.last_response == 'Strategy is ...'
+    assert [entry['message'] for entry in state.history] == ['What is business strategy?',
+                                                              'Can you say that in Japanese?']
+
+
+def test_sessions_are_isolated(clock):
+    store = SessionStateStore()
+    _add(store, 'a', '質問A')
+    _add(store, 'b', '質問B')
+
+    assert [entry['message'] for entry in store.get('a').history] == ['質問A']
+    assert [entry['message'] for entry in store.get('b').history] == ['質問B']
+    assert store.get('unknown') is EMPTY_STATE
+    assert store.get(None) is EMPTY_STATE
+    # セッションIDがない場合は保存しない
+    assert len(_add(store, None).history) == 1
+    assert len(store) == 2
+
+
+def test_evicts_least_recently_used_sessions(clock):
+    one_session = _add(SessionStateStore(), 'probe', response='あ' * 1000).nbytes
+    store = SessionStateStore(max_bytes=one_session * 3)
+    for session_id in ('a', 'b', 'c'):
+        _add(store, session_id, response='あ' * 1000)
+        clock.now += 1
+    store.get('a')   # a を最近使ったセッションにする
+    _add(store, 'd', response='あ' * 1000)
+
+    assert store.get('b') is EMPTY_STATE
+    assert all(store.get(session_id).history for session_id in ('a', 'c', 'd'))
+    stats = store.stats()
+    assert (stats['sessions'], stats['evictions']) == (3, 1)
+    assert stats['total_bytes'] == sum(store.get(session_id).nbytes for session_id in ('a', 'c', 'd'))
+    assert stats['total_bytes'] <= store.max_bytes
+
+
+def test_keeps_the_updated_session_even_if_over_the_limit(clock):
+    store = SessionStateStore(max_bytes=100)
+    _add(store, 'a')
+    state = _add(store, 'b', response='あ' * 1000)
+
+    assert store.get('b') is state
+    assert len(store) == 1
+
+
+def test_expires_sessions_after_ttl(clock):
+    store = SessionStateStore(ttl_seconds=60)
+    _add(store, 'a')
+    _add(store, 'b')
+    clock.now += 59
+    store.get('a')   # 利用すると有効期間が延びる
+    clock.now += 30
+
+    assert store.get('b') is EMPTY_STATE
+    assert store.get('a').history
+    stats = store.stats()
+    assert (stats['sessions'], stats['expirations']) == (1, 1)
+    assert stats['total_bytes'] == store.get('a').nbytes
+
+
+def test_failed_update_keeps_the_previous_state(clock):
+    store = SessionStateStore()
+    state = _add(store, 'a')
+
+    def fail(current):
+        raise RuntimeError('応答生成エラー')
+
+    with pytest.raises(RuntimeError):
+        store.update('a', fail)
+    assert store.get('a') is state
+    assert store.stats()['total_bytes'] == state.nbytes
+
+
+def test_discard_and_clear(clock):
+    store = SessionStateStore()
+    _add(store, 'a')
+    _add(store, 'b')
+    store.discard('a')
+
+    assert store.get('a') is EMPTY_STATE
+    assert store.stats()['total_bytes'] == store.get('b').nbytes
+    store.clear()
+    assert len(store) == 0 and store.stats()['total_bytes'] == 0
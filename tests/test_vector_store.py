@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""FAISSVectorStore の読み込み時の件数の照合"""
+
+import json
+import os
+
+import faiss
+import pytest
+
+from ann_index import ann_index_path, build_ann_index
+from corpus_store import convert_jsonl_corpus
+from dim_reduction import build_reduced_index, make_projection, projection_path, reduced_index_path
+from faiss_vector_store import FAISSVectorStore
+
+
+def _open_store(directory, **kwargs):
+    return FAISSVectorStore(index_path=os.path.join(directory, 'faiss_index_ip.faiss'),
+                            meta_path=os.path.join(directory, 'faiss_meta.json'),
+                            texts_path=os.path.join(directory, 'faiss_texts.jsonl'), **kwargs)
+
+
+def test_consistent_artifacts_load(artifacts, no_embedding_model):
+    directory, vectors = artifacts
+    store = _open_store(directory)
+    assert store.index.ntotal == store._document_count() == len(vectors)
+
+
+def test_texts_count_mismatch_raises(artifacts, no_embedding_model):
+    directory, _ = artifacts
+    texts_path = os.path.join(directory, 'faiss_texts.jsonl')
+    with open(texts_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(texts_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:-1])
+
+    with pytest.raises(ValueError, match='texts=399'):
+        _open_store(directory)
+
+
+def test_metadata_count_mismatch_raises(artifacts, no_embedding_model):
+    directory, _ = artifacts
+    meta_path = os.path.join(directory, 'faiss_meta.json')
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata + metadata[:3], f)
+
+    with pytest.raises(ValueError, match='metadata=403'):
+        _open_store(directory)
+
+
+def test_corpus_count_mismatch_raises(artifacts, no_embedding_model, tmp_path):
+    directory, _ = artifacts
+    corpus_dir = str(tmp_path / 'corpus')
+    convert_jsonl_corpus(os.path.join(directory, 'faiss_texts.jsonl'),
+                         os.path.join(directory, 'faiss_meta.json'), corpus_dir)
+    assert _open_store(directory, corpus_dir=corpus_dir).corpus is not None
+
+    # コーパスだけが古い（チャンク数の異なる）成果物から作られている場合
+    faiss.write_index(faiss.IndexFlatIP(32), os.path.join(directory, 'faiss_index_ip.faiss'))
+    with pytest.raises(ValueError, match='corpus=400'):
+        _open_store(directory, corpus_dir=corpus_dir)
+
+
+@pytest.mark.parametrize('index_type', ['hnsw', 'sq8'])
+def test_stale_ann_index_raises(artifacts, no_embedding_model, index_type):
+    directory, vectors = artifacts
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+    faiss.write_index(build_ann_index(vectors[:300], index_type), ann_index_path(flat_path, index_type))
+
+    with pytest.raises(ValueError, match='flat_index=400'):
+        _open_store(directory, index_type=index_type)
+
+
+def test_stale_reduced_index_raises(artifacts, no_embedding_model):
+    directory, vectors = artifacts
+    flat_path = os.path.join(directory, 'faiss_index_ip.faiss')
+    projection = make_projection(vectors, 'truncate', 16)
+    path = reduced_index_path(flat_path, 'truncate', 16)
+    faiss.write_index(build_reduced_index(vectors[:300], projection), path)
+    projection.save(projection_path(path))
+
+    with pytest.raises(ValueError, match='flat_index=400'):
+        _open_store(directory, reduction='truncate', reduced_dim=16)
+
+    faiss.write_index(build_reduced_index(vectors, projection), path)
+    assert _open_store(directory, reduction='truncate', reduced_dim=16).index.ntotal == 400